@@ -0,0 +1,58 @@
+"""
+人脸扫描子进程入口
+本模块在导入时不依赖 Django，保证 spawn 方式启动的子进程可以安全地反序列化其中的函数；
+子进程在 init_worker 中完成 django.setup() 后才导入模型与服务
+"""
+import os
+import time
+
+def init_worker():
+    """子进程初始化：加载 Django (不启动定时任务调度器)"""
+    # runserver 子进程带有 RUN_MAIN=true，继承后会在每个工作进程里重复启动调度器
+    os.environ.pop('RUN_MAIN', None)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
+
+def decode_photo(row):
+    """
+    解码阶段：读取并解码一张照片 (或视频的多帧)，不访问数据库
+    row: (photo_id, file_path, is_pure_video, is_video, cache_poster)，见 face_scan_rows
+    返回 (photo_id, [(timestamp, image_rgb, original_size), ...] 或 None, 耗时秒数)
+    图像已按 FACE_DETECT_MAX_EDGE 缩小，进程间传输的数组较小
+    """
+    from apps.photos.services.faces import load_face_images
+
+    photo_id, file_path, is_pure_video, is_video, cache_poster = row
+    start = time.perf_counter()
+    try:
+        images = load_face_images(file_path, is_pure_video=is_pure_video, is_video=is_video, cache_poster=cache_poster)
+    except Exception as e:
+        print(f"解码失败 {file_path}: {e}")
+        images = None
+    return photo_id, images, time.perf_counter() - start
+
+def init_face_worker(intra_op_threads):
+    """多进程扫描的子进程初始化：每个进程加载自己的人脸模型 (独立的 ONNX 会话)"""
+    init_worker()
+    from apps.photos.services.faces import get_face_detector
+    get_face_detector(silent=True, intra_op_threads=intra_op_threads)
+
+def detect_photo_chunk(rows):
+    """
+    在子进程中对一批照片解码并推理，不访问数据库
+    rows: [(photo_id, file_path, is_pure_video, is_video, cache_poster), ...]
+    返回 ([(photo_id, [未保存的 Face, ...]), ...], 耗时秒数)，推理失败的照片不在结果中
+    """
+    from apps.photos.services.faces import get_face_detector, load_face_images, detect_faces_in_images
+
+    detector = get_face_detector()
+    start = time.perf_counter()
+    results = []
+    for photo_id, file_path, is_pure_video, is_video, cache_poster in rows:
+        try:
+            images = load_face_images(file_path, is_pure_video=is_pure_video, is_video=is_video, cache_poster=cache_poster)
+            results.append((photo_id, detect_faces_in_images(photo_id, images, detector)))
+        except Exception as e:
+            print(f"人脸检测异常 {photo_id}: {e}")
+    return results, time.perf_counter() - start
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from apps.photos.services.face_clustering import CLUSTER_METHODS, cluster_embeddings, hnswlib
+import numpy as np
+import time
+import tracemalloc
+
+class Command(BaseCommand):
+    help = '在合成的人脸向量簇上对比聚类方法的耗时、峰值内存与聚类质量 (不访问数据库)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--faces', type=int, default=20000, help='合成人脸总数')
+        parser.add_argument('--people', type=int, default=1000, help='合成人物数 (每人人脸数服从长尾分布)')
+        parser.add_argument('--noise', type=float, default=0.1, help='孤立人脸 (不属于任何人物) 的比例')
+        parser.add_argument('--spread', type=float, default=0.022, help='簇内扰动的每维标准差，0.022 时同一人物两张脸的余弦距离约 0.2')
+        parser.add_argument('--threshold', type=float, default=0.3, help='聚类距离阈值')
+        parser.add_argument('--min-samples', type=int, default=2, help='成簇所需最少人脸数')
+        parser.add_argument('--methods', nargs='+', choices=CLUSTER_METHODS, default=CLUSTER_METHODS)
+        parser.add_argument('--dbscan-limit', type=int, default=50000, help='人脸数超过该值时跳过 DBSCAN (全量距离计算)')
+
+    def handle(self, *args, **options):
+        from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+
+        embeddings, truth = self.make_blobs(options)
+        n = len(embeddings)
+        self.stdout.write(
+            f"合成人脸: {n}，人物: {len(set(truth[truth >= 0]))}，孤立人脸: {int((truth < 0).sum())}，"
+            f"近邻索引: {'hnswlib' if hnswlib is not None else '分块精确计算 (未安装 hnswlib)'}\n"
+        )
+        # 孤立人脸各自算作一个真实类别
+        truth_labels = np.where(truth >= 0, truth, -np.arange(1, n + 1))
+
+        self.stdout.write(f"{'方法':<18}{'耗时(s)':>10}{'峰值内存(MB)':>14}{'簇数':>8}{'噪声':>8}{'ARI':>8}{'NMI':>8}")
+        for method in options['methods']:
+            if method == 'dbscan' and n > options['dbscan_limit']:
+                self.stdout.write(f"{method:<18}{'跳过 (人脸数超过 --dbscan-limit)':>30}")
+                continue
+            tracemalloc.start()
+            start = time.perf_counter()
+            labels = cluster_embeddings(
+                embeddings, options['threshold'], min_samples=options['min_samples'], method=method
+            )
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            predicted = np.where(labels >= 0, labels, -np.arange(1, n + 1))
+            self.stdout.write(
+                f"{method:<18}{elapsed:>10.2f}{peak / 1024 / 1024:>14.1f}"
+                f"{len(set(labels[labels >= 0])):>8}{int((labels < 0).sum()):>8}"
+                f"{adjusted_rand_score(truth_labels, predicted):>8.3f}"
+                f"{normalized_mutual_info_score(truth_labels, predicted):>8.3f}"
+            )
+
+    def make_blobs(self, options):
+        """每个人物一个随机单位向量中心，人脸为中心加高斯扰动后归一化；人物大小服从长尾分布"""
+        rng = np.random.default_rng(42)
+        n = options['faces']
+        noise_count = int(n * options['noise'])
+        people = options['people']
+
+        weights = 1.0 / np.arange(1, people + 1)
+        sizes = np.maximum(1, np.round(weights / weights.sum() * (n - noise_count))).astype(int)
+        truth = np.concatenate([np.repeat(np.arange(people), sizes), np.full(noise_count, -1)])
+
+        centers = rng.standard_normal((people + noise_count, 512)).astype(np.float32)
+        centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+        owners = np.where(truth >= 0, truth, people + np.arange(len(truth)) - (len(truth) - noise_count))
+        embeddings = centers[owners] + rng.normal(0, options['spread'], (len(truth), 512)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        order = rng.permutation(len(truth))
+        return embeddings[order], truth[order]
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from apps.photos.models import Photo
+from apps.photos.services.faces import get_face_detector, open_image_for_detection, build_face_objects
+import numpy as np
+import os
+import time
+
+def _iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+class Command(BaseCommand):
+    help = '评估人脸检测输入尺寸 (FACE_DETECT_MAX_EDGE) 对速度与召回率的影响，以原图检测结果为基准'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=30, help='抽样照片数量 (优先选择已检测到人脸的照片)')
+        parser.add_argument('--edges', type=str, default='2560,1920,1280,960', help='待评估的最长边，逗号分隔')
+        parser.add_argument('--min-iou', type=float, default=0.5, help='与基准人脸匹配的最小 IoU')
+
+    def handle(self, *args, **options):
+        edges = [0] + [int(e) for e in options['edges'].split(',') if e.strip()]
+        min_iou = options['min_iou']
+
+        photos = list(
+            Photo.objects.filter(deleted_at__isnull=True, faces__isnull=False, video_path__isnull=True)
+            .distinct().order_by('?').values_list('id', 'file_path')[:options['limit']]
+        )
+        photos = [(pid, path) for pid, path in photos if os.path.exists(path)]
+        if not photos:
+            self.stdout.write(self.style.ERROR("没有可用于评估的照片 (需要先完成一次人脸扫描)。"))
+            return
+
+        self.stdout.write("正在初始化人脸检测模型...")
+        detector = get_face_detector(silent=False)
+        self.stdout.write(f"抽样 {len(photos)} 张照片，最长边: {', '.join('原图' if e == 0 else str(e) for e in edges)}\n")
+
+        results = {edge: {'decode': [], 'infer': [], 'faces': {}} for edge in edges}
+        for photo_id, path in photos:
+            for edge in edges:
+                start = time.perf_counter()
+                img, original_size = open_image_for_detection(path, edge)
+                image_rgb = np.array(img)
+                decoded = time.perf_counter()
+                detections = detector.process(image_rgb)
+                inferred = time.perf_counter()
+                results[edge]['decode'].append((decoded - start) * 1000)
+                results[edge]['infer'].append((inferred - decoded) * 1000)
+                results[edge]['faces'][photo_id] = build_face_objects(photo_id, image_rgb, detections, original_size=original_size)
+
+        baseline = results[0]['faces']
+        total_baseline = sum(len(f) for f in baseline.values())
+        self.stdout.write(
+            f"{'最长边':<8}{'解码(ms)':>10}{'推理(ms)':>10}{'合计(ms)':>10}{'加速':>8}"
+            f"{'人脸数':>8}{'召回率':>8}{'特征相似度':>12}"
+        )
+        base_total = np.mean(results[0]['decode']) + np.mean(results[0]['infer'])
+        for edge in edges:
+            matched, similarities, found = 0, [], 0
+            for photo_id, base_faces in baseline.items():
+                faces = results[edge]['faces'][photo_id]
+                found += len(faces)
+                used = set()
+                for base in base_faces:
+                    best, best_iou = None, min_iou
+                    for i, face in enumerate(faces):
+                        if i in used:
+                            continue
+                        iou = _iou(base.bbox, face.bbox)
+                        if iou >= best_iou:
+                            best, best_iou = i, iou
+                    if best is None:
+                        continue
+                    used.add(best)
+                    matched += 1
+                    a, b = base.get_embedding(), faces[best].get_embedding()
+                    if a is not None and b is not None:
+                        similarities.append(float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12)))
+
+            decode_ms = np.mean(results[edge]['decode'])
+            infer_ms = np.mean(results[edge]['infer'])
+            total_ms = decode_ms + infer_ms
+            recall = matched / total_baseline if total_baseline else 1.0
+            similarity = np.mean(similarities) if similarities else 1.0
+            self.stdout.write(
+                f"{'原图' if edge == 0 else edge:<8}{decode_ms:>10.1f}{infer_ms:>10.1f}{total_ms:>10.1f}"
+                f"{base_total / total_ms:>7.2f}x{found:>8}{recall:>8.1%}{similarity:>12.3f}"
+            )
+        self.stdout.write("\n召回率与特征相似度以原图检测结果为基准；特征相似度过低会影响人物聚类效果。")
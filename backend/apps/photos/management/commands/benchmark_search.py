@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from pgvector.django import CosineDistance
+from apps.photos.models import Photo
+from apps.photos.services.vector_index import get_embedding_snapshot
+from apps.photos.utils import hnsw_search_session, vector_to_numpy
+import numpy as np
+import time
+
+class Command(BaseCommand):
+    help = '对比语义搜索后端的延迟与召回率：内存映射快照 / pgvector 精确扫描 / pgvector HNSW (float32 与 halfvec 列)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=50, help='查询次数 (随机抽取照片向量并加入噪声作为查询)')
+        parser.add_argument('--k', type=int, default=100, help='每次返回的结果数量')
+        parser.add_argument('--hydrate', action='store_true', help='计时包含按 ID 取回照片对象')
+
+    def handle(self, *args, **options):
+        k = options['k']
+        hydrate = options['hydrate']
+
+        # float32 列为召回率基准；已清空 float32 列 (halfvec 模式) 时以 halfvec 精确扫描为基准
+        counts = {
+            column: Photo.objects.filter(**{f'{column}__isnull': False}).count()
+            for column in ('embedding_data', 'embedding_data_half')
+        }
+        columns = [column for column, count in counts.items() if count > 0]
+        if not columns:
+            self.stdout.write(self.style.ERROR("没有已生成语义向量的照片。"))
+            return
+        base_column = columns[0]
+        total = counts[base_column]
+
+        rng = np.random.default_rng(42)
+        samples = list(
+            Photo.objects.filter(**{f'{base_column}__isnull': False}).order_by('?')
+            .values_list(base_column, flat=True)[:options['queries']]
+        )
+        # 以照片向量加噪声模拟文本查询，避免查询本身恰好命中某一行
+        queries = [
+            (vector_to_numpy(v) + rng.normal(0, 0.02, 512)).astype(np.float32)
+            for v in samples
+        ]
+        self.stdout.write(
+            f"向量总数: {total} (float32 列 {counts['embedding_data']}，halfvec 列 {counts['embedding_data_half']})，"
+            f"查询次数: {len(queries)}，k={k}\n"
+        )
+
+        def fetch(ids):
+            if hydrate:
+                Photo.objects.in_bulk(ids)
+            return ids
+
+        def exact(column):
+            def search(q):
+                # 关闭索引扫描，强制顺序扫描得到精确结果 (作为召回率基准)
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL enable_indexscan = off")
+                    ids = list(
+                        Photo.objects.filter(**{f'{column}__isnull': False})
+                        .annotate(distance=CosineDistance(column, q))
+                        .order_by('distance').values_list('id', flat=True)[:k]
+                    )
+                return fetch(ids)
+            return search
+
+        def hnsw(column):
+            def search(q):
+                with hnsw_search_session(ef_search=k):
+                    ids = list(
+                        Photo.objects.filter(**{f'{column}__isnull': False})
+                        .annotate(distance=CosineDistance(column, q))
+                        .order_by('distance').values_list('id', flat=True)[:k]
+                    )
+                return fetch(ids)
+            return search
+
+        labels = {'embedding_data': 'pgvector', 'embedding_data_half': 'halfvec'}
+        backends = []
+        for column in columns:
+            backends += [(f'{labels[column]} exact', exact(column)), (f'{labels[column]} hnsw', hnsw(column))]
+        snapshot = get_embedding_snapshot()
+        if snapshot is not None:
+            self.stdout.write(f"内存映射快照: {snapshot.size} 条向量")
+            backends.insert(0, ('mmap float16', lambda q: fetch([pid for pid, _ in snapshot.search(q, k=k)])))
+        else:
+            self.stdout.write(self.style.WARNING("未找到向量快照，跳过 mmap 后端 (先运行 build_search_index)"))
+
+        results = {}
+        for name, func in backends:
+            func(queries[0])  # 预热 (页缓存 / 连接 / 查询计划)
+            latencies, outputs = [], []
+            for q in queries:
+                start = time.perf_counter()
+                outputs.append(func(q))
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[name] = (np.array(latencies), outputs)
+
+        baseline = results[f'{labels[base_column]} exact'][1]
+        self.stdout.write(f"\n{'后端':<18}{'平均(ms)':>10}{'P50(ms)':>10}{'P95(ms)':>10}{'召回率@k':>12}")
+        for name, (latencies, outputs) in results.items():
+            recall = np.mean([
+                len(set(map(str, got)) & set(map(str, exp))) / max(1, len(exp))
+                for got, exp in zip(outputs, baseline)
+            ])
+            self.stdout.write(
+                f"{name:<18}{latencies.mean():>10.2f}{np.percentile(latencies, 50):>10.2f}"
+                f"{np.percentile(latencies, 95):>10.2f}{recall:>12.3f}"
+            )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from apps.photos.models import GeoTile
+from apps.photos.services.geo import build_pyramid, get_tile_cells, get_tile_max_zoom, refresh_stale_tiles
+import time
+
+class Command(BaseCommand):
+    help = '生成地图瓦片金字塔 (每个缩放级别、每个瓦片的网格照片数、中心点与封面)，供 map/tiles/{z}/{x}/{y}/ 接口读取'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task-id', type=str, help='系统维护任务 ID')
+        parser.add_argument('--stale', action='store_true', help='只重算照片变化后标记为待重算的瓦片，不全量重建')
+
+    def handle(self, *args, **options):
+        task_id = options.get('task_id')
+        from apps.photos.models import MaintenanceTask
+        task = None
+        if task_id:
+            try:
+                task = MaintenanceTask.objects.get(id=task_id)
+            except MaintenanceTask.DoesNotExist:
+                pass
+
+        def update_progress(done, total):
+            if task:
+                MaintenanceTask.objects.filter(id=task.id).update(progress=int(done / total * 100))
+
+        start_time = time.time()
+        if options['stale']:
+            def report(done, total):
+                if done % 500 == 0 or done == total:
+                    self.stdout.write(f"进度: {done}/{total}")
+                    update_progress(done, total)
+
+            refreshed = refresh_stale_tiles(progress_callback=report)
+            self.stdout.write(self.style.SUCCESS(
+                f"完成！重算 {refreshed} 个瓦片，耗时 {time.time() - start_time:.1f} 秒。"
+            ))
+            return
+
+        self.stdout.write(f"最大缩放级别: {get_tile_max_zoom()}，每个瓦片 {get_tile_cells()}x{get_tile_cells()} 个网格")
+
+        def report_level(done, total, z, tiles):
+            self.stdout.write(f"缩放级别 {z}: {tiles} 个瓦片")
+            update_progress(done, total)
+
+        total = build_pyramid(progress_callback=report_level)
+        self.stdout.write(self.style.SUCCESS(
+            f"完成！共生成 {total} 个瓦片 (库中 {GeoTile.objects.count()} 个)，耗时 {time.time() - start_time:.1f} 秒。"
+        ))
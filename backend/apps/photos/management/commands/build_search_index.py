@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.photos.services.vector_index import build_snapshot, iter_database_embeddings, get_index_dir
+import time
+
+class Command(BaseCommand):
+    help = '从数据库全量重建内存映射语义向量快照 (SEARCH_BACKEND=mmap 时使用)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task-id', type=str, help='系统维护任务 ID')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批读取的向量数量')
+
+    def handle(self, *args, **options):
+        index_dir = get_index_dir()
+        self.stdout.write(f"正在重建向量快照: {index_dir}")
+        start_time = time.time()
+        count = build_snapshot(iter_database_embeddings(batch_size=options['batch_size']), index_dir)
+        self.stdout.write(self.style.SUCCESS(
+            f"完成！共写入 {count} 条向量，耗时 {time.time() - start_time:.1f} 秒。"
+        ))
@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from apps.photos.models import Photo
+from apps.photos.services.centroids import affected_person_ids, mark_centroids_stale, refresh_stale_centroids
+from apps.photos.services.people import PersonService
 
 class Command(BaseCommand):
     help = 'Delete photos that have been in trash for more than 30 days'
@@ -28,7 +30,13 @@ class Command(BaseCommand):
         if count > 0:
             self.stdout.write(f'Found {count} photos in trash older than 30 days. Deleting...')
             if task: MaintenanceTask.objects.filter(id=task.id).update(progress=10)
+            # 人脸随照片级联删除，涉及的人物特征中心、照片数与代表人脸需要重算
+            # (没有特征中心的人物不会被标记为过期，单独按人脸归属收集)
+            person_ids = affected_person_ids(photos_to_delete)
+            mark_centroids_stale(photos_to_delete)
             photos_to_delete.delete() # This performs hard delete
+            refresh_stale_centroids()
+            PersonService.refresh_person_stats(person_ids)
             self.stdout.write(self.style.SUCCESS(f'Successfully deleted {count} photos.'))
         else:
             self.stdout.write('No photos found in trash older than 30 days.')
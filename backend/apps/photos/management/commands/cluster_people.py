@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
+from apps.photos.services.face_clustering import ann_available, get_cluster_method
 from apps.photos.services.people import PersonService
-from apps.photos.models import Person
+from apps.photos.utils import face_vector_field
 
 class Command(BaseCommand):
     help = '对人物进行自动聚类和合并'
@@ -30,13 +31,18 @@ class Command(BaseCommand):
         
         # 0. 预检：检查是否有大量缺失特征向量的人脸
         from apps.photos.models import Face
-        missing_vecs = Face.objects.filter(embedding__isnull=True).count()
+        missing_vecs = Face.objects.filter(**{f'{face_vector_field()}__isnull': True}).count()
         if missing_vecs > 0:
             self.stdout.write(self.style.WARNING(f'警告: 发现 {missing_vecs} 张人脸缺少特征向量。'))
             self.stdout.write(self.style.NOTICE('请先运行 python manage.py extract_face_embeddings 来补全特征，否则聚类效果会大打折扣。'))
 
-        # 1. 对未标记人脸进行归类 (DBSCAN 自动发现新人物)
-        self.stdout.write('正在处理未标记人脸...')
+        method = get_cluster_method()
+        if method != 'dbscan' and not ann_available():
+            self.stdout.write(self.style.WARNING('警告: 未安装 hnswlib，近邻图将使用 O(N²) 的分块精确计算，大图库会非常慢。'))
+            self.stdout.write(self.style.NOTICE('建议运行 pip install hnswlib (已列入 requirements.txt) 以使用 HNSW 近似索引。'))
+
+        # 1. 对未标记人脸进行归类 (k 近邻图 + 图聚类自动发现新人物，方法由 FACE_CLUSTER_METHOD 决定)
+        self.stdout.write(f'正在处理未标记人脸 ({method})...')
         if task: MaintenanceTask.objects.filter(id=task.id).update(progress=10)
         labeled_count = PersonService.auto_cluster_unlabeled_faces(threshold=threshold)
         self.stdout.write(self.style.SUCCESS(f'成功自动归类了 {labeled_count} 张脸。'))
@@ -44,10 +50,10 @@ class Command(BaseCommand):
         # 1.5 同步所有人物的照片关联
         self.stdout.write('正在同步人物照片关联...')
         if task: MaintenanceTask.objects.filter(id=task.id).update(progress=40)
-        all_people = Person.objects.all()
-        for person in all_people:
-            person.sync_photos()
-        self.stdout.write(self.style.SUCCESS(f'已同步 {all_people.count()} 个人物的照片关联。'))
+        added, removed = PersonService.sync_person_photos()
+        self.stdout.write(self.style.SUCCESS(f'人物照片关联已同步：新增 {added} 条，清理 {removed} 条失效关联。'))
+        refreshed = PersonService.refresh_person_stats()
+        self.stdout.write(self.style.SUCCESS(f'已更新 {refreshed} 个人物的照片数与代表人脸。'))
 
         # 2. 寻找并自动合并相似人物 (包含自动生成的“人物_N”)
         self.stdout.write('正在分析相似人物并进行聚合...')
@@ -59,25 +65,12 @@ class Command(BaseCommand):
             return
 
         self.stdout.write(f'发现 {len(suggestions)} 组相似人物：')
-        merge_count = 0
-        merged_ids = set()  # 记录在本轮中已被合并（删除）的人物ID
-
+        pairs = []
         for sug in suggestions:
             p1 = sug['person1']
             p2 = sug['person2']
             conf = sug['confidence']
             
-            # 检查人物是否在本轮中已被处理过
-            if p1.id in merged_ids or p2.id in merged_ids:
-                continue
-            
-            # 再次确认数据库中对象仍然存在（双重保险）
-            if not Person.objects.filter(id=p1.id).exists() or not Person.objects.filter(id=p2.id).exists():
-                continue
-
-            # 对于自动生成的名字，我们采取更激进的合并策略
-            is_unnamed = p1.name.startswith('人物_') or p2.name.startswith('人物_')
-            
             self.stdout.write(f'  - {p1.name} 与 {p2.name} (相似度: {conf}%)')
             
             # 自动合并逻辑：
@@ -86,19 +79,17 @@ class Command(BaseCommand):
                 self.stdout.write(f'    [预览合并] {p1.name} -> {p2.name} (未执行)')
                 continue
 
-            self.stdout.write(self.style.WARNING(f'    [执行合并] {p1.name} -> {p2.name}'))
-            try:
-                # 将 p1 合并到 p2 (保持 p2)
-                p1.merge_with(p2)
-                merged_ids.add(p1.id) # p1 被删除了
-                merge_count += 1
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'    合并失败: {e}'))
+            # 将 p1 合并到 p2 (保持 p2)；已在本轮被合并的人物沿合并链找到最终目标
+            pairs.append((p1.id, p2.id))
+
+        merge_count = 0
+        if pairs:
+            self.stdout.write(self.style.WARNING(f'    [执行合并] 共 {len(pairs)} 组建议'))
+            merge_count = PersonService.apply_merges(
+                pairs, log_func=lambda message, level: self.stdout.write(self.style.ERROR(f'    {message}'))
+            )
         
         if merge_count > 0:
-            # 清理缓存
-            from django.core.cache import cache
-            cache.delete('merge_suggestions_all')
-            self.stdout.write(self.style.SUCCESS(f'聚类聚合分析完成，共合并了 {merge_count} 组人物。'))
+            self.stdout.write(self.style.SUCCESS(f'聚类聚合分析完成，共合并了 {merge_count} 个人物。'))
         else:
             self.stdout.write(self.style.SUCCESS('聚类聚合分析完成，没有执行任何合并。'))
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Q
+from apps.photos.models import Face, Person, Photo
+from apps.photos.services.embedding_loader import load_embeddings
+from apps.photos.services.face_clustering import cluster_embeddings
+from apps.photos.services.face_quality import get_cluster_threshold, get_drop_threshold, score_stored_face
+from apps.photos.utils import face_vector_field
+import numpy as np
+import time
+
+class Command(BaseCommand):
+    help = '人脸质量分报告：分数分布、按不同阈值可节省的行数与存储、未归类人脸聚类耗时的变化'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thresholds', type=float, nargs='+', default=[0.05, 0.1, 0.2, 0.3], help='评估的质量分阈值')
+        parser.add_argument('--sample', type=int, default=20000, help='聚类耗时对比使用的未归类人脸数上限')
+        parser.add_argument('--threshold', type=float, default=0.3, help='聚类距离阈值')
+        parser.add_argument('--backfill', action='store_true', help='先为没有质量分的旧人脸补算质量分 (只处理静态照片)')
+        parser.add_argument('--backfill-limit', type=int, default=0, help='补算的照片数上限，0 为不限')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill(options['backfill_limit'])
+
+        total = Face.objects.count()
+        scored = Face.objects.filter(quality__isnull=False).count()
+        self.stdout.write(
+            f"人脸总数: {total}，已评分: {scored}，未评分 (旧数据，可用 --backfill 补算): {total - scored}\n"
+            f"当前配置: 丢弃阈值 {get_drop_threshold()}，聚类阈值 {get_cluster_threshold()}\n"
+        )
+        if not scored:
+            return
+
+        qualities = np.array(Face.objects.filter(quality__isnull=False).values_list('quality', flat=True), dtype=np.float32)
+        edges = [0, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 1.0001]
+        hist, _ = np.histogram(qualities, bins=edges)
+        self.stdout.write("质量分分布:")
+        for lo, hi, count in zip(edges[:-1], edges[1:], hist):
+            self.stdout.write(f"  [{lo:.2f}, {min(hi, 1):.2f}{']' if hi > 1 else ')'}: {count:>8} ({count / scored:.1%})")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(AVG(pg_column_size(f.*)), 0) FROM {Face._meta.db_table} f")
+            row_bytes = float(cursor.fetchone()[0])
+
+        # 每个人物质量最好的人脸；低于阈值的人物全部由低质量人脸组成，过滤后不会被创建
+        best_per_person = np.array(
+            Person.objects.annotate(best=Max('faces__quality')).filter(best__isnull=False).values_list('best', flat=True),
+            dtype=np.float32,
+        )
+        self.stdout.write(f"\n{'阈值':>6}{'低于阈值人脸':>14}{'占比':>8}{'节省存储(MB)':>14}{'可避免的人物':>14}")
+        for t in options['thresholds']:
+            below = int((qualities < t).sum())
+            people = int((best_per_person < t).sum())
+            self.stdout.write(
+                f"{t:>6.2f}{below:>14}{below / scored:>8.1%}{below * row_bytes / 1024 / 1024:>14.1f}{people:>14}"
+            )
+
+        self.compare_clustering(options)
+
+    def compare_clustering(self, options):
+        """在未归类人脸上对比过滤前后的聚类耗时与新建人物数"""
+        loaded = load_embeddings(Face, face_vector_field(), ['person_id IS NULL'], extra_columns=['quality'])
+        if len(loaded) == 0:
+            self.stdout.write("\n没有未归类的人脸，跳过聚类耗时对比。")
+            return
+        rng = np.random.default_rng(0)
+        keep = np.sort(rng.permutation(len(loaded))[:options['sample']])
+        embeddings = loaded.matrix[keep]
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        # 未评分的旧人脸视为满分 (与聚类时的过滤规则一致)
+        qualities = np.array([loaded.columns['quality'][i] for i in keep], dtype=np.float32)
+        qualities = np.nan_to_num(qualities, nan=1.0)
+
+        self.stdout.write(f"\n聚类耗时对比 (未归类人脸抽样 {len(keep)} / {len(loaded)}):")
+        self.stdout.write(f"{'阈值':>6}{'参与聚类':>10}{'耗时(s)':>10}{'新建人物':>10}")
+        for t in [0.0] + list(options['thresholds']):
+            subset = embeddings[qualities >= t]
+            start = time.perf_counter()
+            labels = cluster_embeddings(subset, options['threshold'])
+            elapsed = time.perf_counter() - start
+            # 每个簇成为一个新人物，噪声人脸保持未归类
+            created = int(labels.max()) + 1 if len(labels) else 0
+            self.stdout.write(f"{t:>6.2f}{len(subset):>10}{elapsed:>10.2f}{created:>10}")
+
+    def backfill(self, limit):
+        from apps.photos.services.faces import get_detect_max_edge, open_image_for_detection
+        from apps.photos.utils import resolve_docker_path
+
+        # 纯视频的人脸来自抽帧，无法还原当时的帧，只处理图片与实况照片的静态人脸
+        photos = Photo.objects.filter(faces__quality__isnull=True, faces__timestamp__isnull=True).filter(
+            Q(video_path__isnull=True) | Q(video_path='') | Q(is_live_photo=True)
+        ).distinct().values_list('id', 'file_path')
+        if limit:
+            photos = photos[:limit]
+        max_edge = get_detect_max_edge()
+        updated = 0
+        for photo_id, file_path in photos.iterator():
+            try:
+                img, original_size = open_image_for_detection(resolve_docker_path(file_path), max_edge)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"读取失败 {file_path}: {e}"))
+                continue
+            image_rgb = np.array(img)
+            faces = list(Face.objects.filter(photo_id=photo_id, quality__isnull=True).only('id', 'bbox', 'prob'))
+            for face in faces:
+                face.quality, face.sharpness = score_stored_face(image_rgb, original_size, face.bbox, face.prob)
+            Face.objects.bulk_update(faces, ['quality', 'sharpness'])
+            updated += len(faces)
+        self.stdout.write(self.style.SUCCESS(f"已补算 {updated} 张人脸的质量分\n"))
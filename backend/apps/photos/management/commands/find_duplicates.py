@@ -0,0 +1,119 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.photos.models import Photo, DuplicateGroup
+from apps.photos.services.dedup import (
+    compute_file_dhash,
+    find_near_duplicate_groups,
+    DEFAULT_DUPLICATE_RADIUS,
+)
+import os
+import time
+
+class Command(BaseCommand):
+    help = '基于感知哈希 (dHash) 查找近似重复照片 (缩放、重新导出、聊天软件压缩后的副本)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task-id', type=str, help='系统维护任务 ID')
+        parser.add_argument(
+            '--radius',
+            type=int,
+            default=DEFAULT_DUPLICATE_RADIUS,
+            help=f'汉明距离阈值，越小越严格 (默认: {DEFAULT_DUPLICATE_RADIUS})'
+        )
+        parser.add_argument('--skip-backfill', action='store_true', help='跳过为历史照片补算感知哈希')
+        parser.add_argument('--batch-size', type=int, default=500, help='补算哈希时每批写入数量')
+
+    def handle(self, *args, **options):
+        task_id = options.get('task_id')
+        from apps.photos.models import MaintenanceTask
+        task = None
+        if task_id:
+            try:
+                task = MaintenanceTask.objects.get(id=task_id)
+            except MaintenanceTask.DoesNotExist:
+                pass
+
+        radius = options['radius']
+        batch_size = options['batch_size']
+
+        # --- 第一步：为缺少感知哈希的历史照片补算 ---
+        if not options['skip_backfill']:
+            self.backfill_hashes(task, batch_size)
+
+        # --- 第二步：多索引哈希查找近似重复 ---
+        if task: MaintenanceTask.objects.filter(id=task.id).update(progress=60)
+        rows = list(
+            Photo.objects.filter(deleted_at__isnull=True, phash__isnull=False).values_list('id', 'phash')
+        )
+        self.stdout.write(f"正在比较 {len(rows)} 张照片的感知哈希 (汉明距离 <= {radius})...")
+        start_time = time.time()
+        groups = find_near_duplicate_groups([r[0] for r in rows], [r[1] for r in rows], radius=radius)
+        self.stdout.write(f"查找完成，耗时 {time.time() - start_time:.1f} 秒，发现 {len(groups)} 组近似重复。")
+
+        # --- 第三步：保存分组，替换旧的待处理分组 ---
+        if task: MaintenanceTask.objects.filter(id=task.id).update(progress=85)
+        created = self.save_groups(groups)
+        self.stdout.write(self.style.SUCCESS(f"已生成 {created} 个待审核的重复照片组。"))
+
+    def backfill_hashes(self, task, batch_size):
+        # 纯视频没有可用的静态图像，跳过
+        pending = Photo.objects.filter(
+            phash__isnull=True, deleted_at__isnull=True
+        ).exclude(is_live_photo=False, video_path__isnull=False).values_list('id', 'file_path')
+        total = pending.count()
+        if total == 0:
+            return
+
+        self.stdout.write(f"正在为 {total} 张照片补算感知哈希...")
+        done = 0
+        failed = 0
+        batch = []
+        for photo_id, file_path in pending.iterator(chunk_size=batch_size):
+            done += 1
+            if not os.path.exists(file_path):
+                failed += 1
+                continue
+            try:
+                batch.append(Photo(id=photo_id, phash=compute_file_dhash(file_path)))
+            except Exception:
+                failed += 1
+
+            if len(batch) >= batch_size:
+                Photo.objects.bulk_update(batch, ['phash'])
+                batch = []
+                if task:
+                    MaintenanceTask.objects.filter(id=task.id).update(progress=int(done / total * 60))
+        if batch:
+            Photo.objects.bulk_update(batch, ['phash'])
+
+        self.stdout.write(f"补算完成：成功 {done - failed} 张，失败/缺失 {failed} 张。")
+
+    def save_groups(self, groups):
+        # 已审核过的分组 (忽略/已处理)：新分组若是其子集，不再重复提示
+        Through = DuplicateGroup.photos.through
+        reviewed = {}
+        for group_id, photo_id in Through.objects.exclude(
+            duplicategroup__status=DuplicateGroup.Status.PENDING
+        ).values_list('duplicategroup_id', 'photo_id'):
+            reviewed.setdefault(group_id, set()).add(photo_id)
+        photo_to_reviewed = {}
+        for group_id, members in reviewed.items():
+            for photo_id in members:
+                photo_to_reviewed.setdefault(photo_id, []).append(group_id)
+
+        new_groups = []
+        through_rows = []
+        for member_ids, max_distance in groups:
+            members = set(member_ids)
+            candidates = photo_to_reviewed.get(member_ids[0], [])
+            if any(members <= reviewed[group_id] for group_id in candidates):
+                continue
+            group = DuplicateGroup(photo_count=len(member_ids), max_distance=max_distance)
+            new_groups.append(group)
+            through_rows.extend(Through(duplicategroup_id=group.id, photo_id=pid) for pid in member_ids)
+
+        with transaction.atomic():
+            DuplicateGroup.objects.filter(status=DuplicateGroup.Status.PENDING).delete()
+            DuplicateGroup.objects.bulk_create(new_groups, batch_size=1000)
+            Through.objects.bulk_create(through_rows, batch_size=5000)
+        return len(new_groups)
@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from apps.photos.models import Face, Photo
+from apps.photos.utils import get_embedding_storage
+import time
+
+# (模型, float32 列, halfvec 列)
+EMBEDDING_COLUMNS = [
+    (Photo, 'embedding_data', 'embedding_data_half'),
+    (Face, 'embedding', 'embedding_half'),
+]
+
+class Command(BaseCommand):
+    help = (
+        '人脸与照片向量在 float32 (vector) 与 float16 (halfvec) 存储之间迁移。'
+        '步骤: EMBEDDING_STORAGE=dual 双写 -> --backfill 回填 halfvec 列 -> benchmark_search 对比召回率 -> '
+        'EMBEDDING_STORAGE=halfvec 切换读写 -> (可选) --release-full 清空 float32 列释放空间；'
+        '回滚: EMBEDDING_STORAGE=dual -> --restore-full 由 halfvec 列补回 float32 列 -> EMBEDDING_STORAGE=vector'
+    )
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--backfill', action='store_true', help='由 float32 列回填缺失的 halfvec 列')
+        group.add_argument('--restore-full', action='store_true', help='回滚：由 halfvec 列补回缺失的 float32 列')
+        group.add_argument('--release-full', action='store_true', help='清空已有 halfvec 副本的 float32 列 (需 EMBEDDING_STORAGE=halfvec，之后建议 VACUUM)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='每个事务更新的行数')
+
+    def handle(self, *args, **options):
+        mode = get_embedding_storage()
+        self.stdout.write(f"当前存储模式 EMBEDDING_STORAGE={mode}")
+
+        if options['backfill']:
+            if mode == 'vector':
+                self.stdout.write(self.style.WARNING("当前为 vector 模式，回填期间新写入的向量不会写入 halfvec 列，建议先切换到 dual"))
+            self.copy_columns(options['batch_size'], to_half=True)
+        elif options['restore_full']:
+            if mode == 'halfvec':
+                self.stdout.write(self.style.WARNING("当前为 halfvec 模式，补回期间新写入的向量不会写入 float32 列，建议先切换到 dual"))
+            self.copy_columns(options['batch_size'], to_half=False)
+        elif options['release_full']:
+            if mode != 'halfvec':
+                raise CommandError("只有在 EMBEDDING_STORAGE=halfvec 时才能清空 float32 列")
+            self.release_full(options['batch_size'])
+
+        self.report()
+
+    def run_batches(self, sql, batch_size):
+        """按批执行 UPDATE ... WHERE id IN (SELECT ... LIMIT n)，每批一个事务，返回总行数"""
+        total = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [batch_size])
+                updated = cursor.rowcount
+            total += updated
+            if updated < batch_size:
+                return total
+            self.stdout.write(f"  已更新 {total} 行...")
+
+    def copy_columns(self, batch_size, to_half):
+        for model, full, half in EMBEDDING_COLUMNS:
+            table = model._meta.db_table
+            source, target, cast = (full, half, 'halfvec') if to_half else (half, full, 'vector')
+            start = time.time()
+            count = self.run_batches(f"""
+                UPDATE {table} SET {target} = {source}::{cast}
+                WHERE id IN (
+                    SELECT id FROM {table} WHERE {source} IS NOT NULL AND {target} IS NULL LIMIT %s
+                )
+            """, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"{table}.{target}: 写入 {count} 行，耗时 {time.time() - start:.1f} 秒"))
+
+    def release_full(self, batch_size):
+        for model, full, half in EMBEDDING_COLUMNS:
+            table = model._meta.db_table
+            count = self.run_batches(f"""
+                UPDATE {table} SET {full} = NULL
+                WHERE id IN (
+                    SELECT id FROM {table} WHERE {full} IS NOT NULL AND {half} IS NOT NULL LIMIT %s
+                )
+            """, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"{table}.{full}: 清空 {count} 行"))
+        self.stdout.write(self.style.NOTICE("表空间需 VACUUM (FULL) 后才会归还，float32 列的 HNSW 索引可 REINDEX 后缩小"))
+
+    def report(self):
+        """各列的行数、平均存储大小与索引大小"""
+        self.stdout.write(f"\n{'列':<36}{'行数':>10}{'平均字节':>10}")
+        with connection.cursor() as cursor:
+            for model, full, half in EMBEDDING_COLUMNS:
+                table = model._meta.db_table
+                for column in (full, half):
+                    cursor.execute(
+                        f"SELECT COUNT({column}), COALESCE(AVG(pg_column_size({column})), 0) FROM {table}"
+                    )
+                    count, avg_size = cursor.fetchone()
+                    self.stdout.write(f"{table + '.' + column:<36}{count:>10}{float(avg_size):>10.0f}")
+                missing = model.objects.filter(**{f'{full}__isnull': False, f'{half}__isnull': True}).count()
+                if missing:
+                    self.stdout.write(self.style.WARNING(f"  {table}: {missing} 行尚未回填 halfvec 列"))
+
+            cursor.execute("""
+                SELECT indexrelid::regclass::text, pg_relation_size(indexrelid)
+                FROM pg_index WHERE indexrelid::regclass::text LIKE %s
+                ORDER BY 1
+            """, ['%hnsw%'])
+            rows = cursor.fetchall()
+        if rows:
+            self.stdout.write(f"\n{'HNSW 索引':<36}{'大小(MB)':>10}")
+            for name, size in rows:
+                self.stdout.write(f"{name:<36}{size / 1024 / 1024:>10.1f}")
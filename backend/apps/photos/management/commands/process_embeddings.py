@@ -1,11 +1,14 @@
 from django.core.management.base import BaseCommand
 from apps.photos.models import Photo
+from apps.photos.utils import photo_vector_field
 from sentence_transformers import SentenceTransformer
 from PIL import Image
 import os
+import time
 import torch
 from apps.photos.services import check_gpu_availability
-from apps.photos.services.video import extract_video_frame
+from apps.photos.services.video import extract_video_frame, load_video_poster, prune_video_posters
+from apps.photos.services.vector_index import append_embeddings
 
 class Command(BaseCommand):
     help = 'Generate embeddings for photos using CLIP (GPU Accelerated)'
@@ -29,8 +32,11 @@ class Command(BaseCommand):
         # 强制 transformers 不去检查远程版本，优先使用本地缓存
         os.environ["TRANSFORMERS_OFFLINE"] = "0" 
         
+        # 本次向量化开始前缓存的视频代表帧，跑完后都不会再被使用 (见 prune_video_posters)
+        pass_started = time.time()
+
         # 查找还未生成语义向量的照片
-        photos = Photo.objects.filter(embedding_data__isnull=True).order_by('created_at')
+        photos = Photo.objects.filter(**{f'{photo_vector_field()}__isnull': True}).order_by('created_at')
         
         # 现在视频也支持生成向量，不再过滤
         valid_photo_list = list(photos)
@@ -38,6 +44,7 @@ class Command(BaseCommand):
 
         if count == 0:
             self.stdout.write(self.style.SUCCESS("No photos to process."))
+            self.prune_posters(pass_started)
             return
 
         # 检测设备
@@ -107,7 +114,7 @@ class Command(BaseCommand):
                     img = None
                     
                     if photo.is_pure_video:
-                         img = extract_video_frame(photo.file_path)
+                         img = load_video_poster(photo.file_path)
                          if img:
                              images.append(img.convert('RGB'))
                              valid_batch_photos.append(photo)
@@ -141,6 +148,12 @@ class Command(BaseCommand):
                 for photo, embedding in zip(valid_batch_photos, embeddings):
                     photo.set_embedding(embedding)
                     photo.save()
+
+                # 整批追加到内存映射快照 (未建立快照时跳过)
+                try:
+                    append_embeddings([p.id for p in valid_batch_photos], embeddings)
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"Snapshot update failed: {e}"))
                 
                 processed_count += len(images)
                 if processed_count % (batch_size * 5) == 0 or processed_count == count:
@@ -149,3 +162,20 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f"Error processing batch: {e}"))
                 
         self.stdout.write(self.style.SUCCESS(f"Done! Processed {processed_count} photos."))
+        self.prune_posters(pass_started)
+
+        # 为新生成向量的照片增量打零样本标签 (词表文本向量命中缓存后无需重复推理)
+        if processed_count:
+            try:
+                from apps.photos.services.tagging import tag_photos
+                tagged = tag_photos()
+                if tagged:
+                    self.stdout.write(f"Tagged {tagged} photos.")
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"Tagging skipped: {e}"))
+
+    def prune_posters(self, pass_started):
+        """清理人脸扫描留下但不会再被读取的视频代表帧缓存"""
+        removed = prune_video_posters(pass_started)
+        if removed:
+            self.stdout.write(f"Removed {removed} unused video poster caches.")
@@ -1,12 +1,16 @@
 from django.core.management.base import BaseCommand
-from apps.photos.models import Photo, Face
-from apps.photos.services import detect_faces_in_photo, get_face_detector
+from apps.photos.models import Photo, Face, PersonCentroid
+from apps.photos.services import detect_faces_in_photos, get_face_detector
 from apps.photos.services.people import PersonService
+from apps.photos.services.face_pipeline import run_face_pipeline, run_face_process_pool
+from apps.photos.services.faces import face_scan_rows
+from apps.photos.services.face_gate import gate_photos, get_gate_threshold
 import multiprocessing
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import time
 import os
+import random
 
 class Command(BaseCommand):
     help = '一键完成人脸识别与聚类 (包括扫描、特征提取、自动归类和合并)'
@@ -19,6 +23,27 @@ class Command(BaseCommand):
             default=multiprocessing.cpu_count(),
             help='并发线程数 (默认: CPU 核心数)'
         )
+        parser.add_argument(
+            '--mode',
+            choices=['thread', 'pipeline', 'process'],
+            default='thread',
+            help='扫描模式：thread (线程池) / pipeline (解码进程 + 推理 + 批量写入流水线) / process (多进程，每进程独立 ONNX 会话，适合多核 CPU)'
+        )
+        parser.add_argument('--intra-op-threads', type=int, default=0, help='process 模式每个进程的 ONNX 线程数 (默认: CPU 核心数 / 进程数)')
+        parser.add_argument('--decode-workers', type=int, default=0, help='流水线模式的解码进程数 (默认: CPU 核心数 - 1)')
+        parser.add_argument('--infer-workers', type=int, default=1, help='流水线模式的推理线程数 (默认: 1)')
+        parser.add_argument('--queue-size', type=int, default=16, help='流水线阶段间队列长度 (默认: 16)')
+        parser.add_argument('--write-batch', type=int, default=32, help='流水线模式每次写入的照片数 (默认: 32)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=8,
+            help='每个线程一次处理并批量写入的照片数 (默认: 8)'
+        )
+        parser.add_argument('--gate', action='store_true', help='检测前用已有的 CLIP 向量预筛，跳过大概率无人的照片')
+        parser.add_argument('--gate-threshold', type=float, default=None, help='预筛阈值 (默认: settings.FACE_GATE_THRESHOLD)')
+        parser.add_argument('--gate-sample', type=int, default=50, help='抽样完整检测的被跳过照片数，用于估计召回率 (默认: 50，0 为不抽样)')
+        parser.add_argument('--rescan-gated', action='store_true', help='重新检测之前被预筛跳过的照片 (调整阈值后使用)')
         parser.add_argument(
             '--re-scan',
             action='store_true',
@@ -54,7 +79,8 @@ class Command(BaseCommand):
         default_workers = 1 if is_docker else multiprocessing.cpu_count()
         
         workers = options.get('workers', default_workers)
-        if is_docker and workers > 2:
+        # 流水线/多进程模式只有单一写入者持有数据库连接，不受此限制
+        if is_docker and workers > 2 and options['mode'] == 'thread':
             self.stdout.write(self.style.WARNING(f"检测到 Docker 环境，强制将 workers 从 {workers} 降低到 2 以保证数据库连接稳定。"))
             workers = 2
             
@@ -78,8 +104,12 @@ class Command(BaseCommand):
         if re_scan:
             self.stdout.write(self.style.WARNING("正在按要求清空旧的人脸数据..."))
             Face.objects.all().delete()
-            Photo.objects.update(face_scanned=False)
+            PersonCentroid.objects.all().delete()
+            Photo.objects.update(face_scanned=False, face_gated=False)
             self.stdout.write(self.style.SUCCESS("数据已清空。"))
+        elif options['rescan_gated']:
+            reset = Photo.objects.filter(face_gated=True).update(face_scanned=False, face_gated=False)
+            self.stdout.write(f"已重置 {reset} 张预筛跳过的照片，将重新检测。")
 
         # 同步状态
         Photo.objects.filter(faces__isnull=False, face_scanned=False).update(face_scanned=True)
@@ -90,44 +120,40 @@ class Command(BaseCommand):
         photo_ids = list(Photo.objects.filter(face_scanned=False).values_list('id', flat=True))
         total = len(photo_ids)
 
+        gated_ids = []
+        if total > 0 and options['gate']:
+            threshold_value = options['gate_threshold']
+            if threshold_value is None:
+                threshold_value = get_gate_threshold()
+            gated_ids, photo_ids = gate_photos(photo_ids, threshold=threshold_value)
+            total = len(photo_ids)
+            self.stdout.write(f"CLIP 预筛 (阈值 {threshold_value})：跳过 {len(gated_ids)} 张大概率无人的照片，剩余 {total} 张待检测。")
+
+        scan_start = time.perf_counter()
         if total > 0:
             self.stdout.write(f"总照片数: {total_photos}, 已处理: {scanned_count}, 待处理: {total}")
-            self.stdout.write(f"正在增量识别 {total} 张新照片，使用 {workers} 个线程进行处理...")
-            # 显示硬件加速状态 (现在已被静音，如果需要确认状态，可以在日志中查看)
-            # get_face_detector(silent=False) 
-            self.stdout.write("正在初始化人脸检测模型...")
-            get_face_detector(silent=False)
-            self.stdout.write("模型初始化完成，开始处理...")
-
-            count = 0
-            face_count = 0
-            with tqdm(total=total, desc="人脸扫描中", unit="photo") as pbar:
-                with ThreadPoolExecutor(max_workers=workers) as executor:
-                    batch_size = workers * 2
-                    for i in range(0, total, batch_size):
-                        batch_ids = photo_ids[i:i + batch_size]
-                        future_to_photo = {executor.submit(detect_faces_in_photo, pid): pid for pid in batch_ids}
-                        for future in as_completed(future_to_photo):
-                            try:
-                                num = future.result()
-                                face_count += num
-                                count += 1
-                                pbar.update(1)
-                                if count % 50 == 0:
-                                    pbar.set_postfix({"已发现人脸": face_count})
-                                
-                                # 更新任务进度 (0-80% 给人脸扫描)
-                                if task and count % 10 == 0:
-                                    progress = int((count / total) * 80)
-                                    MaintenanceTask.objects.filter(id=task.id).update(progress=progress)
-                                    
-                            except Exception as e:
-                                self.stdout.write(self.style.ERROR(f"处理照片失败: {e}"))
-                        time.sleep(0.1)
-            self.stdout.write(self.style.SUCCESS(f"人脸扫描完成：共处理 {count} 张照片，发现 {face_count} 张人脸。"))
+            if options['mode'] == 'process':
+                # 每个子进程各自加载模型，主进程无需加载
+                self.scan_with_processes(photo_ids, workers, options, task)
+            else:
+                # 显示硬件加速状态 (现在已被静音，如果需要确认状态，可以在日志中查看)
+                # get_face_detector(silent=False) 
+                self.stdout.write("正在初始化人脸检测模型...")
+                get_face_detector(silent=False)
+                self.stdout.write("模型初始化完成，开始处理...")
+
+                if options['mode'] == 'pipeline':
+                    self.scan_with_pipeline(photo_ids, options, task)
+                else:
+                    self.stdout.write(f"正在增量识别 {total} 张新照片，使用 {workers} 个线程进行处理...")
+                    self.scan_with_threads(photo_ids, workers, options['chunk_size'], task)
         else:
             self.stdout.write(f"总照片数: {total_photos}, 已处理: {scanned_count}, 待处理: {total}")
             self.stdout.write(self.style.SUCCESS("所有照片均已处理，无需增量识别。"))
+        scan_seconds = time.perf_counter() - scan_start
+
+        if gated_ids:
+            self.report_gate(gated_ids, photo_ids, scan_seconds, options['gate_sample'])
 
         # --- 第二步：自动聚类 ---
         if skip_cluster:
@@ -154,7 +180,7 @@ class Command(BaseCommand):
         if not suggestions:
             self.stdout.write(self.style.SUCCESS("未发现可进一步合并的人物。"))
         else:
-            merge_count = 0
+            pairs = []
             for sug in suggestions:
                 p1, p2 = sug['person1'], sug['person2']
                 conf = sug['confidence']
@@ -162,13 +188,163 @@ class Command(BaseCommand):
                 # 自动合并策略：相似度 > 95% 或者 包含自动生成名称且相似度 > 85%
                 is_unnamed = p1.name.startswith('人物_') or p2.name.startswith('人物_')
                 if conf > 95 or (is_unnamed and conf > 85):
-                    try:
-                        p1.merge_with(p2)
-                        merge_count += 1
-                        self.stdout.write(f"  [自动合并] {p1.name} -> {p2.name} (相似度: {conf}%)")
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"  合并失败 {p1.name}: {e}"))
+                    pairs.append((p1.id, p2.id))
+                    self.stdout.write(f"  [自动合并] {p1.name} -> {p2.name} (相似度: {conf}%)")
+
+            merge_count = PersonService.apply_merges(
+                pairs, log_func=lambda message, level: self.stdout.write(self.style.ERROR(f"  {message}"))
+            )
             
-            self.stdout.write(self.style.SUCCESS(f"自动合并完成：共合并了 {merge_count} 组人物。"))
+            self.stdout.write(self.style.SUCCESS(f"自动合并完成：共合并了 {merge_count} 个人物。"))
 
         self.stdout.write("\n" + self.style.SUCCESS("✨ 所有人脸处理任务已全部完成！"))
+
+    def report_gate(self, gated_ids, scanned_ids, scan_seconds, sample_size):
+        """预筛报告：跳过的照片数、节省的时间，以及抽样完整检测估计的召回率"""
+        per_photo = scan_seconds / len(scanned_ids) if scanned_ids else None
+
+        sample = random.sample(gated_ids, min(sample_size, len(gated_ids))) if sample_size > 0 else []
+        missed = 0
+        if sample:
+            sample_start = time.perf_counter()
+            counts = detect_faces_in_photos(sample)
+            # 抽样照片已完整检测，不再视为被跳过
+            Photo.objects.filter(id__in=sample).update(face_gated=False)
+            missed = sum(1 for c in counts.values() if c > 0)
+            if per_photo is None:
+                per_photo = (time.perf_counter() - sample_start) / len(sample)
+
+        self.stdout.write(self.style.MIGRATE_HEADING("--- CLIP 预筛报告 ---"))
+        self.stdout.write(f"跳过检测: {len(gated_ids)} 张 (占待处理的 {len(gated_ids) / (len(gated_ids) + len(scanned_ids)):.1%})")
+        if per_photo is not None:
+            self.stdout.write(f"节省时间: 约 {len(gated_ids) * per_photo:.1f} 秒 (按本次平均 {per_photo * 1000:.0f} ms/张估算)")
+        if not sample:
+            return
+
+        with_faces = 0
+        for i in range(0, len(scanned_ids), 5000):
+            with_faces += Photo.objects.filter(
+                id__in=scanned_ids[i:i + 5000], faces__isnull=False
+            ).distinct().count()
+        miss_rate = missed / len(sample)
+        estimated_missed = miss_rate * (len(gated_ids) - len(sample))
+        found = with_faces + missed
+        recall = found / (found + estimated_missed) if found + estimated_missed > 0 else 1.0
+        self.stdout.write(
+            f"抽样完整检测 {len(sample)} 张被跳过的照片：{missed} 张有人脸 (漏检率 {miss_rate:.1%})，"
+            f"其余被跳过照片中估计还有 {estimated_missed:.0f} 张有人脸"
+        )
+        self.stdout.write(f"估计召回率: {recall:.1%} (有人脸照片中经过检测的比例)")
+        if miss_rate > 0.05:
+            self.stdout.write(self.style.WARNING("漏检率偏高，建议降低 --gate-threshold 后使用 --rescan-gated 重新检测。"))
+
+    def scan_with_threads(self, photo_ids, workers, chunk_size, task):
+        """线程模式：每个线程处理一小批照片 (解码 + 推理)，整批人脸一次写入"""
+        from apps.photos.models import MaintenanceTask
+        total = len(photo_ids)
+        count = 0
+        face_count = 0
+        with tqdm(total=total, desc="人脸扫描中", unit="photo") as pbar:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # 每个线程处理一小批照片，整批人脸一次写入数据库
+                batch_size = workers * chunk_size * 2
+                for i in range(0, total, batch_size):
+                    batch_ids = photo_ids[i:i + batch_size]
+                    chunks = [batch_ids[j:j + chunk_size] for j in range(0, len(batch_ids), chunk_size)]
+                    future_to_chunk = {executor.submit(detect_faces_in_photos, chunk): chunk for chunk in chunks}
+                    for future in as_completed(future_to_chunk):
+                        chunk = future_to_chunk[future]
+                        try:
+                            counts = future.result()
+                            face_count += sum(counts.values())
+                            count += len(chunk)
+                            pbar.update(len(chunk))
+                            pbar.set_postfix({"已发现人脸": face_count})
+                            
+                            # 更新任务进度 (0-80% 给人脸扫描)
+                            if task:
+                                progress = int((count / total) * 80)
+                                MaintenanceTask.objects.filter(id=task.id).update(progress=progress)
+                                
+                        except Exception as e:
+                            self.stdout.write(self.style.ERROR(f"处理照片失败: {e}"))
+                    time.sleep(0.1)
+        self.stdout.write(self.style.SUCCESS(f"人脸扫描完成：共处理 {count} 张照片，发现 {face_count} 张人脸。"))
+
+    def scan_with_pipeline(self, photo_ids, options, task):
+        """流水线模式：解码进程池 -> 推理线程 -> 单线程批量写入，结束后输出各阶段利用率"""
+        from apps.photos.models import MaintenanceTask
+        total = len(photo_ids)
+        decode_workers = options['decode_workers'] or max(1, multiprocessing.cpu_count() - 1)
+        self.stdout.write(
+            f"正在以流水线模式识别 {total} 张新照片 "
+            f"(解码进程: {decode_workers}, 推理线程: {options['infer_workers']}, "
+            f"队列长度: {options['queue_size']}, 写入批量: {options['write_batch']})..."
+        )
+
+        rows = self.get_photo_rows(photo_ids)
+
+        with tqdm(total=total, desc="人脸扫描中", unit="photo") as pbar:
+            def report(done, faces):
+                pbar.update(done - pbar.n)
+                pbar.set_postfix({"已发现人脸": faces})
+                if task:
+                    MaintenanceTask.objects.filter(id=task.id).update(progress=int(done / total * 80))
+
+            count, face_count, stats = run_face_pipeline(
+                rows,
+                decode_workers=decode_workers,
+                infer_workers=options['infer_workers'],
+                queue_size=options['queue_size'],
+                write_batch=options['write_batch'],
+                progress_callback=report,
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"人脸扫描完成：共处理 {count} 张照片，发现 {face_count} 张人脸。"))
+        self.write_stage_report(stats)
+
+    def scan_with_processes(self, photo_ids, workers, options, task):
+        """多进程模式：每个进程独立的 ONNX 会话，照片按块分发，结果由主进程统一批量写入"""
+        from apps.photos.models import MaintenanceTask
+        total = len(photo_ids)
+        cores = multiprocessing.cpu_count()
+        workers = max(1, min(workers, cores))
+        intra_op_threads = options['intra_op_threads'] or max(1, cores // workers)
+        self.stdout.write(
+            f"正在以多进程模式识别 {total} 张新照片 "
+            f"(进程: {workers}, 每进程 ONNX 线程: {intra_op_threads}, 每块照片: {options['chunk_size']})..."
+        )
+
+        rows = self.get_photo_rows(photo_ids)
+        with tqdm(total=total, desc="人脸扫描中", unit="photo") as pbar:
+            def report(done, faces):
+                pbar.update(done - pbar.n)
+                pbar.set_postfix({"已发现人脸": faces})
+                if task:
+                    MaintenanceTask.objects.filter(id=task.id).update(progress=int(done / total * 80))
+
+            count, face_count, stats = run_face_process_pool(
+                rows,
+                workers=workers,
+                intra_op_threads=intra_op_threads,
+                chunk_size=options['chunk_size'],
+                progress_callback=report,
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"人脸扫描完成：共处理 {count} 张照片，发现 {face_count} 张人脸。"))
+        self.write_stage_report(stats)
+
+    def get_photo_rows(self, photo_ids):
+        """子进程不访问数据库：预先取出路径与类型"""
+        return face_scan_rows(photo_ids)
+
+    def write_stage_report(self, stats):
+        self.stdout.write("各阶段利用率 (忙碌 / 等待上游 / 等待下游，按该阶段工作者总时间计)：")
+        for stage in stats:
+            self.stdout.write(
+                f"  {stage['stage']:<10} x{stage['workers']:<3} 处理 {stage['items']:>6} 项  "
+                f"忙碌 {stage['utilization']:>6.1%}  饥饿 {stage['starved']:>6.1%}  阻塞 {stage['blocked']:>6.1%}  "
+                f"平均 {stage['avg_ms']} ms"
+            )
+        bottleneck = max(stats, key=lambda x: x['utilization'])
+        self.stdout.write(f"瓶颈阶段: {bottleneck['stage']} (可增加该阶段的并发数)")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from apps.photos.services.centroids import backfill_missing_centroids, rebuild_centroids, refresh_stale_centroids
+import time
+
+class Command(BaseCommand):
+    help = '重建人物特征中心 (均值 + 多样化中心)，默认只重算过期或缺失的人物'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='全量重建所有人物的特征中心')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+
+        def report(done, total):
+            if done % 100 == 0 or done == total:
+                self.stdout.write(f"进度: {done}/{total}")
+
+        if options['all']:
+            count = rebuild_centroids(progress_callback=report)
+        else:
+            count = refresh_stale_centroids() + backfill_missing_centroids(progress_callback=report)
+        self.stdout.write(self.style.SUCCESS(
+            f"完成！共重建 {count} 个人物的特征中心，耗时 {time.time() - start_time:.1f} 秒。"
+        ))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from apps.photos.services.tagging import tag_photos, get_tag_vocabulary, DEFAULT_TAG_BATCH_SIZE
+import time
+
+class Command(BaseCommand):
+    help = '基于已生成的 CLIP 语义向量为照片打零样本标签 (增量，只处理新照片)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task-id', type=str, help='系统维护任务 ID')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_TAG_BATCH_SIZE, help='每批打分的照片数量')
+        parser.add_argument('--rebuild', action='store_true', help='忽略已有标签，全部重新打分')
+
+    def handle(self, *args, **options):
+        task_id = options.get('task_id')
+        from apps.photos.models import MaintenanceTask
+        task = None
+        if task_id:
+            try:
+                task = MaintenanceTask.objects.get(id=task_id)
+            except MaintenanceTask.DoesNotExist:
+                pass
+
+        vocabulary = get_tag_vocabulary()
+        self.stdout.write(f"标签词表: {len(vocabulary.tags)} 个标签 (版本 {vocabulary.version})")
+
+        def report(done, total):
+            self.stdout.write(f"进度: {done}/{total}")
+            if task:
+                MaintenanceTask.objects.filter(id=task.id).update(progress=int(done / total * 100))
+
+        start_time = time.time()
+        processed = tag_photos(
+            rebuild=options['rebuild'],
+            batch_size=options['batch_size'],
+            progress_callback=report,
+        )
+        if processed is None:
+            self.stdout.write(self.style.ERROR("CLIP 模型不可用，无法编码标签词表。"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"完成！共为 {processed} 张照片打标签，耗时 {time.time() - start_time:.1f} 秒。"
+        ))
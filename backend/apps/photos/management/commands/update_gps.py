@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from apps.photos.models import Photo
 from apps.photos.services import get_gps_data
+from apps.photos.services.geo import mark_tiles_stale, refresh_stale_tiles
 from PIL import Image, ImageOps
 import os
 
@@ -39,6 +40,9 @@ class Command(BaseCommand):
                     if lat is not None and lon is not None:
                         # Update if changed or missing
                         if photo.latitude != lat or photo.longitude != lon:
+                            # 新旧坐标所在的地图瓦片都需要重算
+                            if photo.deleted_at is None:
+                                mark_tiles_stale([(photo.latitude, photo.longitude), (lat, lon)])
                             photo.latitude = lat
                             photo.longitude = lon
                             photo.location_name = "" # Reset location name to trigger reverse geocoding if needed
@@ -56,4 +60,6 @@ class Command(BaseCommand):
                     progress = int(((i + 1) / total) * 100)
                     MaintenanceTask.objects.filter(id=task.id).update(progress=progress)
 
+        if updated_count:
+            refresh_stale_tiles()
         self.stdout.write(self.style.SUCCESS(f"Successfully updated GPS for {updated_count} photos."))
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-19 14:47
+
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0021_face_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100, verbose_name='模型名称')),
+                ('query', models.CharField(max_length=255, verbose_name='查询文本')),
+                ('embedding', pgvector.django.vector.VectorField(dimensions=512, verbose_name='文本向量')),
+                ('hit_count', models.PositiveIntegerField(default=0, verbose_name='命中次数')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '文本向量缓存',
+                'verbose_name_plural': '文本向量缓存',
+                'constraints': [models.UniqueConstraint(fields=('model_name', 'query'), name='unique_text_embedding_query')],
+            },
+        ),
+    ]
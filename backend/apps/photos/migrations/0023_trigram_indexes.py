@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-19 14:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0022_textembedding'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.AddIndex(
+            model_name='album',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='album_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='person_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('location_name'), name='gin_trgm_ops'), name='photo_location_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('file_path'), name='gin_trgm_ops'), name='photo_file_path_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 14:49
+
+import pgvector.django.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0023_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_data'], m=16, name='photo_embedding_hnsw_idx', opclasses=['vector_cosine_ops']),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-19 14:52
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0024_photo_embedding_hnsw'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='phash',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True, verbose_name='感知哈希'),
+        ),
+        migrations.AlterField(
+            model_name='maintenancetask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片')], max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='scheduledtask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片')], max_length=100, verbose_name='任务类型'),
+        ),
+        migrations.CreateModel(
+            name='DuplicateGroup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('photo_count', models.PositiveIntegerField(default=0, verbose_name='照片数量')),
+                ('max_distance', models.PositiveSmallIntegerField(default=0, verbose_name='最大汉明距离')),
+                ('status', models.CharField(choices=[('pending', '待处理'), ('resolved', '已处理'), ('ignored', '已忽略')], db_index=True, default='pending', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('photos', models.ManyToManyField(related_name='duplicate_groups', to='photos.photo', verbose_name='照片')),
+            ],
+            options={
+                'verbose_name': '重复照片组',
+                'verbose_name_plural': '重复照片组',
+                'ordering': ['max_distance', '-photo_count', '-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-19 14:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0025_photo_phash_duplicategroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='tag_version',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=16, verbose_name='标签词表版本'),
+        ),
+        migrations.AlterField(
+            model_name='maintenancetask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片'), ('tag_photos', '生成照片标签')], max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='scheduledtask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片'), ('tag_photos', '生成照片标签')], max_length=100, verbose_name='任务类型'),
+        ),
+        migrations.CreateModel(
+            name='PhotoTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=64, verbose_name='标签')),
+                ('score', models.FloatField(verbose_name='置信度')),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='photos.photo', verbose_name='照片')),
+            ],
+            options={
+                'verbose_name': '照片标签',
+                'verbose_name_plural': '照片标签',
+                'indexes': [models.Index(fields=['tag', '-score'], name='phototag_tag_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('photo', 'tag'), name='unique_photo_tag')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0026_phototag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='face_gated',
+            field=models.BooleanField(default=False, verbose_name='预筛跳过人脸检测'),
+        ),
+    ]
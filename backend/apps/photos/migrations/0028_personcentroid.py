@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-19 15:08
+
+import django.db.models.deletion
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0027_photo_face_gated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonCentroid',
+            fields=[
+                ('person', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='centroid', serialize=False, to='photos.person', verbose_name='人物')),
+                ('centroid', pgvector.django.vector.VectorField(dimensions=512, verbose_name='均值向量')),
+                ('embedding_sum', pgvector.django.vector.VectorField(dimensions=512, verbose_name='向量和')),
+                ('centers', models.BinaryField(verbose_name='多样化中心')),
+                ('center_counts', models.JSONField(default=list, verbose_name='中心人脸数')),
+                ('face_count', models.PositiveIntegerField(default=0, verbose_name='人脸数')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='版本')),
+                ('is_stale', models.BooleanField(db_index=True, default=False, verbose_name='待重算')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '人物特征中心',
+                'verbose_name_plural': '人物特征中心',
+                'indexes': [pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['centroid'], m=16, name='personcentroid_hnsw_idx', opclasses=['vector_cosine_ops'])],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-19 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0028_personcentroid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='照片数量'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='representative_face',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='photos.face', verbose_name='代表人脸'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['is_hidden', '-is_starred', '-photo_count', '-created_at'], name='person_list_idx'),
+        ),
+        # 回填已有人物的照片数与代表人脸
+        migrations.RunSQL(
+            sql="""
+                UPDATE photos_person p SET
+                    photo_count = (SELECT COUNT(DISTINCT f.photo_id) FROM photos_face f WHERE f.person_id = p.id),
+                    representative_face_id = (
+                        SELECT f.id FROM photos_face f WHERE f.person_id = p.id
+                        ORDER BY COALESCE(f.photo_id = p.avatar_id, FALSE) DESC, f.prob DESC LIMIT 1
+                    )
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 17:05
+
+import pgvector.django.halfvec
+import pgvector.django.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0029_person_representative_face_photo_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='face',
+            name='embedding_half',
+            field=pgvector.django.halfvec.HalfVectorField(blank=True, dimensions=512, null=True, verbose_name='特征向量 (半精度)'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='embedding_data_half',
+            field=pgvector.django.halfvec.HalfVectorField(blank=True, dimensions=512, null=True, verbose_name='语义向量 (半精度)'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_data_half'], m=16, name='photo_embedding_half_hnsw_idx', opclasses=['halfvec_cosine_ops']),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0030_halfvec_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='face',
+            name='quality',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='质量分'),
+        ),
+        migrations.AddField(
+            model_name='face',
+            name='sharpness',
+            field=models.FloatField(blank=True, null=True, verbose_name='清晰度'),
+        ),
+    ]
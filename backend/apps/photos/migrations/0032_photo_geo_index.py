@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0031_face_quality'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('latitude__isnull', False), ('longitude__isnull', False)), fields=['latitude', 'longitude'], include=('id', 'captured_at'), name='photo_geo_idx'),
+        ),
+    ]
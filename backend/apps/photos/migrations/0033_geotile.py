@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-19 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0032_photo_geo_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='maintenancetask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片'), ('tag_photos', '生成照片标签'), ('build_geo_tiles', '生成地图瓦片')], max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='scheduledtask',
+            name='name',
+            field=models.CharField(choices=[('scan_photos', '扫描照片'), ('process_faces', '人脸识别'), ('cluster_people', '人脸聚类'), ('generate_memories', '生成回忆'), ('cleanup_trash', '清空回收站'), ('update_gps', '更新GPS信息'), ('process_embeddings', '生成语义向量'), ('find_duplicates', '查找重复照片'), ('tag_photos', '生成照片标签'), ('build_geo_tiles', '生成地图瓦片')], max_length=100, verbose_name='任务类型'),
+        ),
+        migrations.CreateModel(
+            name='GeoTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('z', models.PositiveSmallIntegerField(verbose_name='缩放级别')),
+                ('x', models.PositiveIntegerField(verbose_name='瓦片列')),
+                ('y', models.PositiveIntegerField(verbose_name='瓦片行')),
+                ('cells', models.JSONField(default=list, verbose_name='网格')),
+                ('photo_count', models.PositiveIntegerField(default=0, verbose_name='照片数量')),
+                ('is_stale', models.BooleanField(db_index=True, default=False, verbose_name='待重算')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '地图瓦片',
+                'verbose_name_plural': '地图瓦片',
+                'constraints': [models.UniqueConstraint(fields=('z', 'x', 'y'), name='unique_geotile')],
+            },
+        ),
+    ]
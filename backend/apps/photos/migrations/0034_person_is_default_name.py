@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0033_geotile'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_list_idx',
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='is_default_name',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(name__regex='^人物_\\d+$', then=models.Value(True)), default=models.Value(False)), output_field=models.BooleanField(), verbose_name='默认名称'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['is_hidden', '-is_starred', 'is_default_name', '-photo_count', '-created_at'], name='person_list_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-19 21:45
+
+from django.db import migrations
+
+
+def build_geotile_pyramid(apps, schema_editor):
+    """升级时为已有的带坐标照片生成瓦片金字塔，否则地图在手动运行 build_geo_tiles 之前为空"""
+    Photo = apps.get_model('photos', 'Photo')
+    GeoTile = apps.get_model('photos', 'GeoTile')
+    if GeoTile.objects.exists():
+        return
+    if not Photo.objects.filter(deleted_at__isnull=True, latitude__isnull=False, longitude__isnull=False).exists():
+        return
+    from apps.photos.services.geo import build_pyramid
+    build_pyramid()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0034_person_is_default_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_geotile_pyramid, migrations.RunPython.noop),
+    ]
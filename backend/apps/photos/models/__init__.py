@@ -1,9 +1,13 @@
 from .library import Library
 from .photo import Photo
 from .album import Album
-from .face import Person, Face
+from .face import Person, Face, PersonCentroid
 from .memory import Memory
 from .tasks import MaintenanceTask, ScheduledTask
+from .search import TextEmbedding
+from .duplicates import DuplicateGroup
+from .tags import PhotoTag
+from .geo import GeoTile
 
 __all__ = [
     'Library',
@@ -11,7 +15,12 @@ __all__ = [
     'Album',
     'Person',
     'Face',
+    'PersonCentroid',
     'Memory',
     'MaintenanceTask',
     'ScheduledTask',
+    'TextEmbedding',
+    'DuplicateGroup',
+    'PhotoTag',
+    'GeoTile',
 ]
@@ -1,5 +1,7 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 
 class Album(models.Model):
     """相册模型"""
@@ -15,6 +17,10 @@ class Album(models.Model):
         verbose_name = "相册"
         verbose_name_plural = "相册"
         ordering = ['-created_at']
+        indexes = [
+            # 相册名称模糊搜索 (icontains) 使用的三元组索引
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='album_name_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
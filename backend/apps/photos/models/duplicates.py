@@ -0,0 +1,27 @@
+import uuid
+from django.db import models
+
+class DuplicateGroup(models.Model):
+    """近似重复照片分组：由感知哈希 (dHash) 汉明距离查找得到，等待用户审核"""
+    class Status(models.TextChoices):
+        PENDING = 'pending', '待处理'
+        RESOLVED = 'resolved', '已处理'
+        IGNORED = 'ignored', '已忽略'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    photos = models.ManyToManyField('photos.Photo', related_name='duplicate_groups', verbose_name="照片")
+    photo_count = models.PositiveIntegerField(default=0, verbose_name="照片数量")
+    # 组内任意两张照片间最大的汉明距离，0 表示哈希完全一致
+    max_distance = models.PositiveSmallIntegerField(default=0, verbose_name="最大汉明距离")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, db_index=True, verbose_name="状态")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "重复照片组"
+        verbose_name_plural = "重复照片组"
+        ordering = ['max_distance', '-photo_count', '-created_at']
+
+    def __str__(self):
+        return f"{self.photo_count} 张相似照片 ({self.get_status_display()})"
@@ -1,6 +1,10 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
-from pgvector.django import VectorField
+from django.db.models import Case, Value, When
+from django.db.models.functions import Upper
+from pgvector.django import HalfVectorField, VectorField, HnswIndex
+from apps.photos.utils import embedding_write_fields, face_vector_field, get_embedding_storage, vector_to_numpy
 
 class Person(models.Model):
     """人物模型"""
@@ -16,22 +20,39 @@ class Person(models.Model):
     
     # 忽略的合并建议
     ignored_merges = models.ManyToManyField('self', symmetrical=True, blank=True, verbose_name="忽略的合并建议")
+
+    # 冗余字段，由聚类、合并、归属变更流程维护 (见 PersonService.refresh_person_stats)，人物列表无需再读取人脸
+    # 代表人脸：优先头像照片中的人脸，其次置信度最高的人脸
+    representative_face = models.ForeignKey('photos.Face', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="代表人脸")
+    photo_count = models.PositiveIntegerField(default=0, verbose_name="照片数量")
+    # 是否为聚类时生成的默认名称 (人物_数字)，由数据库根据 name 计算，改名与批量创建时自动更新
+    is_default_name = models.GeneratedField(
+        expression=Case(When(name__regex=r'^人物_\d+$', then=Value(True)), default=Value(False)),
+        output_field=models.BooleanField(),
+        db_persist=True,
+        verbose_name="默认名称",
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         verbose_name = "人物"
         verbose_name_plural = "人物"
+        indexes = [
+            # 人物名称模糊搜索 (icontains) 使用的三元组索引
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='person_name_trgm_idx'),
+            # 人物列表：按隐藏状态过滤，列顺序与列表排序一致 (标星优先、已命名优先、照片数降序、创建时间降序)
+            models.Index(fields=['is_hidden', '-is_starred', 'is_default_name', '-photo_count', '-created_at'], name='person_list_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     def sync_photos(self):
-        """将所有通过 Face 关联的照片也同步到 photos ManyToMany 字段中"""
-        face_photo_ids = self.faces.values_list('photo_id', flat=True).distinct()
-        if face_photo_ids:
-            self.photos.add(*face_photo_ids)
-        return len(face_photo_ids)
+        """将所有通过 Face 关联的照片也同步到 photos ManyToMany 字段中，返回新增的关联数"""
+        from apps.photos.services.people import PersonService
+        added, _ = PersonService.sync_person_photos(person_ids=[self.id], cleanup=False)
+        return added
 
     def ensure_avatar(self):
         """确保人物有头像，如果缺失则自动挑选一个"""
@@ -54,56 +75,12 @@ class Person(models.Model):
             
         return None
 
-    @property
-    def representative_face(self):
-        """获取该人物的代表性人脸（优先选择置信度最高的人脸，如果设置了头像照片，则优先使用头像照片中的人脸）"""
-        # 如果设置了头像照片，优先查找头像照片中的人脸
-        if self.avatar_id:
-            if hasattr(self, 'prefetched_faces'):
-                 # 在预加载的列表中查找
-                 for face in self.prefetched_faces:
-                     if face.photo_id == self.avatar_id:
-                         return face
-            else:
-                # 注意：这里假设一个人在同一张照片中只有一个 Face 归属自己
-                # 如果有多个，可能需要更复杂的逻辑，但通常同一张照片不会有同一个人的多张脸
-                avatar_face = self.faces.filter(photo_id=self.avatar_id).first()
-                if avatar_face:
-                    return avatar_face
-
-        if hasattr(self, 'prefetched_faces'):
-            return self.prefetched_faces[0] if self.prefetched_faces else None
-        return self.faces.order_by('-prob').first()
-
     def merge_with(self, other_person):
-        """将当前人物合并到另一个人物"""
+        """将当前人物合并到另一个人物 (照片、人脸、头像、忽略的合并建议与特征中心，见 PersonService.merge_people)"""
         if self == other_person:
             return
-            
-        # 1. 批量转移所有照片关联 (使用 *args 批量添加)
-        photo_ids = self.photos.values_list('id', flat=True)
-        if photo_ids:
-            other_person.photos.add(*photo_ids)
-            
-        # 2. 批量转移所有面孔关联 (直接 update)
-        self.faces.update(person=other_person)
-        
-        # 3. 如果对方没有头像，把自己的头像给它
-        if not other_person.avatar and self.avatar:
-            other_person.avatar = self.avatar
-            other_person.save(update_fields=['avatar'])
-            
-        # 4. 转移忽略的合并建议 (ManyToMany)
-        # 获取对方已有的忽略列表
-        other_ignored = set(other_person.ignored_merges.values_list('id', flat=True))
-        self_ignored = self.ignored_merges.values_list('id', flat=True)
-        # 过滤掉已有的和对方自己
-        new_ignored = [pid for pid in self_ignored if pid != other_person.id and pid not in other_ignored]
-        if new_ignored:
-            other_person.ignored_merges.add(*new_ignored)
-
-        # 5. 删除自己
-        self.delete()
+        from apps.photos.services.people import PersonService
+        PersonService.merge_people(other_person, [self.id])
 
 class Face(models.Model):
     """人脸模型：存储照片中检测到的人脸"""
@@ -116,9 +93,15 @@ class Face(models.Model):
     
     # 检测置信度
     prob = models.FloatField(default=0.0, db_index=True, verbose_name="置信度")
+    # 质量分 (0~1，检测置信度 x 相对尺寸 x 清晰度，见 services/face_quality)，旧数据为空
+    quality = models.FloatField(null=True, blank=True, db_index=True, verbose_name="质量分")
+    # 人脸区域的拉普拉斯方差
+    sharpness = models.FloatField(null=True, blank=True, verbose_name="清晰度")
     
     # 人脸特征向量 (通常为 128 或 512 维)
     embedding = VectorField(dimensions=512, null=True, blank=True, verbose_name="特征向量")
+    # 同一向量的 float16 存储 (halfvec)，由 EMBEDDING_STORAGE 决定读写哪一列
+    embedding_half = HalfVectorField(dimensions=512, null=True, blank=True, verbose_name="特征向量 (半精度)")
     
     # 视频相关
     timestamp = models.FloatField(null=True, blank=True, verbose_name="视频时间点(秒)")
@@ -130,9 +113,54 @@ class Face(models.Model):
         verbose_name_plural = "人脸"
 
     def set_embedding(self, embedding_array):
-        """保存向量"""
-        self.embedding = embedding_array
+        """保存向量，按存储模式写入 float32 与 / 或 halfvec 列"""
+        mode = get_embedding_storage()
+        if mode != 'halfvec':
+            self.embedding = embedding_array
+        if mode != 'vector':
+            self.embedding_half = embedding_array
+
+    @staticmethod
+    def embedding_fields():
+        """set_embedding 之后 save(update_fields=...) 需要保存的向量列"""
+        return embedding_write_fields('embedding', 'embedding_half')
 
     def get_embedding(self):
-        """获取向量"""
-        return self.embedding
+        """获取向量 (float32 数组，从当前存储模式读取的列)"""
+        return vector_to_numpy(getattr(self, face_vector_field()))
+
+class PersonCentroid(models.Model):
+    """
+    人物特征中心：人脸向量的均值与若干多样化中心 (正脸、侧脸等)
+    在人脸归属变化时增量维护，匹配与合并建议直接读取，无需每次加载人物的全部人脸
+    """
+    person = models.OneToOneField(Person, on_delete=models.CASCADE, primary_key=True, related_name='centroid', verbose_name="人物")
+    # 归一化后的均值向量，带 HNSW 索引，用于相似人物检索
+    centroid = VectorField(dimensions=512, verbose_name="均值向量")
+    # 归一化人脸向量之和，增量加减人脸时据此更新均值
+    embedding_sum = VectorField(dimensions=512, verbose_name="向量和")
+    # 多样化中心：(k, 512) float32 原始字节，以及每个中心代表的人脸数
+    centers = models.BinaryField(verbose_name="多样化中心")
+    center_counts = models.JSONField(default=list, verbose_name="中心人脸数")
+    face_count = models.PositiveIntegerField(default=0, verbose_name="人脸数")
+    # 每次更新加一，可用于判断缓存是否过期
+    version = models.PositiveIntegerField(default=0, verbose_name="版本")
+    # 人脸被级联删除等无法增量维护的情况下标记，下次读取前全量重算
+    is_stale = models.BooleanField(default=False, db_index=True, verbose_name="待重算")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "人物特征中心"
+        verbose_name_plural = "人物特征中心"
+        indexes = [
+            HnswIndex(
+                name='personcentroid_hnsw_idx',
+                fields=['centroid'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops'],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.person_id} ({self.face_count})"
@@ -0,0 +1,25 @@
+from django.db import models
+
+class GeoTile(models.Model):
+    """
+    地图瓦片金字塔：每个缩放级别、每个 Web 墨卡托瓦片 (z/x/y) 内的网格聚合结果
+    由 build_geo_tiles 全量生成，照片导入、删除或坐标变化时标记受影响的瓦片并自底向上重算；没有照片的瓦片不保存
+    """
+    z = models.PositiveSmallIntegerField(verbose_name="缩放级别")
+    x = models.PositiveIntegerField(verbose_name="瓦片列")
+    y = models.PositiveIntegerField(verbose_name="瓦片行")
+    # 网格列表 [[格内列, 格内行, 封面照片 ID, 平均纬度, 平均经度, 照片数, 封面拍摄时间戳], ...]
+    cells = models.JSONField(default=list, verbose_name="网格")
+    photo_count = models.PositiveIntegerField(default=0, verbose_name="照片数量")
+    is_stale = models.BooleanField(default=False, db_index=True, verbose_name="待重算")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "地图瓦片"
+        verbose_name_plural = "地图瓦片"
+        constraints = [
+            models.UniqueConstraint(fields=['z', 'x', 'y'], name='unique_geotile'),
+        ]
+
+    def __str__(self):
+        return f"{self.z}/{self.x}/{self.y} ({self.photo_count})"
@@ -1,11 +1,16 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
-from pgvector.django import VectorField
+from django.db.models.functions import Upper
+from pgvector.django import HalfVectorField, VectorField, HnswIndex
+from apps.photos.utils import embedding_write_fields, get_embedding_storage, photo_vector_field, vector_to_numpy
 
 class Photo(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file_path = models.CharField(max_length=512, unique=True, help_text="Physical path on disk")
     hash_md5 = models.CharField(max_length=32, unique=True, db_index=True)
+    # 64 位感知哈希 (dHash)，用于查找缩放/重新压缩后的近似重复照片
+    phash = models.BigIntegerField(null=True, blank=True, db_index=True, verbose_name="感知哈希")
     captured_at = models.DateTimeField(null=True, blank=True, db_index=True)
     
     # Live Photo / Motion Photo support
@@ -29,9 +34,15 @@ class Photo(models.Model):
     # 聚类相关
     # CLIP 语义特征向量 (512维 for ViT-B-32)
     embedding_data = VectorField(dimensions=512, null=True, blank=True, verbose_name="语义向量")
+    # 同一向量的 float16 存储 (halfvec)，由 EMBEDDING_STORAGE 决定读写哪一列
+    embedding_data_half = HalfVectorField(dimensions=512, null=True, blank=True, verbose_name="语义向量 (半精度)")
+    # 打标签时使用的词表版本，与当前词表不一致 (或向量更新后被清空) 的照片需要重新打标签
+    tag_version = models.CharField(max_length=16, blank=True, default='', db_index=True, verbose_name="标签词表版本")
     
     # 扫描标记
     face_scanned = models.BooleanField(default=False, db_index=True, verbose_name="已扫描人脸")
+    # 由 CLIP 预筛判定为无人而跳过了人脸检测 (face_scanned 同时为 True)
+    face_gated = models.BooleanField(default=False, verbose_name="预筛跳过人脸检测")
     
     # Metadata
     width = models.PositiveIntegerField(null=True, blank=True)
@@ -48,6 +59,32 @@ class Photo(models.Model):
         indexes = [
             models.Index(fields=['captured_at']),
             models.Index(fields=['hash_md5']),
+            # 地图网格聚合：只含未删除且有坐标的照片，附带 id 与拍摄时间，可只扫描索引完成聚合
+            models.Index(
+                fields=['latitude', 'longitude'],
+                include=['id', 'captured_at'],
+                condition=models.Q(deleted_at__isnull=True, latitude__isnull=False, longitude__isnull=False),
+                name='photo_geo_idx',
+            ),
+            # pg_trgm 三元组索引：Django 的 icontains 会生成 UPPER(col) LIKE UPPER('%q%')，
+            # 对 UPPER(col) 建 gin_trgm_ops 表达式索引后，前置通配符的模糊匹配也能走索引
+            GinIndex(OpClass(Upper('location_name'), name='gin_trgm_ops'), name='photo_location_trgm_idx'),
+            GinIndex(OpClass(Upper('file_path'), name='gin_trgm_ops'), name='photo_file_path_trgm_idx'),
+            # 语义向量 HNSW 近似最近邻索引 (余弦距离)，用于文本搜索与相似照片推荐
+            HnswIndex(
+                name='photo_embedding_hnsw_idx',
+                fields=['embedding_data'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops'],
+            ),
+            HnswIndex(
+                name='photo_embedding_half_hnsw_idx',
+                fields=['embedding_data_half'],
+                m=16,
+                ef_construction=64,
+                opclasses=['halfvec_cosine_ops'],
+            ),
         ]
 
     def __str__(self):
@@ -65,9 +102,19 @@ class Photo(models.Model):
         return (bool(self.video_path) and not self.is_live_photo)
 
     def set_embedding(self, embedding_array):
-        """保存特征向量"""
-        self.embedding_data = embedding_array
+        """保存特征向量 (向量变化后标签需重新计算)，按存储模式写入 float32 与 / 或 halfvec 列"""
+        mode = get_embedding_storage()
+        if mode != 'halfvec':
+            self.embedding_data = embedding_array
+        if mode != 'vector':
+            self.embedding_data_half = embedding_array
+        self.tag_version = ''
+
+    @staticmethod
+    def embedding_fields():
+        """set_embedding 之后 save(update_fields=...) 需要保存的向量列"""
+        return embedding_write_fields('embedding_data', 'embedding_data_half')
 
     def get_embedding(self):
-        """获取特征向量"""
-        return self.embedding_data
+        """获取特征向量 (float32 数组，从当前存储模式读取的列)"""
+        return vector_to_numpy(getattr(self, photo_vector_field()))
@@ -0,0 +1,23 @@
+from django.db import models
+from pgvector.django import VectorField
+
+class TextEmbedding(models.Model):
+    """CLIP 文本向量缓存：避免热门/重复搜索词反复调用文本编码器"""
+    model_name = models.CharField(max_length=100, verbose_name="模型名称")
+    # 归一化后的查询文本 (去除首尾空白、合并空格、转小写)
+    query = models.CharField(max_length=255, verbose_name="查询文本")
+    embedding = VectorField(dimensions=512, verbose_name="文本向量")
+
+    hit_count = models.PositiveIntegerField(default=0, verbose_name="命中次数")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "文本向量缓存"
+        verbose_name_plural = "文本向量缓存"
+        constraints = [
+            models.UniqueConstraint(fields=['model_name', 'query'], name='unique_text_embedding_query'),
+        ]
+
+    def __str__(self):
+        return f"{self.query} ({self.model_name})"
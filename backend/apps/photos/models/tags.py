@@ -0,0 +1,23 @@
+from django.db import models
+
+class PhotoTag(models.Model):
+    """零样本标签索引：由已存储的 CLIP 图像向量与标签词表的文本向量打分得到"""
+    photo = models.ForeignKey('photos.Photo', on_delete=models.CASCADE, related_name='tags', verbose_name="照片")
+    # 词表中的标签键 (英文，如 food / beach / cat)
+    tag = models.CharField(max_length=64, verbose_name="标签")
+    # 在整个词表上 softmax 后的概率
+    score = models.FloatField(verbose_name="置信度")
+
+    class Meta:
+        verbose_name = "照片标签"
+        verbose_name_plural = "照片标签"
+        constraints = [
+            models.UniqueConstraint(fields=['photo', 'tag'], name='unique_photo_tag'),
+        ]
+        indexes = [
+            # 按标签筛选并按置信度排序：纯 B-tree 查找，无需向量扫描
+            models.Index(fields=['tag', '-score'], name='phototag_tag_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} ({self.score:.2f})"
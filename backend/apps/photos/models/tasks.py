@@ -11,6 +11,9 @@ class MaintenanceTask(models.Model):
         ('cleanup_trash', '清空回收站'),
         ('update_gps', '更新GPS信息'),
         ('process_embeddings', '生成语义向量'),
+        ('find_duplicates', '查找重复照片'),
+        ('tag_photos', '生成照片标签'),
+        ('build_geo_tiles', '生成地图瓦片'),
     ]
     
     STATUS_CHOICES = [
@@ -0,0 +1,73 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class RankedCursorPagination:
+    """
+    排序结果的游标分页
+    用于搜索/相似推荐等"按得分排序"的列表：游标中只记录偏移量，
+    配合缓存的排序结果或索引扫描使用，翻页时无需重新计算整个列表
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = '无效的分页游标'
+
+    def __init__(self, request):
+        self.request = request
+        self.offset = self.decode_cursor()
+        self.limit = self.get_page_size()
+
+    def get_page_size(self):
+        try:
+            size = int(self.request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self):
+        encoded = self.request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            offset = int(parse.parse_qs(querystring, keep_blank_values=True)['o'][0])
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+        if offset < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return offset
+
+    def encode_cursor(self, offset):
+        querystring = parse.urlencode({'o': offset}, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        previous_offset = max(0, self.offset - self.limit)
+        if previous_offset == 0:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(previous_offset)
+
+    def paginate_list(self, items):
+        """对已完整排序的列表分页"""
+        page = items[self.offset:self.offset + self.limit]
+        has_next = self.offset + self.limit < len(items)
+        return page, has_next
+
+    def slice_bounds(self):
+        """对可切片的查询分页：多取一条用于判断是否还有下一页"""
+        return self.offset, self.offset + self.limit + 1
+
+    def get_response_data(self, results, has_next):
+        return {
+            'next': self.encode_cursor(self.offset + self.limit) if has_next else None,
+            'previous': self.get_previous_link(),
+            'results': results,
+        }
@@ -1,19 +1,22 @@
 from .face import FaceSerializer
-from .photo import PhotoSerializer, SimplePhotoSerializer
+from .photo import PhotoSerializer, SimplePhotoSerializer, PhotoSearchResultSerializer
 from .person import PersonSerializer
 from .album import AlbumSerializer
 from .memory import MemorySerializer
 from .library import LibrarySerializer
 from .tasks import ScheduledTaskSerializer, MaintenanceTaskSerializer
+from .duplicates import DuplicateGroupSerializer
 
 __all__ = [
     'FaceSerializer',
     'PhotoSerializer',
     'SimplePhotoSerializer',
+    'PhotoSearchResultSerializer',
     'PersonSerializer',
     'AlbumSerializer',
     'MemorySerializer',
     'LibrarySerializer',
     'ScheduledTaskSerializer',
     'MaintenanceTaskSerializer',
+    'DuplicateGroupSerializer',
 ]
@@ -0,0 +1,20 @@
+from rest_framework import serializers
+from apps.photos.models import DuplicateGroup, Photo
+
+class DuplicatePhotoSerializer(serializers.ModelSerializer):
+    """重复组内的照片：附带分辨率与文件大小，便于用户挑选保留哪一张"""
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Photo
+        fields = ['id', 'thumbnail', 'file_path', 'captured_at', 'width', 'height', 'size']
+
+    def get_thumbnail(self, obj):
+        return f"/photo/{obj.id}/serve/?size=300&crop=1"
+
+class DuplicateGroupSerializer(serializers.ModelSerializer):
+    photos = DuplicatePhotoSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = DuplicateGroup
+        fields = ['id', 'photo_count', 'max_distance', 'status', 'photos', 'created_at']
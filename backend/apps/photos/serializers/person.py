@@ -4,7 +4,7 @@ from .photo import SimplePhotoSerializer
 
 class PersonSerializer(serializers.ModelSerializer):
     avatar = SimplePhotoSerializer(read_only=True)
-    photo_count = serializers.IntegerField(source='photos.count', read_only=True)
+    photo_count = serializers.IntegerField(read_only=True)
     face_url = serializers.SerializerMethodField()
 
     class Meta:
@@ -12,7 +12,6 @@ class PersonSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'avatar', 'photo_count', 'created_at', 'face_url', 'is_starred']
 
     def get_face_url(self, obj):
-        face = obj.representative_face
-        if face:
-            return f"/face/{face.id}/crop/"
+        if obj.representative_face_id:
+            return f"/face/{obj.representative_face_id}/crop/"
         return None
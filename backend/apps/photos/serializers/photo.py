@@ -13,6 +13,15 @@ class SimplePhotoSerializer(serializers.ModelSerializer):
     def get_thumbnail(self, obj):
         return f"/photo/{obj.id}/serve/?size=300&crop=1"
 
+class PhotoSearchResultSerializer(serializers.Serializer):
+    """搜索/相似推荐结果的轻量表示：只返回 ID、缩略图地址和得分，不查询照片详情"""
+    id = serializers.UUIDField()
+    thumbnail = serializers.SerializerMethodField()
+    score = serializers.FloatField()
+
+    def get_thumbnail(self, obj):
+        return f"/photo/{obj['id']}/serve/?size=300&crop=1"
+
 class PhotoSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     thumbnail = serializers.SerializerMethodField()
@@ -1,11 +1,20 @@
 from .hardware import check_gpu_availability
-from .embeddings import get_clip_model, search_photos_by_text, generate_photo_embedding
+from .embeddings import (
+    get_clip_model, 
+    search_photos_by_text, 
+    generate_photo_embedding, 
+    encode_text, 
+    encode_texts, 
+    get_text_embedding_cache
+)
 from .faces import (
     FaceDetectorWrapper, 
     get_face_detector, 
     cluster_faces, 
     scan_all_faces, 
     detect_faces_in_photo, 
+    detect_faces_in_photos, 
+    save_face_results, 
     extract_face_embedding
 )
 from .scanner import (
@@ -15,6 +24,20 @@ from .scanner import (
     get_exif_details, 
     extract_date_from_filename
 )
+from .search import (
+    keyword_search_queryset, 
+    keyword_search_photos, 
+    reciprocal_rank_fusion, 
+    hybrid_search, 
+    get_hybrid_ranking, 
+    similar_photo_queryset
+)
+from .tagging import (
+    get_tag_vocabulary, 
+    tag_photos, 
+    photo_ids_for_tags, 
+    tag_summary
+)
 from .people import PersonService
 from .memories import MemoryService
 from .recommendations import get_all_recommendations
@@ -25,17 +48,32 @@ __all__ = [
     'get_clip_model',
     'search_photos_by_text',
     'generate_photo_embedding',
+    'encode_text',
+    'encode_texts',
+    'get_text_embedding_cache',
     'FaceDetectorWrapper',
     'get_face_detector',
     'cluster_faces',
     'scan_all_faces',
     'detect_faces_in_photo',
+    'detect_faces_in_photos',
+    'save_face_results',
     'extract_face_embedding',
     'scan_directory',
     'process_single_file',
     'get_gps_data',
     'get_exif_details',
     'extract_date_from_filename',
+    'keyword_search_queryset',
+    'keyword_search_photos',
+    'reciprocal_rank_fusion',
+    'hybrid_search',
+    'get_hybrid_ranking',
+    'similar_photo_queryset',
+    'get_tag_vocabulary',
+    'tag_photos',
+    'photo_ids_for_tags',
+    'tag_summary',
     'PersonService',
     'MemoryService',
     'get_all_recommendations',
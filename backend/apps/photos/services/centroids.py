@@ -0,0 +1,282 @@
+import numpy as np
+from django.db import connection, transaction
+from pgvector.django import CosineDistance
+from apps.photos.models import PersonCentroid
+from apps.photos.utils import face_vector_field, hnsw_search_session
+from .embedding_loader import load_face_embeddings
+
+# 每个人物最多保留的多样化中心数
+MAX_CENTERS = 5
+# 每 20 张人脸增加一个中心
+FACES_PER_CENTER = 20
+# 人脸少于该数量时只保留均值一个中心
+MIN_FACES_FOR_CENTERS = 10
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+
+def center_count_for(face_count):
+    """人脸数对应的中心数量"""
+    if face_count < MIN_FACES_FOR_CENTERS:
+        return 1
+    return max(1, min(MAX_CENTERS, face_count // FACES_PER_CENTER, face_count))
+
+def compute_centers(embeddings, n_clusters=None, sample_weight=None):
+    """
+    用 KMeans 提取多样化中心 (正脸、侧脸等)
+    embeddings: (N, 512) 已归一化
+    返回 (中心矩阵 (k, 512), 每个中心的人脸数列表)
+    """
+    total = int(sample_weight.sum()) if sample_weight is not None else len(embeddings)
+    if n_clusters is None:
+        n_clusters = center_count_for(total)
+    n_clusters = min(n_clusters, len(embeddings))
+    if n_clusters <= 1:
+        return np.average(embeddings, axis=0, weights=sample_weight)[None, :].astype(np.float32), [total]
+    try:
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=n_clusters, n_init=5, random_state=42).fit(embeddings, sample_weight=sample_weight)
+        weights = sample_weight if sample_weight is not None else np.ones(len(embeddings))
+        counts = np.bincount(kmeans.labels_, weights=weights, minlength=n_clusters)
+        keep = counts > 0
+        return kmeans.cluster_centers_[keep].astype(np.float32), [int(round(c)) for c in counts[keep]]
+    except Exception as e:
+        print(f"KMeans failed: {e}, falling back to mean.")
+        return np.average(embeddings, axis=0, weights=sample_weight)[None, :].astype(np.float32), [total]
+
+def get_centers(centroid):
+    """读取人物的多样化中心矩阵 (k, 512)"""
+    return np.frombuffer(bytes(centroid.centers), dtype=np.float32).reshape(-1, 512)
+
+def _set_centers(centroid, centers, counts):
+    centroid.centers = np.ascontiguousarray(centers, dtype=np.float32).tobytes()
+    centroid.center_counts = [int(c) for c in counts]
+
+def _set_mean(centroid, embedding_sum, face_count):
+    centroid.embedding_sum = np.asarray(embedding_sum, dtype=np.float32).tolist()
+    centroid.centroid = _normalize(embedding_sum)[0].tolist()
+    centroid.face_count = face_count
+
+def _person_embeddings(person_id):
+    loaded = load_face_embeddings(person_ids=[person_id])
+    return _normalize(loaded.matrix) if len(loaded) else None
+
+def build_centroid(person_id, embeddings):
+    """由人脸向量构建 (未保存的) 人物特征中心"""
+    embeddings = _normalize(embeddings)
+    centroid = PersonCentroid(person_id=person_id)
+    _set_mean(centroid, embeddings.sum(axis=0), len(embeddings))
+    _set_centers(centroid, *compute_centers(embeddings))
+    return centroid
+
+def rebuild_person_centroid(person_id):
+    """从该人物的全部人脸全量重算特征中心，没有人脸时删除"""
+    embeddings = _person_embeddings(person_id)
+    if embeddings is None:
+        PersonCentroid.objects.filter(person_id=person_id).delete()
+        return None
+    centroid = build_centroid(person_id, embeddings)
+    previous = PersonCentroid.objects.filter(person_id=person_id).values_list('version', flat=True).first()
+    centroid.version = (previous or 0) + 1
+    centroid.save()
+    return centroid
+
+def add_faces_to_centroid(person_id, embeddings):
+    """
+    人脸归入人物后增量更新：均值按向量和更新，新人脸按在线 KMeans 并入最近的中心
+    人脸数增长到需要更多中心时全量重算
+    """
+    embeddings = _normalize(embeddings)
+    if len(embeddings) == 0:
+        return
+    with transaction.atomic():
+        centroid = PersonCentroid.objects.select_for_update().filter(person_id=person_id).first()
+        if centroid is None or centroid.is_stale:
+            rebuild_person_centroid(person_id)
+            return
+
+        face_count = centroid.face_count + len(embeddings)
+        if center_count_for(face_count) > len(centroid.center_counts):
+            rebuild_person_centroid(person_id)
+            return
+
+        _set_mean(centroid, np.asarray(centroid.embedding_sum, dtype=np.float32) + embeddings.sum(axis=0), face_count)
+        centers = get_centers(centroid).copy()
+        counts = list(centroid.center_counts)
+        for vec in embeddings:
+            j = int(np.argmax(_normalize(centers) @ vec))
+            counts[j] += 1
+            centers[j] += (vec - centers[j]) / counts[j]
+        _set_centers(centroid, centers, counts)
+        centroid.version += 1
+        centroid.save()
+
+def remove_faces_from_centroid(person_id, embeddings):
+    """人脸移出人物后增量更新：从向量和与最近的中心中减去这些人脸"""
+    embeddings = _normalize(embeddings)
+    if len(embeddings) == 0:
+        return
+    with transaction.atomic():
+        centroid = PersonCentroid.objects.select_for_update().filter(person_id=person_id).first()
+        if centroid is None or centroid.is_stale:
+            rebuild_person_centroid(person_id)
+            return
+
+        face_count = centroid.face_count - len(embeddings)
+        if face_count <= 0:
+            rebuild_person_centroid(person_id)
+            return
+
+        _set_mean(centroid, np.asarray(centroid.embedding_sum, dtype=np.float32) - embeddings.sum(axis=0), face_count)
+        centers = get_centers(centroid).copy()
+        counts = list(centroid.center_counts)
+        for vec in embeddings:
+            j = int(np.argmax(_normalize(centers) @ vec))
+            if counts[j] > 1:
+                centers[j] = (centers[j] * counts[j] - vec) / (counts[j] - 1)
+            counts[j] -= 1
+        keep = [i for i, c in enumerate(counts) if c > 0]
+        if not keep:
+            rebuild_person_centroid(person_id)
+            return
+        _set_centers(centroid, centers[keep], [counts[i] for i in keep])
+        centroid.version += 1
+        centroid.save()
+
+def merge_centroids(source_ids, target_id):
+    """
+    合并人物时合并特征中心：各方向量和相加，所有中心按人脸数加权重新聚成 k 个
+    source_ids: 被合并的人物 ID 列表，需在删除这些人物之前调用
+    """
+    source_ids = list(source_ids)
+    with transaction.atomic():
+        rows = {
+            c.person_id: c for c in
+            PersonCentroid.objects.select_for_update().filter(person_id__in=source_ids + [target_id])
+        }
+        parts = [rows.get(pid) for pid in source_ids + [target_id]]
+        if any(c is None or c.is_stale for c in parts):
+            # 任一方缺失或过期，人脸已转移，直接按目标人物的全部人脸重算
+            rebuild_person_centroid(target_id)
+            return
+
+        target = parts[-1]
+        face_count = sum(c.face_count for c in parts)
+        _set_mean(target, np.sum([np.asarray(c.embedding_sum, dtype=np.float32) for c in parts], axis=0), face_count)
+        centers = np.concatenate([get_centers(c) for c in parts])
+        counts = np.asarray([n for c in parts for n in c.center_counts], dtype=np.float64)
+        k = center_count_for(face_count)
+        if len(centers) > k:
+            centers, counts = compute_centers(centers, n_clusters=k, sample_weight=counts)
+        _set_centers(target, centers, counts)
+        target.version += 1
+        target.save()
+
+def affected_person_ids(photo_qs):
+    """这些照片中的人脸所归属的人物 ID 列表"""
+    from apps.photos.models import Face
+    return list(
+        Face.objects.filter(photo__in=photo_qs, person__isnull=False)
+        .values_list('person_id', flat=True).distinct()
+    )
+
+def mark_centroids_stale(photo_qs):
+    """照片将被物理删除 (人脸随之级联删除)：标记涉及的人物中心待重算，需在删除前调用"""
+    return PersonCentroid.objects.filter(
+        person__faces__photo__in=photo_qs
+    ).update(is_stale=True)
+
+def refresh_stale_centroids():
+    """
+    重算所有标记为过期的人物中心 (只查询 is_stale 索引，读取中心前调用)，返回重算的数量
+    有人脸但还没有中心的人物 (如升级前的数据) 由 backfill_missing_centroids 补建，不在读取路径上检查
+    """
+    stale_ids = list(PersonCentroid.objects.filter(is_stale=True).values_list('person_id', flat=True))
+    for person_id in stale_ids:
+        rebuild_person_centroid(person_id)
+    if stale_ids:
+        # 过期的人物都失去了人脸，照片数与代表人脸一并重算
+        from .people import PersonService
+        PersonService.refresh_person_stats(stale_ids)
+    return len(stale_ids)
+
+def backfill_missing_centroids(progress_callback=None):
+    """补建有人脸但还没有中心的人物 (升级后运行一次 rebuild_person_centroids)，返回补建的数量"""
+    from apps.photos.models import Person
+    missing_ids = list(
+        Person.objects.filter(centroid__isnull=True, **{f'faces__{face_vector_field()}__isnull': False})
+        .values_list('id', flat=True).distinct()
+    )
+    for i, person_id in enumerate(missing_ids, 1):
+        rebuild_person_centroid(person_id)
+        if progress_callback:
+            progress_callback(i, len(missing_ids))
+    return len(missing_ids)
+
+def rebuild_centroids(person_ids=None, progress_callback=None):
+    """全量重建人物特征中心 (首次启用或数据修复时使用)"""
+    from apps.photos.models import Person
+    if person_ids is None:
+        person_ids = list(Person.objects.values_list('id', flat=True))
+    PersonCentroid.objects.exclude(person_id__in=Person.objects.values('id')).delete()
+    for i, person_id in enumerate(person_ids, 1):
+        rebuild_person_centroid(person_id)
+        if progress_callback:
+            progress_callback(i, len(person_ids))
+    return len(person_ids)
+
+def load_person_centers(person_ids=None):
+    """
+    读取人物的全部多样化中心，用于批量匹配人脸
+    返回 (每个中心所属的人物 ID 列表, 归一化的中心矩阵 (M, 512))
+    """
+    refresh_stale_centroids()
+    qs = PersonCentroid.objects.all()
+    if person_ids is not None:
+        qs = qs.filter(person_id__in=person_ids)
+    owners, blocks = [], []
+    for person_id, centers in qs.values_list('person_id', 'centers'):
+        matrix = np.frombuffer(bytes(centers), dtype=np.float32).reshape(-1, 512)
+        owners.extend([person_id] * len(matrix))
+        blocks.append(matrix)
+    if not blocks:
+        return [], np.zeros((0, 512), dtype=np.float32)
+    return owners, _normalize(np.concatenate(blocks))
+
+def nearest_people(vector, k=20, max_distance=None, exclude_ids=None):
+    """按均值向量检索最相近的人物 (走 HNSW 索引)，返回 [(person_id, distance), ...]"""
+    refresh_stale_centroids()
+    qs = PersonCentroid.objects.all()
+    if exclude_ids:
+        qs = qs.exclude(person_id__in=exclude_ids)
+    qs = qs.annotate(distance=CosineDistance('centroid', np.asarray(vector, dtype=np.float32).tolist()))
+    if max_distance is not None:
+        qs = qs.filter(distance__lt=max_distance)
+    with hnsw_search_session(ef_search=k):
+        return [(row.person_id, row.distance) for row in qs.order_by('distance')[:k]]
+
+def similar_person_pairs(threshold, neighbors=10):
+    """
+    所有均值向量距离小于阈值的人物对 (每个人物只在 HNSW 索引中取最近的若干个邻居)
+    返回 [(person_id1, person_id2, distance), ...]，person_id1 < person_id2
+    """
+    refresh_stale_centroids()
+    sql = """
+        SELECT DISTINCT LEAST(c1.person_id, n.person_id), GREATEST(c1.person_id, n.person_id), n.distance
+        FROM photos_personcentroid c1
+        CROSS JOIN LATERAL (
+            SELECT c2.person_id, c1.centroid <=> c2.centroid AS distance
+            FROM photos_personcentroid c2
+            WHERE c2.person_id <> c1.person_id
+            ORDER BY c1.centroid <=> c2.centroid
+            LIMIT %s
+        ) n
+        WHERE n.distance < %s
+    """
+    with hnsw_search_session(ef_search=neighbors):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [neighbors, threshold])
+            return cursor.fetchall()
@@ -0,0 +1,149 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+# 64 位感知哈希 (dHash 8x8)
+HASH_BITS = 64
+# 默认汉明距离阈值：<= 6 位差异基本为同一张照片的缩放/重新压缩版本
+DEFAULT_DUPLICATE_RADIUS = 6
+# 单个分桶内最多直接两两比较的数量，超出部分按块比较，控制内存
+_BUCKET_BLOCK = 2048
+
+# 0-255 每个字节的 1 的个数，用于向量化 popcount
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def compute_dhash(img):
+    """
+    计算 64 位差值哈希 (dHash)
+    img: 已解码 (并已按 EXIF 旋转) 的 PIL Image
+    返回有符号 64 位整数 (与 PostgreSQL bigint 一致)
+    """
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+    # 先缩小再转灰度，reducing_gap 让 Pillow 先用 reduce() 快速降采样，避免对大图做全分辨率插值
+    small = img.resize((9, 8), Image.Resampling.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return to_signed64(value)
+
+def compute_file_dhash(file_path):
+    """从文件计算 dHash (用于补算历史照片)，JPEG 使用 draft 模式低分辨率解码"""
+    with Image.open(file_path) as img:
+        img.draft('RGB', (256, 256))
+        img = ImageOps.exif_transpose(img)
+        return compute_dhash(img)
+
+def to_signed64(value):
+    """无符号 64 位整数 -> 有符号 (bigint 存储)"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def hamming_distance(a, b):
+    """两个 64 位哈希的汉明距离"""
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+def _popcount64(values):
+    """uint64 数组逐元素 popcount (NumPy >= 2.0 使用原生 bitwise_count)"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8).reshape(values.shape + (8,))].sum(axis=-1)
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, x):
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+def _chunk_layout(radius):
+    """
+    多索引哈希 (Multi-Index Hashing) 的分段方式
+    把 64 位切成 radius+1 段：由鸽巢原理，汉明距离 <= radius 的两个哈希至少有一段完全相同，
+    因此只需在"某段相同"的分桶内做精确比较，无需全量两两比较
+    """
+    m = radius + 1
+    base, extra = divmod(HASH_BITS, m)
+    layout = []
+    shift = 0
+    for i in range(m):
+        width = base + (1 if i < extra else 0)
+        layout.append((shift, width))
+        shift += width
+    return layout
+
+def _max_pairwise_distance(values):
+    """
+    组内任意两个哈希间的最大汉明距离
+    传递合并后组内两张照片可能超出 radius，因此在组内重新两两比较 (组通常很小，按块比较控制内存)
+    """
+    best = 0
+    for i in range(0, len(values), _BUCKET_BLOCK):
+        left = values[i:i + _BUCKET_BLOCK]
+        for j in range(i, len(values), _BUCKET_BLOCK):
+            right = values[j:j + _BUCKET_BLOCK]
+            best = max(best, int(_popcount64(left[:, None] ^ right[None, :]).max()))
+    return best
+
+def find_near_duplicate_groups(ids, hashes, radius=DEFAULT_DUPLICATE_RADIUS):
+    """
+    查找汉明距离在 radius 内的近似重复照片分组 (传递闭包，即并查集合并)
+    ids: 照片 ID 列表
+    hashes: 对应的有符号 64 位 dHash 列表
+    返回 [(member_ids, max_distance), ...]，每组至少 2 张，max_distance 为组内任意两张照片间的最大汉明距离
+    """
+    if len(ids) < 2:
+        return []
+    radius = max(0, min(int(radius), HASH_BITS - 1))
+
+    # 完全相同的哈希先合并，只对不同的哈希值做近邻比较 (大量纯色/黑屏图不会撑爆分桶)
+    all_values = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+    values, inverse = np.unique(all_values, return_inverse=True)
+    n = len(values)
+    uf = _UnionFind(n)
+
+    for shift, width in _chunk_layout(radius):
+        if n < 2:
+            break
+        keys = (values >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # 找出每个分桶的边界
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [n]))
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            # 分块两两比较，单块内存上限约 _BUCKET_BLOCK^2 * 8 字节
+            for i in range(0, len(members), _BUCKET_BLOCK):
+                left = members[i:i + _BUCKET_BLOCK]
+                for j in range(i, len(members), _BUCKET_BLOCK):
+                    right = members[j:j + _BUCKET_BLOCK]
+                    dist = _popcount64(values[left][:, None] ^ values[right][None, :])
+                    li, rj = np.nonzero(dist <= radius)
+                    for a, b in zip(li, rj):
+                        if left[a] != right[b]:
+                            uf.union(left[a], right[b])
+
+    groups = {}
+    for idx in range(len(ids)):
+        groups.setdefault(uf.find(inverse[idx]), []).append(idx)
+
+    results = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        distance = _max_pairwise_distance(values[np.unique(inverse[members])])
+        results.append(([ids[i] for i in members], distance))
+    return results
@@ -0,0 +1,137 @@
+"""
+向量批量读取
+通过服务端游标流式读取 (id, 向量)，向量以 pgvector 的二进制格式 (vector_send / halfvec_send) 传输，
+整批字节一次性解码到预先分配的连续 float32 矩阵中，不创建模型实例，也不经过 Python 列表
+"""
+import time
+import numpy as np
+from django.db import connection
+from pgvector.django import HalfVectorField
+from apps.photos.models import Face, Photo
+from apps.photos.utils import face_vector_field, photo_vector_field
+
+VECTOR_DIM = 512
+# 服务端游标每次取回的行数
+FETCH_SIZE = 10000
+
+class EmbeddingMatrix:
+    """批量读取的结果：ID 列表、(N, dim) float32 矩阵，以及附加列"""
+    def __init__(self, ids, matrix, columns, elapsed):
+        self.ids = ids
+        self.matrix = matrix
+        self.columns = columns
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def describe(self):
+        return f"{len(self)} 个向量，矩阵 {self.nbytes / 1024 / 1024:.1f} MB，读取耗时 {self.elapsed:.2f} 秒"
+
+def decode_vectors(buffers, dim=VECTOR_DIM, half=False):
+    """
+    批量解码 vector_send 的输出：每个向量为 2 字节维度 + 2 字节保留 + dim 个大端 float32
+    头部恰好占一个 float32 的位置，整批拼接后按 (N, dim + 1) 解释并去掉第一列
+    half: halfvec_send 的输出，元素为大端 float16，头部占两个元素的位置
+    """
+    if not buffers:
+        return np.zeros((0, dim), dtype=np.float32)
+    dtype, header = ('>f2', 2) if half else ('>f4', 1)
+    raw = np.frombuffer(b''.join(buffers), dtype=dtype).reshape(len(buffers), dim + header)
+    return raw[:, header:].astype(np.float32)
+
+def _is_half(model, column):
+    return isinstance(model._meta.get_field(column), HalfVectorField)
+
+def _select_sql(model, column, where, extra_columns):
+    table = model._meta.db_table
+    send = 'halfvec_send' if _is_half(model, column) else 'vector_send'
+    columns = ', '.join(['id', f'{send}({column})'] + list(extra_columns))
+    conditions = [f'{column} IS NOT NULL'] + list(where)
+    return table, f"SELECT {columns} FROM {table} WHERE {' AND '.join(conditions)}"
+
+def iter_embedding_batches(model, column, where=(), params=(), extra_columns=(), batch_size=FETCH_SIZE, order_by_id=False):
+    """
+    流式读取向量：服务端游标每次取回 batch_size 行
+    Yields: (ID 列表, (n, dim) float32 矩阵, {附加列名: 值列表})
+    """
+    _, sql = _select_sql(model, column, where, extra_columns)
+    half = _is_half(model, column)
+    if order_by_id:
+        sql += ' ORDER BY id'
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, list(params))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            ids = [r[0] for r in rows]
+            matrix = decode_vectors([r[1] for r in rows], half=half)
+            columns = {name: [r[2 + i] for r in rows] for i, name in enumerate(extra_columns)}
+            yield ids, matrix, columns
+
+def load_embeddings(model, column, where=(), params=(), extra_columns=(), dim=VECTOR_DIM):
+    """
+    把满足条件的全部向量读入一个预先分配的连续矩阵
+    先 COUNT(*) 确定行数，读取期间有新增行时矩阵自动扩容
+    """
+    start = time.perf_counter()
+    table, _ = _select_sql(model, column, where, extra_columns)
+    conditions = ' AND '.join([f'{column} IS NOT NULL'] + list(where))
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {conditions}", list(params))
+        total = cursor.fetchone()[0]
+
+    matrix = np.empty((total, dim), dtype=np.float32)
+    ids = []
+    columns = {name: [] for name in extra_columns}
+    filled = 0
+    for batch_ids, batch, batch_columns in iter_embedding_batches(model, column, where, params, extra_columns):
+        end = filled + len(batch_ids)
+        if end > len(matrix):
+            matrix = np.concatenate([matrix[:filled], np.empty((end - filled, dim), dtype=np.float32)])
+        matrix[filled:end] = batch
+        ids.extend(batch_ids)
+        for name, values in batch_columns.items():
+            columns[name].extend(values)
+        filled = end
+
+    return EmbeddingMatrix(ids, matrix[:filled], columns, time.perf_counter() - start)
+
+def load_face_embeddings(unlabeled=False, person_ids=None, since=None, min_quality=None, with_photo_ids=False):
+    """
+    读取人脸向量
+    unlabeled: 只读取未归入人物的人脸
+    person_ids: 只读取这些人物的人脸
+    since: 只读取该时间之后检测到的人脸
+    min_quality: 跳过质量分低于该值的人脸 (未评分的旧数据保留)
+    with_photo_ids: 附带 photo_id 列
+    """
+    where, params = [], []
+    if unlabeled:
+        where.append('person_id IS NULL')
+    if person_ids is not None:
+        where.append('person_id = ANY(%s::uuid[])')
+        params.append([str(pid) for pid in person_ids])
+    if since is not None:
+        where.append('created_at >= %s')
+        params.append(since)
+    if min_quality:
+        where.append('(quality IS NULL OR quality >= %s)')
+        params.append(min_quality)
+    extra = ['photo_id'] if with_photo_ids else []
+    return load_embeddings(Face, face_vector_field(), where, params, extra)
+
+def load_photo_embeddings(since=None, include_deleted=True):
+    """读取照片的 CLIP 语义向量，since: 只读取该时间之后导入的照片"""
+    where, params = [], []
+    if not include_deleted:
+        where.append('deleted_at IS NULL')
+    if since is not None:
+        where.append('created_at >= %s')
+        params.append(since)
+    return load_embeddings(Photo, photo_vector_field(), where, params)
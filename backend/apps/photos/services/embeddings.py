@@ -1,16 +1,26 @@
 import os
 import threading
 import time
+from collections import OrderedDict
+import numpy as np
 from PIL import Image
+from django.conf import settings
 from django.db import close_old_connections, connections
+from django.db.models import F
 from django.db.utils import InterfaceError, OperationalError
-from apps.photos.models import Photo
+from apps.photos.models import Photo, TextEmbedding
+from ..utils import hnsw_search_session, photo_vector_field
 from .hardware import check_gpu_availability
-from .video import extract_video_frame
+from .video import extract_video_frame, load_video_poster
+from .vector_index import use_mmap_backend, get_embedding_snapshot, append_embeddings
 from pgvector.django import CosineDistance
 
+# 当前使用的 CLIP 模型名称 (同时作为文本向量缓存的键)
+CLIP_MODEL_NAME = 'clip-ViT-B-32'
+
 _clip_model = None
 _clip_lock = threading.Lock()
+_text_cache_lock = threading.Lock()
 
 def get_clip_model(silent=True):
     """获取 CLIP 模型单例"""
@@ -29,7 +39,7 @@ def get_clip_model(silent=True):
                     device = "cuda" if gpu_info["available"] else "cpu"
                     
                     # 模型名称和可能的本地路径
-                    model_name = 'clip-ViT-B-32'
+                    model_name = CLIP_MODEL_NAME
                     # 优先从环境变量获取路径，否则使用相对于当前工作目录的路径
                     local_base = os.environ.get('SENTENCE_TRANSFORMERS_HOME', os.path.join(os.getcwd(), "models", "huggingface"))
                     
@@ -61,23 +71,184 @@ def get_clip_model(silent=True):
                     return None
     return _clip_model
 
-def search_photos_by_text(query, limit=100):
-    """根据文本进行语义搜索"""
-    # 获取 CLIP 模型
+class TextEmbeddingCache:
+    """
+    CLIP 文本向量缓存 (进程级 LRU + 可选数据库持久化)
+    查询顺序: 内存 LRU -> 数据库表 TextEmbedding -> 调用文本编码器
+    """
+    def __init__(self, max_size=2048, persist=True, model_name=CLIP_MODEL_NAME):
+        self.max_size = max_size
+        self.persist = persist
+        self.model_name = model_name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 监控计数
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query):
+        """归一化查询文本：去除首尾空白、合并连续空格、转小写"""
+        return ' '.join(str(query).split()).lower()
+
+    def _remember(self, key, embedding):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def encode(self, queries, model):
+        """
+        批量获取文本向量，只对未命中的文本调用编码器
+        返回与 queries 等长的 numpy 向量列表 (只读，请勿原地修改)
+        """
+        keys = [self.normalize(q) for q in queries]
+        results = {}
+
+        # 1. 内存 LRU
+        with self._lock:
+            for key in keys:
+                if key in self._entries and key not in results:
+                    self._entries.move_to_end(key)
+                    results[key] = self._entries[key]
+                    self.hits += 1
+
+        pending = [k for k in dict.fromkeys(keys) if k not in results]
+
+        # 2. 数据库持久化缓存
+        if pending and self.persist:
+            try:
+                rows = TextEmbedding.objects.filter(
+                    model_name=self.model_name, query__in=pending
+                ).values_list('query', 'embedding')
+                found = []
+                for query, embedding in rows:
+                    vec = np.asarray(embedding, dtype=np.float32)
+                    vec.setflags(write=False)
+                    results[query] = vec
+                    found.append(query)
+                    self._remember(query, vec)
+                if found:
+                    with self._lock:
+                        self.db_hits += len(found)
+                    TextEmbedding.objects.filter(
+                        model_name=self.model_name, query__in=found
+                    ).update(hit_count=F('hit_count') + 1)
+                pending = [k for k in pending if k not in results]
+            except Exception as e:
+                print(f"读取文本向量缓存失败: {e}")
+
+        # 3. 调用 CLIP 文本编码器 (一次批量推理)
+        if pending:
+            encoded = model.encode(pending, convert_to_numpy=True, show_progress_bar=False)
+            with self._lock:
+                self.misses += len(pending)
+            new_rows = []
+            for key, embedding in zip(pending, encoded):
+                vec = np.asarray(embedding, dtype=np.float32)
+                vec.setflags(write=False)
+                results[key] = vec
+                self._remember(key, vec)
+                # 过长的文本不入库 (通常是异常输入)
+                if self.persist and len(key) <= 255:
+                    new_rows.append(TextEmbedding(model_name=self.model_name, query=key, embedding=vec.tolist()))
+            if new_rows:
+                try:
+                    TextEmbedding.objects.bulk_create(new_rows, ignore_conflicts=True)
+                except Exception as e:
+                    print(f"写入文本向量缓存失败: {e}")
+
+        return [results[k] for k in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回缓存命中统计，用于监控"""
+        with self._lock:
+            total = self.hits + self.db_hits + self.misses
+            return {
+                'model_name': self.model_name,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'persist': self.persist,
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.db_hits) / total, 4) if total else 0.0,
+            }
+
+_text_cache = None
+
+def get_text_embedding_cache():
+    """获取进程级文本向量缓存单例"""
+    global _text_cache
+    if _text_cache is None:
+        with _text_cache_lock:
+            if _text_cache is None:
+                _text_cache = TextEmbeddingCache(
+                    max_size=getattr(settings, 'CLIP_TEXT_CACHE_SIZE', 2048),
+                    persist=getattr(settings, 'CLIP_TEXT_CACHE_PERSIST', True),
+                )
+    return _text_cache
+
+def encode_texts(queries):
+    """批量编码文本 (带缓存)，模型不可用时返回 None"""
     model = get_clip_model(silent=True)
     if not model:
-        return []
-    
+        return None
+    return get_text_embedding_cache().encode(list(queries), model)
+
+def encode_text(query):
+    """编码单条文本 (带缓存)，模型不可用时返回 None"""
+    embeddings = encode_texts([query])
+    return embeddings[0] if embeddings else None
+
+def _search_snapshot(snapshot, text_emb, limit):
+    """
+    在向量快照中搜索：快照不随软删除更新，多取一些候选，取回照片时过滤回收站中的照片，
+    仍不足 limit 且还有更多候选时加倍重取
+    """
+    k = limit * 2
+    while True:
+        hits = snapshot.search(text_emb, k=k, max_distance=0.8)
+        photos = Photo.objects.filter(deleted_at__isnull=True).in_bulk([pid for pid, _ in hits])
+        results = []
+        for pid, distance in hits:
+            photo = photos.get(pid)
+            if photo is not None:
+                photo.distance = distance
+                results.append(photo)
+        if len(results) >= limit or len(hits) < k or k >= snapshot.size:
+            return results[:limit]
+        k *= 2
+
+def search_photos_by_text(query, limit=100):
+    """根据文本进行语义搜索"""
     try:
-        # 编码文本
-        text_emb = model.encode(query)
-        
-        # 使用 pgvector 进行高效搜索
-        photos = Photo.objects.annotate(
-            distance=CosineDistance('embedding_data', text_emb)
-        ).filter(distance__lt=0.8).order_by('distance')[:limit]
+        # 编码文本 (命中缓存时无需调用文本编码器)
+        text_emb = encode_text(query)
+        if text_emb is None:
+            return []
         
-        return list(photos)
+        # 内存映射快照后端：进程内一次矩阵乘法得到 top-k，只按主键取回照片
+        if use_mmap_backend():
+            snapshot = get_embedding_snapshot()
+            if snapshot is not None:
+                return _search_snapshot(snapshot, text_emb, limit)
+
+        # 使用 pgvector 进行高效搜索 (HNSW 索引，ef_search 需覆盖 limit；迭代扫描会补齐被过滤掉的回收站照片)
+        with hnsw_search_session(ef_search=limit):
+            photos = Photo.objects.filter(deleted_at__isnull=True).annotate(
+                distance=CosineDistance(photo_vector_field(), text_emb)
+            ).filter(distance__lt=0.8).order_by('distance')[:limit]
+            
+            return list(photos)
     except Exception as e:
         print(f"语义搜索失败: {e}")
         return []
@@ -128,7 +299,7 @@ def generate_photo_embedding(photo_id):
             return False
         
         if is_pure_video:
-            image = extract_video_frame(file_path)
+            image = load_video_poster(file_path)
             if not image:
                 return False
         else:
@@ -168,10 +339,15 @@ def generate_photo_embedding(photo_id):
             # 推理结束后，使用 db_execute_with_retry 保存数据
             def save_embedding():
                 p = Photo.objects.get(id=photo_id)
-                p.embedding_data = embedding.tolist()
-                p.save(update_fields=['embedding_data'])
+                p.set_embedding(embedding.tolist())
+                p.save(update_fields=Photo.embedding_fields() + ['tag_version'])
                 
             db_execute_with_retry(save_embedding)
+            # 同步到内存映射快照 (未建立快照时跳过)
+            try:
+                append_embeddings([photo_id], [embedding])
+            except Exception as e:
+                print(f"更新向量快照失败: {e}")
 
         process_embedding()
         
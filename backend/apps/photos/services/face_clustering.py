@@ -0,0 +1,157 @@
+"""
+新人物发现的人脸聚类
+先构建稀疏的 k 近邻图 (只保留距离小于阈值的边)，再在图上做 Chinese Whispers 或连通分量划分，
+内存随人脸数线性增长，替代在全部人脸上一次性运行的 DBSCAN
+"""
+import numpy as np
+from django.conf import settings
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    import hnswlib
+except ImportError:  # 未安装时使用分块精确 k 近邻
+    hnswlib = None
+
+CLUSTER_METHODS = ['chinese_whispers', 'components', 'dbscan']
+# 每个人脸在图中保留的近邻数
+DEFAULT_NEIGHBORS = 30
+# 精确 k 近邻每块相似度矩阵的元素上限 (float32 相似度 64MB + argpartition 的 int64 下标 128MB)
+EXACT_BLOCK_ELEMENTS = 16 * 1024 * 1024
+# 近似索引分块插入 / 查询的人脸数
+ANN_CHUNK_SIZE = 20000
+
+def get_cluster_method():
+    return getattr(settings, 'FACE_CLUSTER_METHOD', 'chinese_whispers')
+
+def ann_available():
+    """是否可用 hnswlib 近似索引构建近邻图 (否则退化为 O(N²) 的分块精确计算)"""
+    return hnswlib is not None
+
+def _exact_knn(embeddings, k, progress_callback=None):
+    """分块精确 k 近邻：每块 (chunk, N) 相似度矩阵，内存受 EXACT_BLOCK_ELEMENTS 限制"""
+    n = len(embeddings)
+    chunk = max(1, EXACT_BLOCK_ELEMENTS // max(n, 1))
+    neighbors = np.empty((n, k), dtype=np.int64)
+    sims_out = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        sims = embeddings[start:end] @ embeddings.T
+        # 排除自身
+        sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+        top = np.argpartition(sims, kth=-k, axis=1)[:, -k:]
+        neighbors[start:end] = top
+        sims_out[start:end] = np.take_along_axis(sims, top, axis=1)
+        if progress_callback:
+            progress_callback(end, n)
+    return neighbors, sims_out
+
+def _ann_knn(embeddings, k, progress_callback=None):
+    """HNSW 近似 k 近邻：分块插入与查询，内存与人脸数线性相关"""
+    n, dim = embeddings.shape
+    index = hnswlib.Index(space='cosine', dim=dim)
+    index.init_index(max_elements=n, ef_construction=200, M=16)
+    for start in range(0, n, ANN_CHUNK_SIZE):
+        index.add_items(embeddings[start:start + ANN_CHUNK_SIZE], np.arange(start, min(start + ANN_CHUNK_SIZE, n)))
+    index.set_ef(max(2 * (k + 1), 64))
+
+    neighbors = np.empty((n, k), dtype=np.int64)
+    sims_out = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, ANN_CHUNK_SIZE):
+        end = min(start + ANN_CHUNK_SIZE, n)
+        labels, distances = index.knn_query(embeddings[start:end], k=k + 1)
+        # 查询 k + 1 个再去掉自身 (通常是第一个结果，近似索引下不保证)；
+        # 稳定排序把非自身的结果排在前面，自身未出现时去掉最远的一个
+        not_self = labels != np.arange(start, end)[:, None]
+        order = np.argsort(~not_self, axis=1, kind='stable')[:, :k]
+        neighbors[start:end] = np.take_along_axis(labels, order, axis=1)
+        sims_out[start:end] = 1 - np.take_along_axis(distances, order, axis=1)
+        if progress_callback:
+            progress_callback(end, n)
+    return neighbors, sims_out
+
+def build_knn_graph(embeddings, threshold, k=DEFAULT_NEIGHBORS, progress_callback=None):
+    """
+    构建对称的稀疏近邻图：每张人脸取 k 个最近邻，只保留余弦距离小于 threshold 的边
+    embeddings: (N, 512) 已归一化
+    返回 CSR 邻接矩阵，边权为余弦相似度
+    """
+    n = len(embeddings)
+    if n < 2:
+        return csr_matrix((n, n), dtype=np.float32)
+    k = min(k, n - 1)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if hnswlib is not None:
+        neighbors, sims = _ann_knn(embeddings, k, progress_callback)
+    else:
+        neighbors, sims = _exact_knn(embeddings, k, progress_callback)
+
+    rows = np.repeat(np.arange(n), k)
+    cols = neighbors.ravel()
+    weights = sims.ravel()
+    keep = weights > 1 - threshold
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    graph = coo_matrix((weights, (rows, cols)), shape=(n, n)).tocsr()
+    # 对称化：A 是 B 的近邻或 B 是 A 的近邻都连边
+    return graph.maximum(graph.T).tocsr()
+
+def chinese_whispers(graph, iterations=30, seed=42):
+    """
+    Chinese Whispers 图聚类：每个节点反复采用邻居中权重之和最大的标签
+    用稀疏矩阵一次更新一半随机节点 (半同步)，避免同步更新在二分结构上来回振荡
+    返回每个节点的簇标签
+    """
+    n = graph.shape[0]
+    labels = np.arange(n)
+    if n == 0 or graph.nnz == 0:
+        return labels
+    rng = np.random.default_rng(seed)
+    coo = graph.tocoo()
+    for _ in range(iterations):
+        # score[i, l] = 邻居中标签为 l 的边权之和；自环权重很小，只在没有邻居时保留原标签
+        score = csr_matrix(
+            (np.concatenate([coo.data, np.full(n, 1e-6, dtype=np.float32)]),
+             (np.concatenate([coo.row, np.arange(n)]), np.concatenate([labels[coo.col], labels]))),
+            shape=(n, n),
+        )
+        score.sum_duplicates()
+        # 每行权重最大的标签：按 (行, -权重) 排序后取每行第一个 (自环保证每行非空)
+        row_ids = np.repeat(np.arange(n), np.diff(score.indptr))
+        order = np.lexsort((-score.data, row_ids))
+        best = score.indices[order][score.indptr[:-1]]
+        update = rng.random(n) < 0.5
+        changed = np.count_nonzero(best[update] != labels[update])
+        labels = np.where(update, best, labels)
+        if changed <= n * 0.0005:
+            break
+    return labels
+
+def _relabel(labels, min_samples):
+    """把簇标签压缩为 0..K-1，成员少于 min_samples 的簇记为噪声 (-1)"""
+    _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    keep = counts[inverse] >= min_samples
+    result = np.full(len(labels), -1, dtype=np.int64)
+    if keep.any():
+        _, result[keep] = np.unique(inverse[keep], return_inverse=True)
+    return result
+
+def cluster_embeddings(embeddings, threshold, min_samples=2, method=None, k=DEFAULT_NEIGHBORS, progress_callback=None):
+    """
+    聚类人脸向量，返回与 DBSCAN 相同格式的标签 (-1 为噪声)
+    method: chinese_whispers (默认) / components (k 近邻图的连通分量) / dbscan (旧实现，全量距离计算，只适合小数据量)
+    """
+    method = method or get_cluster_method()
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if method == 'dbscan':
+        from sklearn.cluster import DBSCAN
+        return DBSCAN(eps=threshold, min_samples=min_samples, metric='cosine', n_jobs=-1).fit(embeddings).labels_
+
+    graph = build_knn_graph(embeddings, threshold, k=k, progress_callback=progress_callback)
+    if method == 'components':
+        _, labels = connected_components(graph, directed=False)
+    else:
+        labels = chinese_whispers(graph)
+    return _relabel(labels, min_samples)
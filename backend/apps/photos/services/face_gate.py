@@ -0,0 +1,108 @@
+import threading
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from apps.photos.models import Photo
+from apps.photos.utils import photo_vector_field, vector_to_numpy
+from .tagging import clip_prompt_matrix, clip_softmax
+
+# 人物相关提示词：概率之和即为 "照片中有人" 的置信度
+PERSON_PROMPTS = [
+    'a photo of a person',
+    'a photo of a face',
+    'a selfie',
+    'a portrait photo of a person',
+    'a group photo of people',
+    'a photo of a child',
+    'a photo of people in a crowd',
+]
+# 常见的无人照片类型，作为对照类别参与 softmax
+OTHER_PROMPTS = [
+    'a screenshot',
+    'a photo of a document',
+    'a photo of a receipt',
+    'a photo of text',
+    'a landscape photo',
+    'a photo of a building',
+    'a photo of food',
+    'a photo of an animal',
+    'a photo of a plant',
+    'a photo of a car',
+    'a photo of an object',
+    'a photo of a room interior',
+    'a photo of the sky',
+]
+# 每批打分的照片数量
+DEFAULT_GATE_BATCH_SIZE = 4096
+
+_gate = None
+_gate_lock = threading.Lock()
+
+class FaceGate:
+    """人脸检测前的快速筛选：用已有的 CLIP 向量判断照片中是否可能有人"""
+    def __init__(self, person_prompts=PERSON_PROMPTS, other_prompts=OTHER_PROMPTS):
+        self.prompts = list(person_prompts) + list(other_prompts)
+        self.person_count = len(person_prompts)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        """(提示词数, 512) 的 L2 归一化文本向量矩阵，模型不可用时返回 None"""
+        if self._matrix is None:
+            self._matrix = clip_prompt_matrix(self.prompts)
+        return self._matrix
+
+    def score(self, embeddings):
+        """
+        一批图像向量中有人的概率 (一次矩阵乘法)
+        embeddings: (N, 512) float32
+        返回 (N,) float32，模型不可用时返回 None
+        """
+        matrix = self.matrix
+        if matrix is None:
+            return None
+        if len(embeddings) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return clip_softmax(embeddings, matrix)[:, :self.person_count].sum(axis=1)
+
+def get_face_gate():
+    """获取进程级单例 (提示词只编码一次)"""
+    global _gate
+    if _gate is None:
+        with _gate_lock:
+            if _gate is None:
+                _gate = FaceGate()
+    return _gate
+
+def get_gate_threshold():
+    return getattr(settings, 'FACE_GATE_THRESHOLD', 0.1)
+
+def gate_photos(photo_ids, threshold=None, batch_size=DEFAULT_GATE_BATCH_SIZE):
+    """
+    按 CLIP 向量筛掉大概率无人的照片：直接标记为已扫描 (face_gated=True)，不做人脸检测
+    只筛选有语义向量的静态照片，视频的代表帧不能代表其他帧，始终完整检测
+    返回 (被跳过的照片 ID 列表, 需要检测的照片 ID 列表)，模型不可用时不跳过任何照片
+    """
+    if threshold is None:
+        threshold = get_gate_threshold()
+    gate = get_face_gate()
+    if gate.matrix is None or not photo_ids:
+        return [], list(photo_ids)
+
+    field = photo_vector_field()
+    candidates = Photo.objects.filter(**{f'{field}__isnull': False}).filter(
+        Q(video_path__isnull=True) | Q(video_path='') | Q(is_live_photo=True)
+    )
+    skipped = []
+    for i in range(0, len(photo_ids), batch_size):
+        rows = list(candidates.filter(id__in=photo_ids[i:i + batch_size]).values_list('id', field))
+        if not rows:
+            continue
+        scores = gate.score(np.stack([vector_to_numpy(r[1]) for r in rows]))
+        batch_skipped = [row[0] for row, score in zip(rows, scores) if score < threshold]
+        if batch_skipped:
+            Photo.objects.filter(id__in=batch_skipped).update(face_scanned=True, face_gated=True)
+            skipped.extend(batch_skipped)
+
+    skipped_set = set(skipped)
+    return skipped, [pid for pid in photo_ids if pid not in skipped_set]
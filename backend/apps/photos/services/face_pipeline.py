@@ -0,0 +1,231 @@
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+
+from .faces import get_face_detector, detect_faces_in_images, save_face_results
+
+# 队列结束标记
+_DONE = object()
+
+class StageStats:
+    """流水线单个阶段的统计：忙碌时间、处理数量，以及等待上游 (饥饿) / 下游 (阻塞) 的时间"""
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, starved=0.0, blocked=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.items += items
+
+    def as_dict(self, wall):
+        capacity = max(wall * self.workers, 1e-9)
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'utilization': round(self.busy / capacity, 3),
+            'starved': round(self.starved / capacity, 3),
+            'blocked': round(self.blocked / capacity, 3),
+            'avg_ms': round(self.busy / self.items * 1000, 1) if self.items else 0.0,
+        }
+
+def _timed_put(q, item, stats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.add(blocked=time.perf_counter() - start)
+
+def _timed_get(q, stats):
+    start = time.perf_counter()
+    item = q.get()
+    stats.add(starved=time.perf_counter() - start)
+    return item
+
+def run_face_pipeline(rows, decode_workers=2, infer_workers=1, queue_size=16, write_batch=32, progress_callback=None):
+    """
+    流水线式人脸扫描：解码 (多进程) -> 推理 (线程，共享 ONNX 会话) -> 写入 (单线程批量写入)
+    阶段之间用有界队列连接，下游处理不过来时上游自动阻塞，内存占用可控
+    rows: [(photo_id, file_path, is_pure_video, is_video, cache_poster), ...]，见 face_scan_rows
+    返回 (处理的照片数, 发现的人脸数, 各阶段统计列表)
+    """
+    from apps.photos.face_workers import init_worker, decode_photo
+
+    decode_stats = StageStats('decode', decode_workers)
+    infer_stats = StageStats('inference', infer_workers)
+    write_stats = StageStats('write', 1)
+
+    decoded_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+    totals = {'photos': 0, 'faces': 0}
+    errors = []
+
+    detector = get_face_detector()
+    start_time = time.perf_counter()
+
+    def feed():
+        """按提交顺序取回解码结果放入队列；在途任务数有上限，解码不会无限领先推理"""
+        ctx = multiprocessing.get_context('spawn')
+        in_flight = deque()
+        max_in_flight = decode_workers * 2
+        try:
+            with ProcessPoolExecutor(max_workers=decode_workers, mp_context=ctx, initializer=init_worker) as pool:
+                for row in rows:
+                    in_flight.append(pool.submit(decode_photo, row))
+                    if len(in_flight) >= max_in_flight:
+                        _forward(in_flight.popleft())
+                while in_flight:
+                    _forward(in_flight.popleft())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(infer_workers):
+                decoded_queue.put(_DONE)
+
+    def _forward(future):
+        try:
+            photo_id, images, elapsed = future.result()
+        except Exception as e:
+            # 子进程崩溃 (如解码时内存不足)：跳过该照片，下次扫描时重试
+            print(f"解码进程异常: {e}")
+            return
+        decode_stats.add(busy=elapsed, items=1)
+        _timed_put(decoded_queue, (photo_id, images), decode_stats)
+
+    def infer():
+        try:
+            while True:
+                item = _timed_get(decoded_queue, infer_stats)
+                if item is _DONE:
+                    break
+                photo_id, images = item
+                if images is None:
+                    continue
+                begin = time.perf_counter()
+                try:
+                    faces = detect_faces_in_images(photo_id, images, detector)
+                except Exception as e:
+                    # 推理失败的照片不写入，下次扫描时重试
+                    print(f"人脸检测异常 {photo_id}: {e}")
+                    continue
+                finally:
+                    infer_stats.add(busy=time.perf_counter() - begin, items=1)
+                _timed_put(result_queue, (photo_id, faces), infer_stats)
+        finally:
+            result_queue.put(_DONE)
+
+    def write():
+        pending = []
+        finished = 0
+
+        def flush():
+            if not pending:
+                return
+            begin = time.perf_counter()
+            totals['faces'] += save_face_results(pending)
+            totals['photos'] += len(pending)
+            write_stats.add(busy=time.perf_counter() - begin, items=len(pending))
+            pending.clear()
+            if progress_callback:
+                progress_callback(totals['photos'], totals['faces'])
+
+        failed = False
+        try:
+            while finished < infer_workers:
+                item = _timed_get(result_queue, write_stats)
+                if item is _DONE:
+                    finished += 1
+                    continue
+                if failed:
+                    # 写入已失败：继续取空队列，避免上游线程阻塞在 put 上
+                    continue
+                pending.append(item)
+                if len(pending) >= write_batch:
+                    try:
+                        flush()
+                    except Exception as e:
+                        errors.append(e)
+                        failed = True
+            if not failed:
+                flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=feed, name='face-decode-feeder', daemon=True)]
+    threads += [threading.Thread(target=infer, name=f'face-infer-{i}', daemon=True) for i in range(infer_workers)]
+    writer = threading.Thread(target=write, name='face-writer', daemon=True)
+    threads.append(writer)
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+    wall = time.perf_counter() - start_time
+    stats = [s.as_dict(wall) for s in (decode_stats, infer_stats, write_stats)]
+    return totals['photos'], totals['faces'], stats
+
+def run_face_process_pool(rows, workers=2, intra_op_threads=None, chunk_size=8, progress_callback=None):
+    """
+    多进程人脸扫描：每个子进程加载独立的 ONNX 会话，照片按块分发；
+    子进程只做解码与推理，结果回到主进程由单一写入者批量写入数据库
+    intra_op_threads: 每个会话的线程数，默认 CPU 核心数 / 进程数
+    返回 (处理的照片数, 发现的人脸数, 各阶段统计列表)
+    """
+    from apps.photos.face_workers import init_face_worker, detect_photo_chunk
+
+    if not intra_op_threads:
+        intra_op_threads = max(1, multiprocessing.cpu_count() // workers)
+
+    worker_stats = StageStats('detect', workers)
+    write_stats = StageStats('write', 1)
+    totals = {'photos': 0, 'faces': 0}
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    start_time = time.perf_counter()
+
+    def collect(future):
+        try:
+            results, elapsed = future.result()
+        except Exception as e:
+            # 子进程崩溃：整块跳过，下次扫描时重试
+            print(f"人脸检测进程异常: {e}")
+            return
+        worker_stats.add(busy=elapsed, items=len(results))
+        begin = time.perf_counter()
+        totals['faces'] += save_face_results(results)
+        totals['photos'] += len(results)
+        write_stats.add(busy=time.perf_counter() - begin, items=len(results))
+        if progress_callback:
+            progress_callback(totals['photos'], totals['faces'])
+
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=ctx,
+        initializer=init_face_worker, initargs=(intra_op_threads,)
+    ) as pool:
+        # 在途块数有上限：结果写入跟不上时不会在主进程堆积大量未保存的人脸
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(detect_photo_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+
+    wall = time.perf_counter() - start_time
+    stats = [s.as_dict(wall) for s in (worker_stats, write_stats)]
+    return totals['photos'], totals['faces'], stats
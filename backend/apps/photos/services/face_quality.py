@@ -0,0 +1,53 @@
+"""
+人脸质量评分
+综合检测置信度、人脸相对图像的大小与清晰度 (拉普拉斯方差) 给出 0~1 的质量分，
+人群照片背景中十几个像素的小脸、虚焦的人脸得分很低：
+低于丢弃阈值的人脸不提取特征也不入库，低于聚类阈值的人脸入库但不参与匹配与聚类
+"""
+import cv2
+import numpy as np
+from django.conf import settings
+
+# 人脸短边达到图像短边的该比例时，尺寸分为满分
+FULL_SIZE_RATIO = 0.05
+# 拉普拉斯方差达到该值时，清晰度分为满分
+FULL_SHARPNESS = 100.0
+
+def get_drop_threshold():
+    return getattr(settings, 'FACE_QUALITY_DROP_THRESHOLD', 0.0)
+
+def get_cluster_threshold():
+    return getattr(settings, 'FACE_QUALITY_CLUSTER_THRESHOLD', 0.0)
+
+def face_sharpness(image_rgb, bbox):
+    """人脸区域灰度图的拉普拉斯方差，越大越清晰；bbox 为检测图像上的 [x1, y1, x2, y2]"""
+    h, w = image_rgb.shape[:2]
+    x1, y1 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+    x2, y2 = min(w, int(bbox[2])), min(h, int(bbox[3]))
+    if x2 - x1 < 3 or y2 - y1 < 3:
+        return 0.0
+    gray = cv2.cvtColor(np.ascontiguousarray(image_rgb[y1:y2, x1:x2]), cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def face_quality(det_score, bbox, image_shape, sharpness):
+    """
+    质量分 = 检测置信度 x 尺寸分 x 清晰度分
+    尺寸分：人脸短边 / 图像短边，达到 FULL_SIZE_RATIO 为 1
+    清晰度分：拉普拉斯方差 / FULL_SHARPNESS，最高为 1
+    """
+    h, w = image_shape[:2]
+    face_edge = max(0.0, min(bbox[2] - bbox[0], bbox[3] - bbox[1]))
+    size_score = min(1.0, face_edge / max(1, min(h, w)) / FULL_SIZE_RATIO)
+    sharp_score = min(1.0, sharpness / FULL_SHARPNESS)
+    return float(det_score) * size_score * sharp_score
+
+def score_stored_face(image_rgb, original_size, bbox, det_score):
+    """
+    为已入库的人脸补算质量分：bbox 为原图坐标 [x1, y1, x2, y2]，按比例映射到检测尺寸的图像上
+    返回 (质量分, 清晰度)
+    """
+    h, w = image_rgb.shape[:2]
+    sx, sy = w / original_size[0], h / original_size[1]
+    scaled = [bbox[0] * sx, bbox[1] * sy, bbox[2] * sx, bbox[3] * sy]
+    sharpness = face_sharpness(image_rgb, scaled)
+    return face_quality(det_score, scaled, image_rgb.shape, sharpness), sharpness
@@ -12,7 +12,11 @@ from django.db.utils import InterfaceError, OperationalError
 
 from apps.photos.models import Photo, Face
 from .hardware import check_gpu_availability
-from .video import extract_video_frame, extract_video_frames_generator
+from .video import extract_video_frame, extract_video_samples, save_video_poster
+from .face_quality import face_quality, face_sharpness, get_drop_threshold
+
+# face_scan_rows 每条查询的照片 ID 数，避免待扫描列表很长时生成超大的 IN 列表
+SCAN_ROWS_CHUNK_SIZE = 5000
 
 # 全局单例，避免多线程重复加载模型导致显存爆炸
 _global_detector = None
@@ -34,9 +38,28 @@ class FaceDetectorWrapper:
     """
     人脸检测与特征提取包装类 (仅使用强力的 InsightFace 模型)
     """
-    def __init__(self, silent=False):
+    def __init__(self, silent=False, intra_op_threads=None):
         # 已经在 get_face_detector 中通过锁保证了单例初始化的安全性
         self._init_impl(silent)
+        if intra_op_threads and self.insightface_app is not None:
+            self._limit_session_threads(intra_op_threads, silent)
+
+    def _limit_session_threads(self, intra_op_threads, silent=False):
+        """
+        限制每个 ONNX 会话的线程数 (多进程扫描时，各进程线程数之和与 CPU 核心数一致)
+        insightface 的 FaceAnalysis 不会把 sess_options 传给 InferenceSession，这里按相同模型文件重建会话
+        """
+        try:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = intra_op_threads
+            options.inter_op_num_threads = 1
+            for model in self.insightface_app.models.values():
+                providers = model.session.get_providers()
+                model.session = ort.InferenceSession(model.model_file, sess_options=options, providers=providers)
+        except Exception as e:
+            if not silent:
+                print(f"设置 ONNX 线程数失败: {e}")
 
     def _init_impl(self, silent=False):
         self.insightface_app = None
@@ -139,16 +162,18 @@ class FaceDetectorWrapper:
                 traceback.print_exc()
             self.insightface_app = None
 
-    def process(self, image_rgb):
+    def process(self, image_rgb, drop_threshold=None):
         """
         处理图片，返回检测到的人脸及其特征
+        先只做检测并计算质量分，质量分低于 drop_threshold 的人脸不再做对齐和特征提取
         """
         if self.insightface_app is None:
             return []
+        if drop_threshold is None:
+            drop_threshold = get_drop_threshold()
             
         try:
-            # InsightFace 的 get 方法会同时进行检测、对齐和特征提取
-            faces = self.insightface_app.get(image_rgb)
+            faces = self._detect_and_embed(image_rgb, drop_threshold)
         except Exception as e:
             # 打印详细错误到标准输出，以便我们在任务日志中看到
             import sys, traceback
@@ -163,12 +188,42 @@ class FaceDetectorWrapper:
             detections.append({
                 'bbox': [int(x1), int(y1), int(x2-x1), int(y2-y1)],
                 'score': float(face.det_score),
+                'quality': face.quality,
+                'sharpness': face.sharpness,
                 'embedding': face.embedding, # 预存特征向量
                 'gender': face.gender,       # 性别 (0: 女性, 1: 男性)
                 'age': face.age              # 年龄
             })
         return detections
 
+    def _detect_and_embed(self, image_rgb, drop_threshold):
+        """
+        与 FaceAnalysis.get 相同的流程 (检测后对每张人脸运行对齐、识别、性别年龄模型)，
+        但在检测之后先按质量分过滤，被丢弃的人脸不运行后续模型
+        """
+        from insightface.app.common import Face as InsightFace
+
+        app = self.insightface_app
+        bboxes, kpss = app.det_model.detect(image_rgb, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            bbox = bboxes[i, 0:4]
+            det_score = bboxes[i, 4]
+            sharpness = face_sharpness(image_rgb, bbox)
+            quality = face_quality(det_score, bbox, image_rgb.shape, sharpness)
+            if quality < drop_threshold:
+                continue
+            face = InsightFace(
+                bbox=bbox, kps=kpss[i] if kpss is not None else None, det_score=det_score,
+                quality=quality, sharpness=sharpness,
+            )
+            for taskname, model in app.models.items():
+                if taskname == 'detection':
+                    continue
+                model.get(image_rgb, face)
+            faces.append(face)
+        return faces
+
     def extract_embedding(self, face_image_rgb):
         """
         为单个裁剪后的人脸图片提取特征向量 (通常 process 已包含)
@@ -183,15 +238,18 @@ class FaceDetectorWrapper:
             return faces[0].embedding
         return None
 
-def get_face_detector(silent=True):
-    """获取全局共享的人脸检测器实例"""
+def get_face_detector(silent=True, intra_op_threads=None):
+    """
+    获取全局共享的人脸检测器实例
+    intra_op_threads: 首次初始化时限制 ONNX 会话线程数 (多进程扫描时每个进程各自一份)
+    """
     global _global_detector
     
     if _global_detector is None:
         # 使用双重检查锁定 (Double-Checked Locking) 确保线程安全
         with _init_lock:
             if _global_detector is None:
-                _global_detector = FaceDetectorWrapper(silent=silent)
+                _global_detector = FaceDetectorWrapper(silent=silent, intra_op_threads=intra_op_threads)
                 
     return _global_detector
 
@@ -214,10 +272,11 @@ def scan_all_faces(limit=None):
     if limit:
         photos = photos[:limit]
         
-    count = 0
-    for photo in photos:
-        detect_faces_in_photo(photo.id)
-        count += 1
+    photo_ids = list(photos.values_list('id', flat=True))
+    count = len(photo_ids)
+    # 分批检测，每批的人脸一次写入
+    for i in range(0, count, 16):
+        detect_faces_in_photos(photo_ids[i:i + 16])
         
     # 扫描完后尝试聚类
     if count > 0:
@@ -254,108 +313,198 @@ def db_execute_with_retry(func, max_retries=3):
             raise e
     return func()
 
-def detect_faces_in_photo(photo_id):
-    """检测照片中的人脸并保存到 Face 模型"""
-    
-    def process_image_array(photo_id, img_array, detector_obj, timestamp=None):
-        if img_array is None:
-            return 0
-            
-        h, w, _ = img_array.shape
-        
-        # 如果不在事务中，才彻底关闭连接，AI 推理期间不持有任何 DB 资源
+def get_detect_max_edge():
+    """人脸检测输入图像的最长边 (像素)，0 表示使用原图"""
+    from django.conf import settings
+    return int(getattr(settings, 'FACE_DETECT_MAX_EDGE', 1920) or 0)
+
+def open_image_for_detection(file_path, max_edge):
+    """
+    以降低的分辨率解码图片
+    JPEG 使用 draft 模式在 DCT 阶段直接按 1/2、1/4、1/8 缩小解码；HEIF 的 draft 会选用足够大的内嵌缩略图。
+    返回 (PIL RGB 图像, 原图按 EXIF 旋转后的尺寸 (宽, 高))
+    """
+    img = Image.open(file_path)
+    width, height = img.size
+    # EXIF 方向 5-8 表示需要旋转 90 度，原图尺寸的宽高互换
+    if img.getexif().get(0x0112) in (5, 6, 7, 8):
+        width, height = height, width
+
+    if max_edge and max(width, height) > max_edge:
+        # draft 返回不小于请求尺寸的最小缩放级别，请求尺寸按未旋转的原始宽高等比计算
+        ratio = max_edge / max(img.size)
         try:
-            from django.db import transaction, connections
-            if not transaction.get_connection().in_atomic_block:
-                for conn in connections.all():
-                    conn.close()
-                    conn.connection = None # 强力清除
-        except:
+            img.draft('RGB', (int(img.size[0] * ratio) + 1, int(img.size[1] * ratio) + 1))
+        except Exception:
             pass
-            
-        # AI 推理过程 (最耗时且可能干扰连接的操作)
-        detections = detector_obj.process(img_array)
-        
-        # 推理结束后，不依赖传入的对象，而是重新开启连接保存数据
-        detected_count = 0
-        for det in detections:
-            x1, y1, width, height = det['bbox']
-            
-            # 边界检查
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(w, x1 + width)
-            y2 = min(h, y1 + height)
-            
-            # 使用带重试机制的函数保存数据
-            def save_face():
-                # 重新获取 photo 对象，确保连接是新鲜的
-                current_photo = Photo.objects.get(id=photo_id)
-                
-                # 创建人脸记录
-                face = Face(
-                    photo=current_photo,
-                    bbox=[x1, y1, x2, y2],
-                    prob=det['score']
-                )
-                
-                if timestamp is not None:
-                    face.timestamp = timestamp
-                
-                if 'embedding' in det:
-                    face.embedding = det['embedding'].tolist()
-                
-                face.save()
-            
-            db_execute_with_retry(save_face)
-            detected_count += 1
-        return detected_count
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('RGB')
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR)
+    return img, (width, height)
+
+def fit_detection_size(img, max_edge):
+    """把已解码的图像 (如视频帧) 缩小到检测尺寸，返回 (RGB 数组, 原始尺寸)"""
+    original_size = img.size
+    if max_edge and max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR)
+    return np.array(img.convert('RGB')), original_size
+
+def face_scan_rows(photo_ids, chunk_size=SCAN_ROWS_CHUNK_SIZE):
+    """
+    解码阶段所需的照片信息 (解码在子进程中进行时不访问数据库)，按 chunk_size 分批查询
+    返回 [(photo_id, file_path, is_pure_video, is_video, cache_poster), ...]；
+    cache_poster 只对尚无语义向量的纯视频为真，之后的向量化会读取并删除缓存的代表帧
+    """
+    from django.db.models import BooleanField, ExpressionWrapper, Q
+    from apps.photos.utils import photo_vector_field
+
+    photo_ids = list(photo_ids)
+    qs = Photo.objects.annotate(
+        missing_embedding=ExpressionWrapper(Q(**{f'{photo_vector_field()}__isnull': True}), output_field=BooleanField())
+    )
+    rows = []
+    for start in range(0, len(photo_ids), chunk_size):
+        chunk = qs.filter(id__in=photo_ids[start:start + chunk_size]).values_list(
+            'id', 'file_path', 'video_path', 'is_live_photo', 'missing_embedding'
+        )
+        rows.extend(
+            (photo_id, file_path, bool(video_path) and not is_live_photo, bool(video_path) or is_live_photo,
+             bool(video_path) and not is_live_photo and missing_embedding)
+            for photo_id, file_path, video_path, is_live_photo, missing_embedding in chunk
+        )
+    return rows
 
+def load_face_images(file_path, is_pure_video=False, is_video=False, max_edge=None, cache_poster=False):
+    """
+    解码待检测的图像 (解码阶段，不访问数据库)
+    max_edge: 检测输入的最长边，None 时读取 settings.FACE_DETECT_MAX_EDGE
+    cache_poster: 纯视频是否缓存代表帧供之后的 CLIP 向量化使用 (只在照片尚无语义向量时传入)
+    返回 [(timestamp, image_rgb, original_size), ...]，图片的 timestamp 为 None，视频为多帧采样；
+    original_size 为原图尺寸，用于把检测框映射回原图坐标
+    """
+    if max_edge is None:
+        max_edge = get_detect_max_edge()
+
+    if is_pure_video:
+        # 视频处理：单次遍历多帧采样，帧在解码时即缩小到检测尺寸；
+        # 尚无语义向量时同一遍顺带取出 CLIP 向量化用的代表帧并缓存，向量化时无需再次解码视频
+        frames, poster = extract_video_samples(
+            file_path, interval=10.0, max_frames=50, max_edge=max_edge, with_poster=cache_poster
+        )
+        if poster is not None:
+            save_video_poster(file_path, poster)
+        return [
+            (timestamp, np.array(img_obj), original_size)
+            for timestamp, img_obj, original_size in frames
+        ]
+
+    # 图片处理
+    if os.path.exists(file_path):
+        try:
+            img_rgb, original_size = open_image_for_detection(file_path, max_edge)
+            return [(None, np.array(img_rgb), original_size)]
+        except Exception as e:
+            if not is_video:
+                print(f"读取图片失败 {file_path}: {e}")
+
+    if is_video:
+        img_obj = extract_video_frame(file_path)
+        if img_obj:
+            return [(None, *fit_detection_size(img_obj, max_edge))]
+
+    return []
+
+def build_face_objects(photo_id, image_rgb, detections, timestamp=None, original_size=None):
+    """
+    把检测结果转换为未保存的 Face 对象
+    检测在缩小后的图像上进行时，边界框按比例映射回原图坐标，并裁剪到原图范围内
+    """
+    h, w = image_rgb.shape[:2]
+    orig_w, orig_h = original_size or (w, h)
+    sx, sy = orig_w / w, orig_h / h
+    faces = []
+    for det in detections:
+        x1, y1, width, height = det['bbox']
+
+        # 边界检查
+        x1 = max(0, x1)
+        y1 = max(0, y1)
+        x2 = min(w, x1 + width)
+        y2 = min(h, y1 + height)
+
+        face = Face(
+            photo_id=photo_id,
+            bbox=[
+                int(round(x1 * sx)), int(round(y1 * sy)),
+                min(orig_w, int(round(x2 * sx))), min(orig_h, int(round(y2 * sy))),
+            ],
+            prob=det['score'],
+            quality=det.get('quality'),
+            sharpness=det.get('sharpness'),
+            timestamp=timestamp,
+        )
+        if 'embedding' in det:
+            face.set_embedding(det['embedding'].tolist())
+        faces.append(face)
+    return faces
+
+def detect_faces_in_images(photo_id, images, detector):
+    """对已解码的图像做推理 (推理阶段，不访问数据库)，返回未保存的 Face 列表"""
+    faces = []
+    for timestamp, image_rgb, original_size in images:
+        detections = detector.process(image_rgb)
+        faces.extend(build_face_objects(photo_id, image_rgb, detections, timestamp, original_size))
+    return faces
+
+def save_face_results(results):
+    """
+    写入阶段：一批照片的所有人脸一次 bulk_create，并在同一事务中标记 face_scanned
+    results: [(photo_id, [Face, ...]), ...]
+    返回写入的人脸数量
+    """
+    if not results:
+        return 0
+    from django.db import transaction
+
+    photo_ids = [photo_id for photo_id, _ in results]
+    faces = [face for _, photo_faces in results for face in photo_faces]
+
+    def write():
+        with transaction.atomic():
+            Face.objects.bulk_create(faces, batch_size=500)
+            Photo.objects.filter(id__in=photo_ids).update(face_scanned=True)
+
+    db_execute_with_retry(write)
+    return len(faces)
+
+def detect_faces_in_photos(photo_ids):
+    """
+    批量检测多张照片的人脸：一次查询取出照片信息，逐张解码推理，最后一次性写入
+    推理失败的照片不写入也不标记为已扫描，下次扫描时重试
+    返回 {photo_id: 人脸数量}
+    """
+    rows = db_execute_with_retry(lambda: face_scan_rows(photo_ids))
+    detector = get_face_detector()
+
+    results = []
+    for photo_id, file_path, is_pure_video, is_video, cache_poster in rows:
+        try:
+            images = load_face_images(file_path, is_pure_video=is_pure_video, is_video=is_video, cache_poster=cache_poster)
+            results.append((photo_id, detect_faces_in_images(photo_id, images, detector)))
+        except Exception as e:
+            import traceback
+            print(f"人脸检测异常 {photo_id}: {str(e)}")
+            traceback.print_exc()
+
+    save_face_results(results)
+    return {photo_id: len(faces) for photo_id, faces in results}
+
+def detect_faces_in_photo(photo_id):
+    """检测照片中的人脸并保存到 Face 模型"""
     try:
-        # 获取基础信息后立即释放连接
-        photo = db_execute_with_retry(lambda: Photo.objects.get(id=photo_id))
-        detector = get_face_detector()
-        total_count = 0
-        
-        file_path = photo.file_path
-        is_pure_video = photo.is_pure_video
-        is_video = photo.is_video
-        
-        if is_pure_video:
-             # 视频处理：多帧提取
-             for timestamp, img_obj in extract_video_frames_generator(file_path, interval=10.0, max_frames=50):
-                 image_rgb = np.array(img_obj)
-                 count = process_image_array(photo_id, image_rgb, detector, timestamp)
-                 total_count += count
-                 
-        else:
-            # 图片处理
-            image_rgb = None
-            if os.path.exists(file_path):
-                try:
-                    img_obj = Image.open(file_path)
-                    img_obj = ImageOps.exif_transpose(img_obj)
-                    img_rgb = img_obj.convert('RGB')
-                    image_rgb = np.array(img_rgb)
-                except Exception as e:
-                     if is_video:
-                          img_obj = extract_video_frame(file_path)
-                          if img_obj:
-                              image_rgb = np.array(img_obj)
-                     else:
-                          print(f"读取图片失败 {file_path}: {e}")
-            
-            if image_rgb is None and is_video:
-                 img_obj = extract_video_frame(file_path)
-                 if img_obj:
-                     image_rgb = np.array(img_obj)
-                     
-            if image_rgb is not None:
-                total_count = process_image_array(photo_id, image_rgb, detector, None)
-        
-        # 标记为已扫描
-        db_execute_with_retry(lambda: Photo.objects.filter(id=photo_id).update(face_scanned=True))
-        return total_count
+        return sum(detect_faces_in_photos([photo_id]).values())
     except Exception as e:
         # 打印更详细的错误
         import traceback
@@ -373,7 +522,7 @@ def extract_face_embedding(face, face_image_rgb):
         embedding = detector.extract_embedding(face_image_rgb)
         
         if embedding is not None:
-            face.embedding = embedding.tolist()
+            face.set_embedding(embedding.tolist())
             face.save()
             
     except Exception as e:
@@ -0,0 +1,284 @@
+"""
+地图网格聚合
+在数据库中按 floor(纬度 / g)、floor(经度 / g) 分组，返回每个网格的照片数、平均坐标与封面照片 (最新的一张)，
+走 (latitude, longitude) 上只含未删除照片的覆盖索引，不再把照片逐张读到 Python 中聚合
+
+瓦片金字塔：按 Web 墨卡托瓦片 (z/x/y) 预先计算每个缩放级别的网格聚合并存入 GeoTile，
+地图平移缩放时只读取瓦片；照片变化时标记受影响的瓦片，随即自底向上重算 (上一级由子瓦片合并，不再查询照片表)
+"""
+import math
+from django.conf import settings
+from django.db import connection, transaction
+from apps.photos.models import GeoTile, Photo
+
+# Web 墨卡托投影的纬度范围
+MAX_LATITUDE = 85.0511287798
+
+def grid_size_for_zoom(zoom):
+    """网格边长 (度)：zoom 越大网格越小，系数决定聚合的松紧程度"""
+    return 100.0 / (2 ** zoom)
+
+# 先按网格 GROUP BY 得到照片数、平均坐标与最新拍摄时间 (哈希聚合，不对全部照片排序)，
+# 再只在拍摄时间等于该最新时间的少数照片中取 ID 最小者作为封面 (没有拍摄时间的网格取全部照片中 ID 最小者)
+GRID_SQL = """
+    WITH pts AS MATERIALIZED (
+        SELECT id, latitude, longitude, captured_at,
+               floor(latitude / %(g)s) AS gx, floor(longitude / %(g)s) AS gy
+        FROM {table}
+        WHERE deleted_at IS NULL
+          AND latitude BETWEEN %(min_lat)s AND %(max_lat)s
+          AND longitude BETWEEN %(min_lng)s AND %(max_lng)s
+    ), cells AS (
+        SELECT gx, gy, COUNT(*) AS count, AVG(latitude) AS lat, AVG(longitude) AS lng, MAX(captured_at) AS latest
+        FROM pts
+        GROUP BY gx, gy
+    )
+    SELECT DISTINCT ON (c.gx, c.gy) p.id, p.captured_at, c.count, c.lat, c.lng
+    FROM cells c
+    JOIN pts p ON p.gx = c.gx AND p.gy = c.gy AND p.captured_at IS NOT DISTINCT FROM c.latest
+    ORDER BY c.gx, c.gy, p.id
+"""
+
+def grid_clusters(min_lat, max_lat, min_lng, max_lng, grid_size):
+    """
+    范围内未删除照片的网格聚合，不限制照片数
+    返回 [(封面照片 ID, 封面拍摄时间, 照片数, 平均纬度, 平均经度), ...]
+    """
+    params = {
+        'g': grid_size,
+        'min_lat': min_lat, 'max_lat': max_lat,
+        'min_lng': min_lng, 'max_lng': max_lng,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(GRID_SQL.format(table=Photo._meta.db_table), params)
+        return cursor.fetchall()
+
+def get_tile_max_zoom():
+    return int(getattr(settings, 'GEO_TILE_MAX_ZOOM', 16))
+
+def get_tile_cells():
+    """每个瓦片每边的网格数"""
+    return max(1, int(getattr(settings, 'GEO_TILE_CELLS', 4)))
+
+def get_tile_max_age():
+    return int(getattr(settings, 'GEO_TILE_MAX_AGE', 300))
+
+def tile_for(lat, lng, z):
+    """坐标所在的瓦片 (x, y)"""
+    n = 2 ** z
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bounds(z, x, y):
+    """瓦片的经纬度范围 (south, north, west, east)；边缘瓦片延伸到投影范围之外，包含被截断到边缘的照片"""
+    n = 2 ** z
+    west = -180.0 if x == 0 else x / n * 360.0 - 180.0
+    east = 180.0 if x == n - 1 else (x + 1) / n * 360.0 - 180.0
+    north = 90.0 if y == 0 else math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = -90.0 if y == n - 1 else math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, north, west, east
+
+def tile_keys(points, max_zoom=None):
+    """坐标在各缩放级别所在的瓦片 {(z, x, y), ...}"""
+    max_zoom = get_tile_max_zoom() if max_zoom is None else max_zoom
+    keys = set()
+    for lat, lng in points:
+        if lat is None or lng is None:
+            continue
+        for z in range(max_zoom + 1):
+            keys.add((z, *tile_for(lat, lng, z)))
+    return keys
+
+# 按墨卡托网格 (每边 n 格) 聚合，与 GRID_SQL 相同地先 GROUP BY 再取每个网格最新的一张照片作为封面
+MERCATOR_CELL_SQL = """
+    WITH pts AS MATERIALIZED (
+        SELECT id, latitude, longitude, captured_at,
+               LEAST(GREATEST(floor((longitude + 180) / 360 * %(n)s), 0), %(n)s - 1)::bigint AS cx,
+               LEAST(GREATEST(floor(
+                   (1 - asinh(tan(radians(LEAST(GREATEST(latitude, -%(max_lat)s), %(max_lat)s)))) / pi()) / 2 * %(n)s
+               ), 0), %(n)s - 1)::bigint AS cy
+        FROM {table}
+        WHERE deleted_at IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL {bounds}
+    ), cells AS (
+        SELECT cx, cy, COUNT(*) AS count, SUM(latitude) AS lat_sum, SUM(longitude) AS lng_sum, MAX(captured_at) AS latest
+        FROM pts
+        WHERE TRUE {cell_filter}
+        GROUP BY cx, cy
+    )
+    SELECT DISTINCT ON (c.cx, c.cy) c.cx, c.cy, p.id, EXTRACT(EPOCH FROM p.captured_at), c.count, c.lat_sum, c.lng_sum
+    FROM cells c
+    JOIN pts p ON p.cx = c.cx AND p.cy = c.cy AND p.captured_at IS NOT DISTINCT FROM c.latest
+    ORDER BY c.cx, c.cy, p.id
+"""
+
+def _query_cells(n, bounds='', cell_filter='', params=None):
+    """返回 {(cx, cy): [封面 ID, 封面时间戳, 照片数, 纬度和, 经度和]}"""
+    sql = MERCATOR_CELL_SQL.format(table=Photo._meta.db_table, bounds=bounds, cell_filter=cell_filter)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'n': n, 'max_lat': MAX_LATITUDE, **(params or {})})
+        return {
+            (cx, cy): [str(photo_id), ts and float(ts), count, lat_sum, lng_sum]
+            for cx, cy, photo_id, ts, count, lat_sum, lng_sum in cursor.fetchall()
+        }
+
+def _newer(a, b):
+    """两个网格中哪个的封面更新：拍摄时间晚者优先，没有时间的最旧，相同时取 ID 较小者 (与 SQL 排序一致)"""
+    ta = float('-inf') if a[1] is None else a[1]
+    tb = float('-inf') if b[1] is None else b[1]
+    return ta > tb or (ta == tb and a[0] < b[0])
+
+def merge_cells(cells):
+    """把一级网格合并为上一级 (网格坐标各除以 2)：照片数与坐标和相加，封面取最新"""
+    parents = {}
+    for (cx, cy), cell in cells.items():
+        key = (cx // 2, cy // 2)
+        parent = parents.get(key)
+        if parent is None:
+            parents[key] = list(cell)
+            continue
+        if _newer(cell, parent):
+            parent[0], parent[1] = cell[0], cell[1]
+        parent[2] += cell[2]
+        parent[3] += cell[3]
+        parent[4] += cell[4]
+    return parents
+
+def pack_tiles(cells, cells_per_tile):
+    """
+    按瓦片分组：{(x, y): [[格内列, 格内行, 封面 ID, 平均纬度, 平均经度, 照片数, 封面时间戳], ...]}
+    格内行列是网格在瓦片内的位置 (0 ~ cells_per_tile - 1)，上一级瓦片据此由子瓦片合并
+    """
+    tiles = {}
+    for (cx, cy), (cover_id, ts, count, lat_sum, lng_sum) in sorted(cells.items()):
+        tiles.setdefault((cx // cells_per_tile, cy // cells_per_tile), []).append(
+            [cx % cells_per_tile, cy % cells_per_tile, cover_id, round(lat_sum / count, 6), round(lng_sum / count, 6), count, ts]
+        )
+    return tiles
+
+def unpack_tile(x, y, packed, cells_per_tile):
+    """pack_tiles 的逆操作：瓦片保存的网格还原为 {(cx, cy): [封面 ID, 封面时间戳, 照片数, 纬度和, 经度和]}"""
+    return {
+        (x * cells_per_tile + i, y * cells_per_tile + j): [cover_id, ts, count, lat * count, lng * count]
+        for i, j, cover_id, lat, lng, count, ts in packed
+    }
+
+def build_pyramid(progress_callback=None, batch_size=2000):
+    """
+    全量生成瓦片金字塔：只查询一次最大缩放级别的网格，再逐级合并得到低级别，
+    在一个事务中替换全部瓦片，返回生成的瓦片数
+    """
+    max_zoom, per_tile = get_tile_max_zoom(), get_tile_cells()
+    level = _query_cells(2 ** max_zoom * per_tile)
+    total = 0
+    with transaction.atomic():
+        GeoTile.objects.all().delete()
+        for z in range(max_zoom, -1, -1):
+            tiles = [
+                GeoTile(z=z, x=x, y=y, cells=cells, photo_count=sum(c[5] for c in cells))
+                for (x, y), cells in pack_tiles(level, per_tile).items()
+            ]
+            GeoTile.objects.bulk_create(tiles, batch_size=batch_size)
+            total += len(tiles)
+            if progress_callback:
+                progress_callback(max_zoom - z + 1, max_zoom + 1, z, len(tiles))
+            level = merge_cells(level)
+    return total
+
+def query_tile_cells(z, x, y):
+    """直接从照片表计算单个瓦片的网格 (经纬度范围过滤走 photo_geo_idx，只用于重算最大缩放级别的瓦片)"""
+    per_tile = get_tile_cells()
+    south, north, west, east = tile_bounds(z, x, y)
+    # 范围略微放宽，再按网格坐标精确过滤，避免浮点误差漏掉边界上的照片
+    eps = 1e-9
+    return _query_cells(
+        2 ** z * per_tile,
+        bounds='AND latitude BETWEEN %(south)s AND %(north)s AND longitude BETWEEN %(west)s AND %(east)s',
+        cell_filter='AND cx / %(per_tile)s = %(x)s AND cy / %(per_tile)s = %(y)s',
+        params={
+            'south': south - eps, 'north': north + eps, 'west': west - eps, 'east': east + eps,
+            'per_tile': per_tile, 'x': x, 'y': y,
+        },
+    )
+
+def merge_child_tiles(z, x, y):
+    """由下一级的四个子瓦片合并出瓦片的网格，待重算的子瓦片先递归重算，不访问照片表"""
+    per_tile = get_tile_cells()
+    children = {}
+    for cx in (2 * x, 2 * x + 1):
+        for cy in (2 * y, 2 * y + 1):
+            child = get_tile(z + 1, cx, cy)
+            if child is not None:
+                children.update(unpack_tile(cx, cy, child.cells, per_tile))
+    return merge_cells(children)
+
+def get_tile(z, x, y):
+    """
+    读取瓦片，不存在的瓦片即没有照片，返回 None (空瓦片不保存)
+    待重算的瓦片由子瓦片自底向上合并，只有最大缩放级别的瓦片重新查询照片表 (范围很小)；
+    重算后没有照片的瓦片直接删除
+    """
+    tile = GeoTile.objects.filter(z=z, x=x, y=y).first()
+    if tile is None or not tile.is_stale:
+        return tile
+    # 并发的地图请求与 refresh_stale_tiles 可能同时重算同一瓦片：锁定行后重新检查，
+    # 等待期间已被重算或删除时直接使用结果 (加锁顺序总是先父瓦片后子瓦片，不会死锁)
+    with transaction.atomic():
+        tile = GeoTile.objects.select_for_update().filter(z=z, x=x, y=y).first()
+        if tile is None or not tile.is_stale:
+            return tile
+        if z < get_tile_max_zoom():
+            cells = merge_child_tiles(z, x, y)
+        else:
+            cells = query_tile_cells(z, x, y)
+        packed = pack_tiles(cells, get_tile_cells()).get((x, y), [])
+        if not packed:
+            tile.delete()
+            return None
+        tile.cells, tile.photo_count, tile.is_stale = packed, sum(c[5] for c in packed), False
+        tile.save(update_fields=['cells', 'photo_count', 'is_stale', 'updated_at'])
+        return tile
+
+def mark_tiles_stale(points):
+    """
+    照片导入、删除或坐标变化后，标记其新旧坐标在各级别所在的瓦片待重算，返回标记的瓦片数
+    此前没有照片的瓦片插入一条待重算的空行，重算时再填充 (仍没有照片则删除)
+    """
+    keys = tile_keys(points)
+    if not keys:
+        return 0
+    zs, xs, ys = zip(*keys)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {GeoTile._meta.db_table} (z, x, y, cells, photo_count, is_stale, updated_at)
+            SELECT z, x, y, '[]'::jsonb, 0, TRUE, NOW()
+            FROM unnest(%s::int[], %s::int[], %s::int[]) AS k(z, x, y)
+            ON CONFLICT (z, x, y) DO UPDATE SET is_stale = TRUE
+            WHERE NOT {GeoTile._meta.db_table}.is_stale
+        """, [list(zs), list(xs), list(ys)])
+        return cursor.rowcount
+
+def refresh_tiles_for_points(points):
+    """单张照片删除、恢复等操作后：标记并立即重算受影响的瓦片"""
+    if mark_tiles_stale(points):
+        refresh_stale_tiles()
+
+def mark_photo_tiles_stale(photo_qs):
+    """在软删除 / 删除一批照片之前调用：标记其中仍在地图上显示的照片所在的瓦片"""
+    points = photo_qs.filter(
+        deleted_at__isnull=True, latitude__isnull=False, longitude__isnull=False
+    ).values_list('latitude', 'longitude').distinct()
+    return mark_tiles_stale(points)
+
+def refresh_stale_tiles(progress_callback=None):
+    """
+    重算所有待重算的瓦片 (从最大缩放级别开始，上一级直接合并已重算的子瓦片)，返回重算的数量
+    照片导入、删除与坐标更新后调用，地图请求只读取现成的瓦片
+    """
+    keys = list(GeoTile.objects.filter(is_stale=True).order_by('-z').values_list('z', 'x', 'y'))
+    for i, (z, x, y) in enumerate(keys):
+        get_tile(z, x, y)
+        if progress_callback:
+            progress_callback(i + 1, len(keys))
+    return len(keys)
@@ -139,9 +139,7 @@ class MemoryService:
         """生成“人物特辑”：为经常出现的人物生成回忆"""
         count = 0
         # 查找照片数量较多的人物
-        top_people = Person.objects.annotate(
-            photo_count=Count('photos')
-        ).filter(photo_count__gte=10, is_hidden=False).exclude(name="未命名")
+        top_people = Person.objects.filter(photo_count__gte=10, is_hidden=False).exclude(name="未命名")
 
         for person in top_people:
             title = f"人物特辑：{person.name}"
@@ -181,29 +179,41 @@ class MemoryService:
 
     @staticmethod
     def generate_mood_memories():
-        """生成“心境氛围”回忆：利用 CLIP 语义搜索"""
+        """生成“心境氛围”回忆：优先使用零样本标签索引，未打标签时回退到 CLIP 语义搜索"""
         count = 0
         moods = [
-            {"tag": "开心时刻", "keywords": ["happy people smiling", "laughing together", "party celebration"], "desc": "捕捉那些充满欢笑的瞬间。"},
-            {"tag": "宁静时光", "keywords": ["peaceful landscape", "calm nature sunset", "quiet forest"], "desc": "在自然中寻找片刻宁静。"},
-            {"tag": "美食主义", "keywords": ["delicious food", "gourmet meal", "restaurant table"], "desc": "唯有美食不可辜负。"},
-            {"tag": "萌宠出没", "keywords": ["cute cat dog", "lovely pet", "animal friend"], "desc": "治愈系的小精灵们。"},
-            {"tag": "运动活力", "keywords": ["running cycling sport", "workout fitness", "active lifestyle"], "desc": "生命在于运动。"},
-            {"tag": "城市光影", "keywords": ["city night lights", "urban street photography", "architecture"], "desc": "穿梭在繁华的都市之间。"},
+            {"tag": "开心时刻", "tags": ["smile", "party", "birthday"], "keywords": ["happy people smiling", "laughing together", "party celebration"], "desc": "捕捉那些充满欢笑的瞬间。"},
+            {"tag": "宁静时光", "tags": ["sunset", "lake", "forest", "landscape"], "keywords": ["peaceful landscape", "calm nature sunset", "quiet forest"], "desc": "在自然中寻找片刻宁静。"},
+            {"tag": "美食主义", "tags": ["food", "meal", "dessert", "restaurant"], "keywords": ["delicious food", "gourmet meal", "restaurant table"], "desc": "唯有美食不可辜负。"},
+            {"tag": "萌宠出没", "tags": ["pet", "cat", "dog"], "keywords": ["cute cat dog", "lovely pet", "animal friend"], "desc": "治愈系的小精灵们。"},
+            {"tag": "运动活力", "tags": ["sports", "running", "cycling", "gym"], "keywords": ["running cycling sport", "workout fitness", "active lifestyle"], "desc": "生命在于运动。"},
+            {"tag": "城市光影", "tags": ["city_night", "street", "architecture"], "keywords": ["city night lights", "urban street photography", "architecture"], "desc": "穿梭在繁华的都市之间。"},
         ]
         
-        from .embeddings import search_photos_by_text
+        from .embeddings import search_photos_by_text, encode_texts
+        from .tagging import photo_ids_for_tags
+        from ..models import PhotoTag
+        
+        use_tags = PhotoTag.objects.exists()
+        if not use_tags:
+            # 预先批量编码全部关键词：首次运行一次推理完成，之后直接命中文本向量缓存
+            encode_texts([kw for mood in moods for kw in mood['keywords']])
         
         for mood in moods:
             title = mood['tag']
             if not Memory.objects.filter(title=title, memory_type=Memory.MemoryType.MOOD).exists():
-                # 尝试多个关键词以增加成功率
                 photos = []
-                for kw in mood['keywords']:
-                    results = search_photos_by_text(kw, limit=20)
-                    if results:
-                        photos.extend(results)
-                        if len(photos) >= 5: break
+                if use_tags:
+                    # 标签索引命中：纯 B-tree 查找，无需文本编码与向量扫描
+                    ids = photo_ids_for_tags(mood['tags'], min_score=0.3, limit=20)
+                    photos = sorted(Photo.objects.filter(id__in=ids), key=lambda p: ids.index(p.id))
+                else:
+                    # 尝试多个关键词以增加成功率
+                    for kw in mood['keywords']:
+                        results = search_photos_by_text(kw, limit=20)
+                        if results:
+                            photos.extend(results)
+                            if len(photos) >= 5: break
                 
                 if len(photos) >= 3:
                     # 去重
@@ -1,17 +1,27 @@
-from django.db.models import Avg
-from apps.photos.models import Person, Face, Photo
+from apps.photos.models import Person, Face, Photo, PersonCentroid
 import numpy as np
-import json
-from pgvector.django import CosineDistance
+from .face_clustering import cluster_embeddings, get_cluster_method
+from .embedding_loader import load_face_embeddings
+from .face_quality import get_cluster_threshold
+from .centroids import (
+    add_faces_to_centroid, build_centroid, get_centers, load_person_centers,
+    merge_centroids, nearest_people, rebuild_person_centroid, similar_person_pairs
+)
+
+# 自动创建的人物名称前缀 (人物_1, 人物_2, ...)
+AUTO_PERSON_PREFIX = '人物_'
+# 批量创建新人物时每个事务的人物数
+CREATE_BATCH_SIZE = 2000
+# 匹配已有人物时每块人脸数：4096 张人脸 x 1 万个中心的相似度矩阵约 160MB
+MATCH_CHUNK_SIZE = 4096
 
 class PersonService:
     @staticmethod
     def get_merge_suggestions(threshold=0.2):
         """
         获取合并建议：寻找特征向量相近的人物
-        优化版：使用 pgvector 的自连接在数据库层面完成 O(N^2) 比较，极大提升性能
+        直接比较 PersonCentroid 中的均值向量，不再对整张人脸表求平均
         """
-        from django.db import connection
         from apps.photos.models import Person
         
         # 1. 获取所有非隐藏人物的 ID 列表，用于过滤
@@ -26,26 +36,8 @@ class PersonService:
         for p1_id, p2_id in all_ignored:
             ignored_pairs.add(tuple(sorted([str(p1_id), str(p2_id)])))
 
-        # 3. 使用原生 SQL 在数据库内部进行向量相似度计算
-        # 使用 CTE 计算平均向量，然后进行自连接筛选
-        with connection.cursor() as cursor:
-            sql = """
-                WITH person_embeddings AS (
-                    SELECT person_id, avg(embedding) as avg_vec
-                    FROM photos_face 
-                    WHERE person_id IS NOT NULL AND embedding IS NOT NULL
-                    GROUP BY person_id
-                )
-                SELECT 
-                    p1.person_id as id1, 
-                    p2.person_id as id2, 
-                    p1.avg_vec <=> p2.avg_vec as distance
-                FROM person_embeddings p1
-                JOIN person_embeddings p2 ON p1.person_id < p2.person_id
-                WHERE p1.avg_vec <=> p2.avg_vec < %s
-            """
-            cursor.execute(sql, [threshold])
-            rows = cursor.fetchall()
+        # 3. 读取预先维护的人物特征中心，每个人物只在 HNSW 索引中比较最近的若干邻居
+        rows = similar_person_pairs(threshold)
 
         if not rows:
             return []
@@ -97,253 +89,497 @@ class PersonService:
         target_vec = PersonService.get_person_representative_embedding(target_person)
         if target_vec is None:
             return []
-            
-        # 获取所有其他人物的平均向量
-        from django.db import connection
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT person_id, avg(embedding) 
-                FROM photos_face 
-                WHERE person_id IS NOT NULL AND person_id != %s AND embedding IS NOT NULL
-                GROUP BY person_id
-            """, [target_person.id])
-            rows = cursor.fetchall()
-            
-        def parse_vector(v):
-            if isinstance(v, str):
-                return np.array(json.loads(v))
-            return np.array(v)
 
-        similar_people = []
         ignored_ids = set(target_person.ignored_merges.values_list('id', flat=True))
+        neighbors = nearest_people(
+            target_vec, k=50, max_distance=threshold,
+            exclude_ids=ignored_ids | {target_person.id},
+        )
         
         # 获取人物信息以便显示
-        other_people_map = {p.id: p for p in Person.objects.filter(is_hidden=False)}
-        
-        for row in rows:
-            person_id = row[0]
-            if person_id in ignored_ids or person_id not in other_people_map:
+        other_people_map = Person.objects.filter(
+            id__in=[pid for pid, _ in neighbors], is_hidden=False
+        ).in_bulk()
+
+        similar_people = []
+        for person_id, dist in neighbors:
+            if person_id not in other_people_map:
                 continue
-                
-            other_vec = parse_vector(row[1])
-            dist = PersonService.cosine_distance(target_vec, other_vec)
-            
-            if dist < threshold:
-                similar_people.append({
-                    'person': other_people_map[person_id],
-                    'distance': dist,
-                    'confidence': round((1 - dist) * 100, 1)
-                })
+            similar_people.append({
+                'person': other_people_map[person_id],
+                'distance': dist,
+                'confidence': round((1 - dist) * 100, 1)
+            })
                 
         return sorted(similar_people, key=lambda x: x['distance'])
 
+    @staticmethod
+    def get_person_centroid(person):
+        """读取人物特征中心，缺失或过期时从人脸全量重算"""
+        centroid = PersonCentroid.objects.filter(person_id=person.id).first()
+        if centroid is None or centroid.is_stale:
+            centroid = rebuild_person_centroid(person.id)
+        return centroid
+
     @staticmethod
     def get_person_diverse_embeddings(person, max_clusters=5):
         """
         获取人物的多样化特征向量列表
         如果照片较少，返回 [平均向量]
-        如果照片较多，使用 KMeans 聚类提取 max_clusters 个代表性向量（如正脸、侧脸等）
+        如果照片较多，返回 KMeans 聚类得到的代表性向量（如正脸、侧脸等），随人脸归属变化增量维护
         """
-        faces = person.faces.exclude(embedding__isnull=True)
-        count = faces.count()
-        
-        if count == 0:
+        centroid = PersonService.get_person_centroid(person)
+        if centroid is None:
             return []
-        
-        embeddings = [np.array(f.embedding) for f in faces]
-        
-        # 样本少时，直接用平均值
-        if count < 10:
-            return [np.mean(embeddings, axis=0)]
-            
-        # 样本多时，聚类出几个中心
-        # 聚类数量：每 20 张照片增加一个簇，最多 max_clusters 个
-        n_clusters = min(max_clusters, max(1, count // 20))
-        # 确保 n_clusters 不超过样本数（虽然 count >= 10 肯定满足，但安全起见）
-        n_clusters = min(n_clusters, count)
-        
-        try:
-            from sklearn.cluster import KMeans
-            kmeans = KMeans(n_clusters=n_clusters, n_init=5, random_state=42).fit(embeddings)
-            return list(kmeans.cluster_centers_)
-        except Exception as e:
-            print(f"KMeans failed for person {person.id}: {e}, falling back to mean.")
-            return [np.mean(embeddings, axis=0)]
+        return list(get_centers(centroid)[:max_clusters])
 
     @staticmethod
     def get_person_representative_embedding(person):
-        """获取人物的代表性特征向量（目前取平均值）"""
-        faces = person.faces.exclude(embedding__isnull=True)
-        if not faces.exists():
+        """获取人物的代表性特征向量（归一化的平均值）"""
+        centroid = PersonService.get_person_centroid(person)
+        if centroid is None:
             return None
-        
-        embeddings = [np.array(f.embedding) for f in faces]
-        return np.mean(embeddings, axis=0)
+        return np.asarray(centroid.centroid, dtype=np.float32)
 
     @staticmethod
     def cosine_distance(v1, v2):
         """计算余弦距离 (输入需为 numpy 数组)"""
         return 1 - np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
 
+    @staticmethod
+    def match_faces_to_people(embeddings, threshold, chunk_size=MATCH_CHUNK_SIZE):
+        """
+        把人脸与所有已有人物的多样化中心做比较 (分块的归一化矩阵乘法)
+        embeddings: (N, 512) 已归一化
+        返回长度为 N 的列表：距离小于阈值的最近中心所属的人物 ID，否则为 None
+        """
+        center_owners, center_matrix = load_person_centers()
+        if not center_owners or len(embeddings) == 0:
+            return [None] * len(embeddings)
+
+        print(f"正在尝试匹配 {len(set(center_owners))} 个已有人物（使用多中心特征）...")
+        matched = []
+        for start in range(0, len(embeddings), chunk_size):
+            # (chunk, M) 相似度矩阵，每块内存约 chunk * M * 4 字节
+            sims = embeddings[start:start + chunk_size] @ center_matrix.T
+            best = sims.argmax(axis=1)
+            best_dist = 1 - sims[np.arange(len(best)), best]
+            matched.extend(
+                center_owners[b] if d < threshold else None
+                for b, d in zip(best, best_dist)
+            )
+        return matched
+
+    @staticmethod
+    def link_people_photos(pairs):
+        """批量写入人物-照片关联 (ManyToMany 中间表)，已存在的关联自动跳过"""
+        through = Person.photos.through
+        rows = [through(person_id=person_id, photo_id=photo_id) for person_id, photo_id in set(pairs)]
+        through.objects.bulk_create(rows, batch_size=5000, ignore_conflicts=True)
+
+    @staticmethod
+    def assign_faces_to_people(face_ids, photo_ids, embeddings, assignments):
+        """
+        批量把人脸归入已有人物
+        face_ids / photo_ids: 人脸 ID 与所属照片 ID，与 embeddings 的行一一对应
+        assignments: {person_id: [人脸下标, ...]}
+        每个人物一条 UPDATE，人物-照片关联一次批量插入，缺少头像的人物批量补上头像，照片数与代表人脸一次重算，
+        最后每个人物的特征中心增量更新一次
+        返回成功归入的人脸下标集合
+        """
+        from django.db import transaction
+
+        # 匹配期间可能被删除或合并掉的人物
+        existing = Person.objects.filter(id__in=list(assignments)).in_bulk()
+        assigned = set()
+        with transaction.atomic():
+            pairs = []
+            avatars = []
+            for person_id, indices in assignments.items():
+                person = existing.get(person_id)
+                if person is None:
+                    continue
+                # 只更新仍未标记的人脸，避免覆盖并发的手动标记
+                Face.objects.filter(id__in=[face_ids[i] for i in indices], person__isnull=True).update(person_id=person_id)
+                pairs.extend((person_id, photo_ids[i]) for i in indices)
+                if not person.avatar_id:
+                    person.avatar_id = photo_ids[indices[0]]
+                    avatars.append(person)
+                assigned.update(indices)
+            PersonService.link_people_photos(pairs)
+            if avatars:
+                Person.objects.bulk_update(avatars, ['avatar'], batch_size=1000)
+            PersonService.refresh_person_stats(list(existing))
+
+        for person_id, indices in assignments.items():
+            if person_id in existing:
+                add_faces_to_centroid(person_id, embeddings[indices])
+        return assigned
+
+    @staticmethod
+    def _person_photo_sql(person_ids):
+        """人物-照片同步 / 检查共用的表名与人物过滤条件"""
+        tables = {
+            'links': Person.photos.through._meta.db_table,
+            'faces': Face._meta.db_table,
+        }
+        if person_ids is None:
+            return tables, '', '', []
+        ids = [str(pid) for pid in person_ids]
+        return tables, 'AND f.person_id = ANY(%s::uuid[])', 'AND l.person_id = ANY(%s::uuid[])', [ids]
+
+    @staticmethod
+    def sync_person_photos(person_ids=None, cleanup=True):
+        """
+        按人脸归属同步人物-照片关联 (集合式 SQL，与人物数量无关)
+        补齐：一条 INSERT ... SELECT DISTINCT person_id, photo_id FROM 人脸表 ON CONFLICT DO NOTHING
+        清理：删除没有对应人脸的关联行
+        person_ids: 只同步这些人物，None 为全部
+        返回 (新增行数, 删除行数)
+        """
+        from django.db import connection, transaction
+
+        tables, face_filter, link_filter, params = PersonService._person_photo_sql(person_ids)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {tables['links']} (person_id, photo_id)
+                SELECT DISTINCT f.person_id, f.photo_id FROM {tables['faces']} f
+                WHERE f.person_id IS NOT NULL {face_filter}
+                ON CONFLICT DO NOTHING
+            """, params)
+            added = cursor.rowcount
+            removed = 0
+            if cleanup:
+                cursor.execute(f"""
+                    DELETE FROM {tables['links']} l
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {tables['faces']} f WHERE f.person_id = l.person_id AND f.photo_id = l.photo_id
+                    ) {link_filter}
+                """, params)
+                removed = cursor.rowcount
+        return added, removed
+
+    @staticmethod
+    def check_person_photos(person_ids=None):
+        """
+        一致性检查 (只读)：人物-照片关联与人脸归属的偏差
+        返回 {'missing': 有人脸但缺少关联的 (人物, 照片) 数, 'stale': 没有对应人脸的关联行数, 'people': 存在偏差的人物数}
+        """
+        from django.db import connection
+
+        tables, face_filter, link_filter, params = PersonService._person_photo_sql(person_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH missing AS (
+                    SELECT DISTINCT f.person_id, f.photo_id FROM {tables['faces']} f
+                    WHERE f.person_id IS NOT NULL {face_filter} AND NOT EXISTS (
+                        SELECT 1 FROM {tables['links']} l WHERE l.person_id = f.person_id AND l.photo_id = f.photo_id
+                    )
+                ), stale AS (
+                    SELECT l.person_id, l.photo_id FROM {tables['links']} l
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {tables['faces']} f WHERE f.person_id = l.person_id AND f.photo_id = l.photo_id
+                    ) {link_filter}
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM missing),
+                    (SELECT COUNT(*) FROM stale),
+                    (SELECT COUNT(DISTINCT person_id) FROM (
+                        SELECT person_id FROM missing UNION ALL SELECT person_id FROM stale
+                    ) drift)
+            """, params * 2)
+            missing, stale, people = cursor.fetchone()
+        return {'missing': missing, 'stale': stale, 'people': people}
+
+    @staticmethod
+    def refresh_person_stats(person_ids=None):
+        """
+        重算人物的冗余字段 photo_count (人脸所在的不同照片数) 与 representative_face (头像照片中的人脸优先，其次置信度最高)
+        一条 UPDATE ... FROM 子查询完成，只写入发生变化的行
+        person_ids: 只重算这些人物，None 为全部
+        返回更新的人物数
+        """
+        from django.db import connection
+
+        person_table = Person._meta.db_table
+        face_table = Face._meta.db_table
+        person_filter, params = '', []
+        if person_ids is not None:
+            person_filter = 'WHERE p2.id = ANY(%s::uuid[])'
+            params = [[str(pid) for pid in person_ids]]
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE {person_table} p
+                SET photo_count = s.photo_count, representative_face_id = s.face_id
+                FROM (
+                    SELECT p2.id AS person_id,
+                        (SELECT COUNT(DISTINCT f.photo_id) FROM {face_table} f WHERE f.person_id = p2.id) AS photo_count,
+                        (SELECT f.id FROM {face_table} f WHERE f.person_id = p2.id
+                         ORDER BY COALESCE(f.photo_id = p2.avatar_id, FALSE) DESC, f.prob DESC LIMIT 1) AS face_id
+                    FROM {person_table} p2 {person_filter}
+                ) s
+                WHERE p.id = s.person_id
+                  AND (p.photo_count <> s.photo_count OR p.representative_face_id IS DISTINCT FROM s.face_id)
+            """, params)
+            return cursor.rowcount
+
+    @staticmethod
+    def merge_people(target, source_ids, invalidate_cache=True):
+        """
+        把多个人物一次性合并到 target (单个事务)
+        人脸、人物-照片关联与忽略的合并建议各用一条集合式 SQL 转移，特征中心合并一次，最后删除源人物
+        返回实际合并的人物数
+        """
+        from django.core.cache import cache
+        from django.db import connection, transaction
+
+        with transaction.atomic():
+            sources = list(
+                Person.objects.select_for_update()
+                .filter(id__in=list(source_ids)).exclude(id=target.id)
+                .values_list('id', 'avatar_id')
+            )
+            if not sources:
+                return 0
+            ids = [pid for pid, _ in sources]
+
+            # 1. 人脸直接改归属
+            Face.objects.filter(person_id__in=ids).update(person_id=target.id)
+
+            photos_table = Person.photos.through._meta.db_table
+            ignored_table = Person.ignored_merges.through._meta.db_table
+            with connection.cursor() as cursor:
+                # 2. 人物-照片关联：源人物的所有照片一次插入到目标人物，已存在的跳过
+                cursor.execute(f"""
+                    INSERT INTO {photos_table} (person_id, photo_id)
+                    SELECT DISTINCT %s::uuid, photo_id FROM {photos_table} WHERE person_id = ANY(%s::uuid[])
+                    ON CONFLICT DO NOTHING
+                """, [str(target.id), [str(pid) for pid in ids]])
+
+                # 3. 忽略的合并建议 (对称关系，两个方向各存一行)，排除目标人物与本次被合并的人物
+                excluded = [str(pid) for pid in ids + [target.id]]
+                cursor.execute(f"""
+                    INSERT INTO {ignored_table} (from_person_id, to_person_id)
+                    SELECT DISTINCT pair.from_id, pair.to_id FROM (
+                        SELECT %s::uuid AS from_id, to_person_id AS to_id FROM {ignored_table}
+                        WHERE from_person_id = ANY(%s::uuid[]) AND NOT (to_person_id = ANY(%s::uuid[]))
+                        UNION
+                        SELECT to_person_id, %s::uuid FROM {ignored_table}
+                        WHERE from_person_id = ANY(%s::uuid[]) AND NOT (to_person_id = ANY(%s::uuid[]))
+                    ) pair
+                    ON CONFLICT DO NOTHING
+                """, [str(target.id), excluded[:-1], excluded, str(target.id), excluded[:-1], excluded])
+
+            # 4. 目标人物没有头像时沿用第一个有头像的源人物
+            if not target.avatar_id:
+                avatar_id = next((avatar_id for _, avatar_id in sources if avatar_id), None)
+                if avatar_id:
+                    target.avatar_id = avatar_id
+                    target.save(update_fields=['avatar'])
+
+            # 5. 合并特征中心 (需在删除源人物之前，删除会级联删除它们的中心)
+            merge_centroids(ids, target.id)
+
+            # 6. 删除源人物 (关联表中的行随之级联删除)
+            Person.objects.filter(id__in=ids).delete()
+
+            # 7. 重算目标人物的照片数与代表人脸
+            PersonService.refresh_person_stats([target.id])
+
+        if invalidate_cache:
+            cache.delete('merge_suggestions_all')
+        return len(ids)
+
+    @staticmethod
+    def plan_merges(pairs):
+        """
+        把 (源人物, 目标人物) 对整理为合并计划 {目标人物 ID: [源人物 ID, ...]}
+        已被合并的人物沿链条找到最终目标，A->B、B->C 合并为 C 吸收 A 和 B
+        """
+        merged_into = {}
+
+        def resolve(person_id):
+            while person_id in merged_into:
+                person_id = merged_into[person_id]
+            return person_id
+
+        for source_id, target_id in pairs:
+            source_id, target_id = resolve(source_id), resolve(target_id)
+            if source_id != target_id:
+                merged_into[source_id] = target_id
+
+        plan = {}
+        for source_id in merged_into:
+            plan.setdefault(resolve(source_id), []).append(source_id)
+        return plan
+
+    @staticmethod
+    def apply_merges(pairs, log_func=None):
+        """
+        按 (源人物, 目标人物) 对批量合并：每个最终目标人物一次 merge_people，合并建议缓存只清理一次
+        每个目标人物单独一个事务，某个目标合并失败时记录错误并继续合并其余目标
+        log_func: 可选的日志回调 (message, level)
+        返回实际合并的人物数
+        """
+        from django.core.cache import cache
+
+        plan = PersonService.plan_merges(pairs)
+        targets = Person.objects.in_bulk(list(plan))
+        merged = 0
+        for target_id, source_ids in plan.items():
+            target = targets.get(target_id)
+            if target is None:
+                continue
+            try:
+                merged += PersonService.merge_people(target, source_ids, invalidate_cache=False)
+            except Exception as e:
+                if log_func:
+                    log_func(f"合并到 {target.name} 失败 ({len(source_ids)} 个人物): {e}", 'error')
+        if merged:
+            cache.delete('merge_suggestions_all')
+        return merged
+
+    @staticmethod
+    def next_person_number():
+        """自动命名 (人物_N) 的下一个序号：一次 MAX() 查询，之后在内存中递增"""
+        from django.db.models import IntegerField, Max
+        from django.db.models.functions import Cast, Substr
+
+        prefix = AUTO_PERSON_PREFIX
+        result = Person.objects.filter(
+            name__regex=rf'^{prefix}[0-9]{{1,9}}$'
+        ).aggregate(
+            max_number=Max(Cast(Substr('name', len(prefix) + 1), IntegerField()))
+        )
+        return (result['max_number'] or 0) + 1
+
+    @staticmethod
+    def create_people_for_groups(face_ids, photo_ids, embeddings, groups, batch_size=CREATE_BATCH_SIZE):
+        """
+        为每组人脸批量创建新人物
+        face_ids / photo_ids: 人脸 ID 与所属照片 ID，与 embeddings 的行一一对应
+        groups: [人脸下标数组, ...]，每组对应一个新人物
+        每批人脸归属一条 UPDATE (只更新仍未标记的人脸)，再按实际归入的人脸批量创建人物、
+        人物-照片关联与特征中心；加载之后已被手动或并发标记的人脸保持原归属，全部被标记的组不创建人物
+        返回归入新人物的人脸数
+        """
+        import uuid
+        from django.db import connection, transaction
+
+        number = PersonService.next_person_number()
+        labeled = 0
+        for start in range(0, len(groups), batch_size):
+            batch = groups[start:start + batch_size]
+            # 主键在客户端生成，写入人脸归属时无需回查
+            person_ids = [uuid.uuid4() for _ in batch]
+            owner_face_ids, owner_person_ids = [], []
+            for person_id, indices in zip(person_ids, batch):
+                owner_face_ids.extend(str(face_ids[i]) for i in indices)
+                owner_person_ids.extend([str(person_id)] * len(indices))
+
+            with transaction.atomic():
+                # 人物行在同一事务内随后创建，外键约束 (DEFERRABLE INITIALLY DEFERRED) 在提交时检查
+                with connection.cursor() as cursor:
+                    cursor.execute(f"""
+                        UPDATE {Face._meta.db_table} f SET person_id = v.person_id
+                        FROM unnest(%s::uuid[], %s::uuid[]) AS v(face_id, person_id)
+                        WHERE f.id = v.face_id AND f.person_id IS NULL
+                        RETURNING f.id
+                    """, [owner_face_ids, owner_person_ids])
+                    updated = {str(row[0]) for row in cursor.fetchall()}
+
+                people, pairs, centroids = [], [], []
+                for person_id, indices in zip(person_ids, batch):
+                    indices = [i for i in indices if str(face_ids[i]) in updated]
+                    if not indices:
+                        continue
+                    people.append(Person(
+                        id=person_id,
+                        name=f"{AUTO_PERSON_PREFIX}{number}",
+                        # 设置第一个脸的照片为头像，确保在列表页能看到头像
+                        avatar_id=photo_ids[indices[0]],
+                        # 头像照片中的人脸即代表人脸
+                        representative_face_id=face_ids[indices[0]],
+                        photo_count=len({photo_ids[i] for i in indices}),
+                    ))
+                    number += 1
+                    pairs.extend((person_id, photo_ids[i]) for i in indices)
+                    centroids.append(build_centroid(person_id, embeddings[indices]))
+
+                Person.objects.bulk_create(people, batch_size=1000)
+                PersonService.link_people_photos(pairs)
+                PersonCentroid.objects.bulk_create(centroids, batch_size=1000)
+            labeled += len(updated)
+        return labeled
+
     @staticmethod
     def auto_cluster_unlabeled_faces(threshold=0.3, min_samples=2):
         """
         使用快速聚类算法处理大量未标记人脸
         1. 尝试匹配已有人物
-        2. 对剩余人脸进行 DBSCAN 聚类
+        2. 对剩余人脸构建 k 近邻图并做图聚类 (见 face_clustering)
         """
-        from sklearn.cluster import DBSCAN, KMeans
         import numpy as np
-        from django.db import transaction
         from django.db import connections
 
-        # 获取所有未标记且有向量的人脸
-        # 针对 8 万张脸的大规模数据，我们分批处理向量加载
-        self_qs = Face.objects.filter(person__isnull=True, embedding__isnull=False).only('id', 'embedding', 'photo_id')
-        total_unlabeled = self_qs.count()
-        
-        if total_unlabeled == 0:
+        # 获取所有未标记且有向量的人脸：服务端游标 + 二进制向量格式直接读入连续矩阵，不创建模型实例
+        # 质量分低于聚类阈值的人脸 (背景小脸、虚焦) 不参与匹配与聚类，避免产生大量单人脸人物
+        loaded = load_face_embeddings(unlabeled=True, min_quality=get_cluster_threshold(), with_photo_ids=True)
+        if len(loaded) == 0:
             return 0
+        print(f"加载 {loaded.describe()}，进行聚类分析...")
+        face_ids = loaded.ids
+        photo_ids = loaded.columns['photo_id']
 
-        print(f"加载 {total_unlabeled} 个特征向量进行聚类分析...")
-        unlabeled_faces = list(self_qs)
-        labeled_count = 0
+        # 归一化后的向量矩阵，余弦相似度即为矩阵乘积 (原地归一化，不再复制一份)
+        embeddings = loaded.matrix
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # 避免除以 0
+        norms[norms == 0] = 1
+        embeddings /= norms
         
         # --- 第一阶段：尝试匹配已有人物 ---
-        people = Person.objects.all()
-        # 预先计算所有人物的代表向量（对于照片多的人物，使用多中心特征）
-        people_vecs = []
-        for p in people:
-            # 使用多中心特征提取，能更好地覆盖人物的不同角度（正脸、侧脸等）
-            vecs = PersonService.get_person_diverse_embeddings(p)
-            if vecs:
-                people_vecs.append((p, vecs))
-        
-        remaining_faces = []
-        if people_vecs:
-            print(f"正在尝试匹配 {len(people_vecs)} 个已有人物（使用多中心特征）...")
-            for face in unlabeled_faces:
-                best_match = None
-                # 匹配已有人物时可以使用稍微宽松一点的阈值
-                current_threshold = threshold 
-                min_dist = current_threshold
-                
-                face_vec = np.array(face.embedding)
-                for person, p_vecs in people_vecs:
-                    # 计算到该人物所有中心的最小距离
-                    # p_vecs 是一个列表 [v1, v2, ...]
-                    dists = [PersonService.cosine_distance(face_vec, pv) for pv in p_vecs]
-                    dist = min(dists)
-                    
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_match = person
-                
-                if best_match:
-                    try:
-                        with transaction.atomic():
-                            # 再次确认人物是否存在，防止竞态条件
-                            if not Person.objects.filter(id=best_match.id).exists():
-                                remaining_faces.append(face)
-                                continue
-                                
-                            face.person = best_match
-                            face.save()
-                            best_match.photos.add(face.photo_id)
-                            # 确保人物有头像
-                            if not best_match.avatar:
-                                best_match.avatar = face.photo
-                                best_match.save(update_fields=['avatar'])
-                            labeled_count += 1
-                    except Exception as e:
-                        print(f"Error labeling face {face.id} to person {best_match.id}: {e}")
-                        remaining_faces.append(face)
-                else:
-                    remaining_faces.append(face)
+        # 直接读取预先维护的多中心特征（正脸、侧脸等），分块矩阵乘法一次比较所有人脸与所有中心
+        matched = PersonService.match_faces_to_people(embeddings, threshold)
+        assignments = {}
+        for i, person_id in enumerate(matched):
+            if person_id is not None:
+                assignments.setdefault(person_id, []).append(i)
+        labeled_count = 0
+        if assignments:
+            print(f"正在将 {sum(len(v) for v in assignments.values())} 张人脸归入 {len(assignments)} 个已有人物...")
+            assigned = PersonService.assign_faces_to_people(face_ids, photo_ids, embeddings, assignments)
+            labeled_count += len(assigned)
         else:
-            remaining_faces = unlabeled_faces
+            assigned = set()
 
-        if not remaining_faces:
+        remaining_indices = [i for i in range(len(face_ids)) if i not in assigned]
+        face_ids = [face_ids[i] for i in remaining_indices]
+        photo_ids = [photo_ids[i] for i in remaining_indices]
+        embeddings = embeddings[remaining_indices]
+
+        if not face_ids:
             return labeled_count
 
-        # --- 第二阶段：对剩余人脸进行快速聚类 (DBSCAN) ---
-        print(f"对剩余 {len(remaining_faces)} 张人脸进行 DBSCAN 聚类发现新人物...")
-        
-        # 准备数据矩阵
-        embeddings = np.array([f.embedding for f in remaining_faces])
+        # --- 第二阶段：对剩余人脸进行快速聚类 (k 近邻图) ---
+        print(f"对剩余 {len(face_ids)} 张人脸进行聚类 ({get_cluster_method()}) 发现新人物...")
         
-        # 确保向量归一化，以便余弦距离计算更准确
-        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-        # 避免除以 0
-        norms[norms == 0] = 1
-        embeddings = embeddings / norms
-        
-        # 余弦距离下的 DBSCAN
-        # eps 是距离阈值，余弦距离 = 1 - 相似度
-        clustering = DBSCAN(eps=threshold, min_samples=min_samples, metric='cosine', n_jobs=-1).fit(embeddings)
-        
-        labels = clustering.labels_
+        # k 近邻图 + 图聚类，阈值为余弦距离 (1 - 相似度)，内存随人脸数线性增长
+        labels = cluster_embeddings(embeddings, threshold, min_samples=min_samples)
         unique_labels = set(labels)
         
         print(f"聚类完成，发现 {len(unique_labels) - (1 if -1 in unique_labels else 0)} 个潜在新人物群组")
         
-        # 处理每个簇
-        def get_next_person_name():
-            nonlocal current_person_count
-            while True:
-                current_person_count += 1
-                name = f"人物_{current_person_count}"
-                if not Person.objects.filter(name=name).exists():
-                    return name
-
-        current_person_count = Person.objects.count()
-        for label in unique_labels:
-            if label == -1: # 噪声点
-                continue
-            
-            # 获取该簇的所有索引
-            indices = np.where(labels == label)[0]
-            cluster_faces = [remaining_faces[i] for i in indices]
-            
-            # 为该簇创建一个新人物
-            with transaction.atomic():
-                new_person = Person.objects.create(
-                    name=get_next_person_name()
-                )
-                
-                # 批量更新关联
-                face_ids = [f.id for f in cluster_faces]
-                Face.objects.filter(id__in=face_ids).update(person=new_person)
-                
-                # 批量添加照片关联 (ManyToMany)
-                photo_ids = list(set(f.photo_id for f in cluster_faces))
-                new_person.photos.add(*photo_ids)
-                
-                # 设置第一个脸的照片为头像，确保在列表页能看到头像
-                if cluster_faces:
-                    new_person.avatar_id = cluster_faces[0].photo_id
-                    new_person.save()
-                
-                labeled_count += len(cluster_faces)
-        
-        # --- 第三阶段：处理无法成簇的孤立人脸 ---
-        # 为每个孤立的人脸也创建一个“未命名”人物，以便用户可以手动命名和合并
+        # 每个簇一个新人物；无法成簇的孤立人脸也各自创建一个“未命名”人物，以便用户可以手动命名和合并
+        # 按标签排序后切分，一次得到所有簇的下标
+        order = np.argsort(labels, kind='stable')
+        bounds = np.flatnonzero(np.diff(labels[order])) + 1
+        groups = [part for part in np.split(order, bounds) if len(part) and labels[part[0]] != -1]
         noise_indices = np.where(labels == -1)[0]
         if len(noise_indices) > 0:
             print(f"处理 {len(noise_indices)} 个孤立人脸...")
-            for idx in noise_indices:
-                face = remaining_faces[idx]
-                with transaction.atomic():
-                    new_person = Person.objects.create(
-                        name=get_next_person_name()
-                    )
-                    
-                    face.person = new_person
-                    face.save()
-                    new_person.photos.add(face.photo_id)
-                    new_person.avatar_id = face.photo_id
-                    new_person.save()
-                    labeled_count += 1
+        groups.extend(noise_indices[:, None])
+        labeled_count += PersonService.create_people_for_groups(face_ids, photo_ids, embeddings, groups)
         
         # 任务结束后清理连接
         connections.close_all()
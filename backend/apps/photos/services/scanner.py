@@ -17,6 +17,10 @@ from .faces import detect_faces_in_photo, cluster_faces
 from .embeddings import generate_photo_embedding
 from .motion_photo import MotionPhotoService
 from .video import extract_video_metadata
+from .dedup import compute_dhash
+from .centroids import affected_person_ids, mark_centroids_stale
+from .people import PersonService
+from .geo import mark_photo_tiles_stale, mark_tiles_stale, refresh_stale_tiles
 
 def get_gps_data(exif):
     """从 EXIF 中提取 GPS 经纬度"""
@@ -234,6 +238,7 @@ def process_single_file(file_path, log_func=None):
         width, height = 0, 0
         duration = 0.0
         lat, lon = None, None
+        phash = None
         is_video = ext in video_extensions
         video_path = file_path if is_video else None
         is_live_photo = False
@@ -264,6 +269,11 @@ def process_single_file(file_path, log_func=None):
                     exif = img.getexif()
                     img = ImageOps.exif_transpose(img)
                     width, height = img.size
+                    # 复用已解码的图像计算感知哈希，用于近似重复查找
+                    try:
+                        phash = compute_dhash(img)
+                    except Exception:
+                        phash = None
                     if exif:
                         if not captured_at:
                             dt_orig = exif.get(36867)
@@ -307,6 +317,7 @@ def process_single_file(file_path, log_func=None):
         photo = Photo.objects.create(
             file_path=file_path,
             hash_md5=file_hash,
+            phash=phash,
             captured_at=captured_at,
             width=width,
             height=height,
@@ -317,6 +328,9 @@ def process_single_file(file_path, log_func=None):
             video_path=video_path,
             duration=duration
         )
+        # 有坐标的新照片：地图瓦片待重算
+        if lat is not None and lon is not None:
+            mark_tiles_stale([(lat, lon)])
         
         # 无论是图片还是视频，都尝试进行人脸检测和向量生成
         # [MODIFIED] 用户要求解耦，扫描时不再自动执行这些耗时操作
@@ -456,7 +470,13 @@ def scan_directory(path, logger=None, library_id=None, task_id=None):
             batch_size = 900
             for i in range(0, count_deleted, batch_size):
                 batch_ids = ids_to_delete[i:i+batch_size]
-                Photo.objects.filter(id__in=batch_ids).delete()
+                batch_qs = Photo.objects.filter(id__in=batch_ids)
+                # 人脸随照片级联删除，涉及人物的照片数与代表人脸需在删除后重算
+                person_ids = affected_person_ids(batch_qs)
+                mark_centroids_stale(batch_qs)
+                mark_photo_tiles_stale(batch_qs)
+                batch_qs.delete()
+                PersonService.refresh_person_stats(person_ids)
             
             log(f"清理已删除文件: {count_deleted} 个", 'warning')
 
@@ -466,6 +486,12 @@ def scan_directory(path, logger=None, library_id=None, task_id=None):
         library.last_scanned_at = make_aware(datetime.now())
         library.save()
 
+    # 新增、移除的照片所在的地图瓦片
+    try:
+        refresh_stale_tiles()
+    except Exception as e:
+        log(f"地图瓦片更新失败: {e}", 'warning')
+
     if count > 0:
         from django.core.cache import cache
         cache.delete('years_timeline_data')
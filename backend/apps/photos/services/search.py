@@ -0,0 +1,139 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from apps.photos.models import Photo
+from ..utils import hnsw_search_session, photo_vector_field
+from .embeddings import encode_text, TextEmbeddingCache
+
+# RRF 融合常数，60 为论文推荐值，越大则排名靠后的结果权重衰减越慢
+RRF_K = 60
+# 每一路召回的候选数量
+HYBRID_CANDIDATE_DEPTH = 500
+# 融合排序结果缓存时间 (秒)，翻页时直接复用
+HYBRID_RANKING_TTL = 300
+
+def keyword_search_queryset(query):
+    """
+    关键词匹配 (地点名称 / 文件路径)
+    icontains 由 UPPER(col) 上的 pg_trgm GIN 索引支撑，避免全表 LIKE 扫描；
+    命中结果再按三元组词相似度排序，最相关的地点排在前面
+    """
+    query = query.strip()
+    return Photo.objects.filter(
+        deleted_at__isnull=True
+    ).filter(
+        Q(location_name__icontains=query) |
+        Q(file_path__icontains=query)
+    ).annotate(
+        keyword_score=Greatest(
+            TrigramWordSimilarity(query, 'location_name'),
+            TrigramWordSimilarity(query, 'file_path'),
+        )
+    ).order_by('-keyword_score', '-captured_at')
+
+def keyword_search_photos(query, limit=100):
+    """关键词匹配，返回照片对象列表"""
+    if not query or not query.strip():
+        return []
+    return list(keyword_search_queryset(query)[:limit])
+
+def keyword_search_ids(query, limit=HYBRID_CANDIDATE_DEPTH):
+    """关键词匹配，只返回按相关度排序的照片 ID (不实例化模型)"""
+    if not query or not query.strip():
+        return []
+    return list(keyword_search_queryset(query).values_list('id', flat=True)[:limit])
+
+def semantic_search_ids(query, limit=HYBRID_CANDIDATE_DEPTH, max_distance=0.8):
+    """语义搜索，只返回按距离排序的照片 ID (不实例化模型)"""
+    text_emb = encode_text(query)
+    if text_emb is None:
+        return []
+    field = photo_vector_field()
+    with hnsw_search_session(ef_search=limit):
+        return list(
+            Photo.objects.filter(deleted_at__isnull=True, **{f'{field}__isnull': False})
+            .annotate(distance=CosineDistance(field, text_emb))
+            .filter(distance__lt=max_distance)
+            .order_by('distance')
+            .values_list('id', flat=True)[:limit]
+        )
+
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    """
+    倒数排名融合 (Reciprocal Rank Fusion)
+    score(d) = Σ 1 / (k + rank_i(d))，rank 从 1 开始
+    返回按得分降序排列的 [(id, score), ...]
+    """
+    scores = {}
+    for ranked in ranked_lists:
+        for rank, item_id in enumerate(ranked, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+def _run_in_thread(func, *args):
+    """在线程中执行查询，结束后关闭该线程持有的数据库连接"""
+    try:
+        return func(*args)
+    except Exception as e:
+        print(f"搜索子查询失败 ({func.__name__}): {e}")
+        return []
+    finally:
+        connections.close_all()
+
+def hybrid_search(query, depth=HYBRID_CANDIDATE_DEPTH):
+    """
+    混合搜索：关键词与语义两路并发召回，再用 RRF 融合排序
+    返回 [(photo_id, score), ...]
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        keyword_future = executor.submit(_run_in_thread, keyword_search_ids, query, depth)
+        semantic_future = executor.submit(_run_in_thread, semantic_search_ids, query, depth)
+        keyword_ids = keyword_future.result()
+        semantic_ids = semantic_future.result()
+
+    return reciprocal_rank_fusion([keyword_ids, semantic_ids])
+
+def get_hybrid_ranking(query):
+    """
+    获取混合搜索的完整排序 (带缓存)
+    首页请求计算一次后缓存，后续翻页直接切片，不再重复召回与融合
+    """
+    normalized = TextEmbeddingCache.normalize(query)
+    cache_key = f"hybrid_search_{hashlib.md5(normalized.encode('utf-8')).hexdigest()}"
+    ranking = cache.get(cache_key)
+    if ranking is None:
+        ranking = [(str(pid), round(score, 6)) for pid, score in hybrid_search(normalized)]
+        cache.set(cache_key, ranking, HYBRID_RANKING_TTL)
+    return ranking
+
+def similar_photo_queryset(photo, date_from=None, date_to=None, exclude_same_day=False, exclude_trashed=True):
+    """
+    以照片自身的语义向量为查询向量，查找相似照片 ("更多类似照片")
+    所有过滤条件都作为 SQL WHERE 条件下推，配合 HNSW 迭代扫描在索引内完成过滤
+    """
+    field = photo_vector_field()
+    qs = Photo.objects.filter(**{f'{field}__isnull': False}).exclude(id=photo.id)
+
+    if exclude_trashed:
+        qs = qs.filter(deleted_at__isnull=True)
+    if date_from:
+        qs = qs.filter(captured_at__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        qs = qs.filter(captured_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)))
+    if exclude_same_day and photo.captured_at:
+        # 用区间而不是 __date 比较，保持条件可被索引利用
+        day_start = timezone.localtime(photo.captured_at).replace(hour=0, minute=0, second=0, microsecond=0)
+        qs = qs.exclude(captured_at__gte=day_start, captured_at__lt=day_start + timedelta(days=1))
+
+    return qs.annotate(
+        distance=CosineDistance(field, photo.get_embedding())
+    ).order_by('distance')
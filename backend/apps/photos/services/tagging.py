@@ -0,0 +1,348 @@
+import hashlib
+import json
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from apps.photos.models import Photo, PhotoTag
+from apps.photos.utils import photo_vector_field, vector_to_numpy
+from .embeddings import encode_texts, CLIP_MODEL_NAME
+
+# CLIP 的 logit 缩放系数 (ViT-B-32 训练得到的温度约为 100)
+CLIP_LOGIT_SCALE = 100.0
+# 每批打分的照片数量：4096 x 512 的 float32 矩阵约 8MB
+DEFAULT_TAG_BATCH_SIZE = 4096
+
+# 内置词表：(标签键, 中文名称, 提示词)，提示词为空时使用 "a photo of <标签>"
+DEFAULT_TAG_VOCABULARY = [
+    # 人物与活动
+    ('people', '人物', 'a photo of people'),
+    ('selfie', '自拍', 'a selfie'),
+    ('portrait', '人像', 'a portrait photo of a person'),
+    ('group_photo', '合影', 'a group photo of friends'),
+    ('baby', '宝宝', 'a photo of a baby'),
+    ('child', '儿童', 'a photo of a child playing'),
+    ('smile', '笑容', 'a photo of happy people smiling'),
+    ('party', '聚会', 'a photo of a party celebration'),
+    ('birthday', '生日', 'a photo of a birthday party with cake'),
+    ('wedding', '婚礼', 'a photo of a wedding'),
+    ('graduation', '毕业', 'a photo of a graduation ceremony'),
+    ('concert', '演唱会', 'a photo of a concert on stage'),
+    ('festival', '节日', 'a photo of a festival'),
+    ('fireworks', '烟花', None),
+    ('christmas', '圣诞', 'a photo of christmas decorations'),
+    ('spring_festival', '春节', 'a photo of chinese new year decorations'),
+    ('meeting', '会议', 'a photo of a business meeting'),
+    ('classroom', '课堂', 'a photo of a classroom'),
+    ('shopping', '购物', 'a photo of shopping in a mall'),
+    # 运动
+    ('sports', '运动', 'a photo of people playing sports'),
+    ('running', '跑步', 'a photo of a person running'),
+    ('cycling', '骑行', 'a photo of cycling'),
+    ('gym', '健身', 'a photo of a workout in the gym'),
+    ('swimming', '游泳', 'a photo of swimming'),
+    ('hiking', '徒步', 'a photo of hiking in the mountains'),
+    ('skiing', '滑雪', 'a photo of skiing'),
+    ('football', '足球', 'a photo of playing football'),
+    ('basketball', '篮球', 'a photo of playing basketball'),
+    ('badminton', '羽毛球', 'a photo of playing badminton'),
+    ('yoga', '瑜伽', 'a photo of yoga'),
+    ('camping', '露营', 'a photo of camping with a tent'),
+    ('fishing', '钓鱼', 'a photo of fishing'),
+    # 动物
+    ('pet', '宠物', 'a photo of a cute pet'),
+    ('cat', '猫', 'a photo of a cat'),
+    ('dog', '狗', 'a photo of a dog'),
+    ('bird', '鸟', 'a photo of a bird'),
+    ('fish', '鱼', 'a photo of fish in an aquarium'),
+    ('rabbit', '兔子', 'a photo of a rabbit'),
+    ('horse', '马', 'a photo of a horse'),
+    ('panda', '熊猫', 'a photo of a panda'),
+    ('insect', '昆虫', 'a photo of an insect'),
+    ('zoo', '动物园', 'a photo of animals in a zoo'),
+    # 美食
+    ('food', '美食', 'a photo of delicious food'),
+    ('meal', '正餐', 'a photo of a meal on a dining table'),
+    ('restaurant', '餐厅', 'a photo of a restaurant'),
+    ('dessert', '甜点', 'a photo of a dessert'),
+    ('cake', '蛋糕', 'a photo of a cake'),
+    ('coffee', '咖啡', 'a photo of a cup of coffee'),
+    ('tea', '茶', 'a photo of a cup of tea'),
+    ('drink', '饮品', 'a photo of a drink'),
+    ('hotpot', '火锅', 'a photo of chinese hot pot'),
+    ('barbecue', '烧烤', 'a photo of barbecue'),
+    ('noodles', '面条', 'a photo of a bowl of noodles'),
+    ('sushi', '寿司', 'a photo of sushi'),
+    ('fruit', '水果', 'a photo of fruit'),
+    ('cooking', '烹饪', 'a photo of cooking in a kitchen'),
+    # 自然风光
+    ('landscape', '风景', 'a photo of a beautiful landscape'),
+    ('beach', '海滩', 'a photo of a beach'),
+    ('sea', '大海', 'a photo of the sea'),
+    ('mountain', '山', 'a photo of mountains'),
+    ('lake', '湖泊', 'a photo of a lake'),
+    ('river', '河流', 'a photo of a river'),
+    ('waterfall', '瀑布', 'a photo of a waterfall'),
+    ('forest', '森林', 'a photo of a forest'),
+    ('desert', '沙漠', 'a photo of a desert'),
+    ('grassland', '草原', 'a photo of grassland'),
+    ('island', '海岛', 'a photo of a tropical island'),
+    ('sunset', '日落', 'a photo of a sunset'),
+    ('sunrise', '日出', 'a photo of a sunrise'),
+    ('sky', '天空', 'a photo of the sky with clouds'),
+    ('night_sky', '星空', 'a photo of a starry night sky'),
+    ('snow', '雪景', 'a photo of a snowy landscape'),
+    ('rain', '雨天', 'a photo taken on a rainy day'),
+    ('flower', '花', 'a photo of flowers'),
+    ('cherry_blossom', '樱花', 'a photo of cherry blossoms'),
+    ('autumn_leaves', '红叶', 'a photo of autumn leaves'),
+    ('tree', '树木', 'a photo of trees'),
+    ('garden', '花园', 'a photo of a garden'),
+    ('park', '公园', 'a photo of a park'),
+    # 城市与建筑
+    ('city', '城市', 'a photo of a city'),
+    ('city_night', '城市夜景', 'a photo of city night lights'),
+    ('street', '街道', 'a photo of a street'),
+    ('architecture', '建筑', 'a photo of architecture'),
+    ('skyscraper', '摩天楼', 'a photo of skyscrapers'),
+    ('bridge', '桥', 'a photo of a bridge'),
+    ('temple', '寺庙', 'a photo of a temple'),
+    ('church', '教堂', 'a photo of a church'),
+    ('castle', '城堡', 'a photo of a castle'),
+    ('ancient_town', '古镇', 'a photo of an ancient chinese town'),
+    ('museum', '博物馆', 'a photo of a museum exhibition'),
+    ('amusement_park', '游乐园', 'a photo of an amusement park'),
+    ('tower', '塔', 'a photo of a tower'),
+    ('village', '乡村', 'a photo of a countryside village'),
+    # 交通
+    ('car', '汽车', 'a photo of a car'),
+    ('train', '火车', 'a photo of a train'),
+    ('airplane', '飞机', 'a photo of an airplane'),
+    ('airport', '机场', 'a photo of an airport'),
+    ('boat', '船', 'a photo of a boat'),
+    ('bicycle', '自行车', 'a photo of a bicycle'),
+    ('motorcycle', '摩托车', 'a photo of a motorcycle'),
+    ('road_trip', '自驾', 'a photo of a road trip'),
+    # 室内与物品
+    ('home', '居家', 'a photo of a living room at home'),
+    ('bedroom', '卧室', 'a photo of a bedroom'),
+    ('kitchen', '厨房', 'a photo of a kitchen'),
+    ('office', '办公室', 'a photo of an office'),
+    ('hotel', '酒店', 'a photo of a hotel room'),
+    ('book', '书籍', 'a photo of books'),
+    ('computer', '电脑', 'a photo of a computer'),
+    ('toy', '玩具', 'a photo of toys'),
+    ('clothes', '服饰', 'a photo of clothes'),
+    ('shoes', '鞋子', 'a photo of shoes'),
+    ('gift', '礼物', 'a photo of a gift'),
+    ('art', '艺术', 'a photo of a painting'),
+    ('musical_instrument', '乐器', 'a photo of a musical instrument'),
+    # 文档与截图
+    ('screenshot', '截图', 'a screenshot of a phone screen'),
+    ('document', '文档', 'a photo of a document with text'),
+    ('receipt', '票据', 'a photo of a receipt'),
+    ('whiteboard', '白板', 'a photo of a whiteboard'),
+    ('qr_code', '二维码', 'a photo of a qr code'),
+    ('map', '地图', 'a photo of a map'),
+    # 风格
+    ('black_and_white', '黑白', 'a black and white photo'),
+    ('night', '夜晚', 'a photo taken at night'),
+    ('macro', '微距', 'a macro photo'),
+    ('aerial', '航拍', 'an aerial photo taken by a drone'),
+    ('underwater', '水下', 'an underwater photo'),
+]
+
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+def load_tag_vocabulary():
+    """
+    加载标签词表
+    优先读取 settings.PHOTO_TAG_VOCABULARY_FILE 指定的 JSON 文件，否则使用内置词表
+    返回 [{'tag': ..., 'label': ..., 'prompt': ...}, ...]
+    """
+    path = getattr(settings, 'PHOTO_TAG_VOCABULARY_FILE', '')
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    else:
+        entries = [{'tag': tag, 'label': label, 'prompt': prompt} for tag, label, prompt in DEFAULT_TAG_VOCABULARY]
+
+    vocabulary = []
+    seen = set()
+    for entry in entries:
+        tag = str(entry['tag']).strip().lower()
+        if not tag or tag in seen:
+            continue
+        seen.add(tag)
+        vocabulary.append({
+            'tag': tag[:64],
+            'label': entry.get('label') or tag,
+            'prompt': entry.get('prompt') or f"a photo of {tag.replace('_', ' ')}",
+        })
+    return vocabulary
+
+def clip_prompt_matrix(prompts):
+    """提示词的 (提示词数, 512) L2 归一化文本向量矩阵，模型不可用时返回 None"""
+    embeddings = encode_texts(list(prompts))
+    if embeddings is None:
+        return None
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix
+
+def clip_softmax(embeddings, matrix):
+    """
+    一批图像向量在各提示词上的 softmax 概率 (一次矩阵乘法)
+    embeddings: (N, 512)，matrix: clip_prompt_matrix 的结果
+    返回 (N, 提示词数) float32
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+    logits = (embeddings @ matrix.T) * CLIP_LOGIT_SCALE
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    return probs
+
+class TagVocabulary:
+    """词表及其文本向量矩阵 (只在进程内编码一次)"""
+    def __init__(self, entries, top_k, min_score, model_name=CLIP_MODEL_NAME):
+        self.entries = entries
+        self.tags = [e['tag'] for e in entries]
+        self.labels = {e['tag']: e['label'] for e in entries}
+        self.top_k = max(1, min(top_k, len(entries)))
+        self.min_score = min_score
+        self.model_name = model_name
+        self._matrix = None
+
+        # 词表、提示词、模型或阈值变化都会导致打分结果变化，需要重新打标签
+        signature = json.dumps(
+            [model_name, self.top_k, min_score, [(e['tag'], e['prompt']) for e in entries]],
+            ensure_ascii=False,
+        )
+        self.version = hashlib.md5(signature.encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def matrix(self):
+        """(标签数, 512) 的 L2 归一化文本向量矩阵，模型不可用时返回 None"""
+        if self._matrix is None:
+            self._matrix = clip_prompt_matrix([e['prompt'] for e in self.entries])
+        return self._matrix
+
+    def score(self, embeddings):
+        """
+        对一批图像向量打分 (一次矩阵乘法)
+        embeddings: (N, 512) float32
+        返回每张照片的 [(tag, score), ...]，按置信度降序
+        """
+        matrix = self.matrix
+        if matrix is None or len(embeddings) == 0:
+            return [[] for _ in range(len(embeddings))]
+
+        probs = clip_softmax(embeddings, matrix)
+
+        k = self.top_k
+        if k < probs.shape[1]:
+            # argpartition 只做部分排序，比整行排序快得多
+            top = np.argpartition(-probs, kth=k - 1, axis=1)[:, :k]
+        else:
+            top = np.argsort(-probs, axis=1)
+        top_scores = np.take_along_axis(probs, top, axis=1)
+
+        results = []
+        for indices, scores in zip(top, top_scores):
+            order = np.argsort(-scores)
+            results.append([
+                (self.tags[indices[i]], float(scores[i]))
+                for i in order if scores[i] >= self.min_score
+            ])
+        return results
+
+def get_tag_vocabulary():
+    """获取进程级词表单例"""
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = TagVocabulary(
+                    load_tag_vocabulary(),
+                    top_k=getattr(settings, 'PHOTO_TAG_TOP_K', 5),
+                    min_score=getattr(settings, 'PHOTO_TAG_MIN_SCORE', 0.05),
+                )
+    return _vocabulary
+
+def tag_photos(photo_ids=None, rebuild=False, batch_size=DEFAULT_TAG_BATCH_SIZE, progress_callback=None):
+    """
+    为照片打零样本标签 (增量)
+    只处理有语义向量、且标签词表版本与当前不一致的照片：新照片或向量被更新过的照片
+    photo_ids: 只处理指定照片
+    rebuild: 忽略已有版本，全部重新打分
+    返回处理的照片数量，模型不可用时返回 None
+    """
+    vocabulary = get_tag_vocabulary()
+    if vocabulary.matrix is None:
+        return None
+
+    field = photo_vector_field()
+    pending = Photo.objects.filter(**{f'{field}__isnull': False})
+    if photo_ids is not None:
+        pending = pending.filter(id__in=photo_ids)
+    if not rebuild:
+        pending = pending.exclude(tag_version=vocabulary.version)
+
+    total = pending.count()
+    processed = 0
+    last_id = None
+    while processed < total:
+        # 按主键游标分页，避免大偏移量
+        batch_qs = pending.order_by('id')
+        if last_id is not None:
+            batch_qs = batch_qs.filter(id__gt=last_id)
+        rows = list(batch_qs.values_list('id', field)[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        ids = [r[0] for r in rows]
+        matrix = np.stack([vector_to_numpy(r[1]) for r in rows])
+        scored = vocabulary.score(matrix)
+
+        new_tags = [
+            PhotoTag(photo_id=photo_id, tag=tag, score=score)
+            for photo_id, tags in zip(ids, scored)
+            for tag, score in tags
+        ]
+        with transaction.atomic():
+            PhotoTag.objects.filter(photo_id__in=ids).delete()
+            PhotoTag.objects.bulk_create(new_tags, batch_size=5000)
+            Photo.objects.filter(id__in=ids).update(tag_version=vocabulary.version)
+
+        processed += len(rows)
+        if progress_callback:
+            progress_callback(processed, total)
+    return processed
+
+def photo_ids_for_tags(tags, min_score=None, limit=None):
+    """按标签查找照片 ID (按置信度降序，去重)，走 (tag, score) B-tree 索引"""
+    if isinstance(tags, str):
+        tags = [tags]
+    qs = PhotoTag.objects.filter(tag__in=tags, photo__deleted_at__isnull=True)
+    if min_score is not None:
+        qs = qs.filter(score__gte=min_score)
+    qs = qs.values('photo_id').annotate(best=Max('score')).order_by('-best')
+    if limit:
+        qs = qs[:limit]
+    return [row['photo_id'] for row in qs]
+
+def tag_summary():
+    """各标签的照片数量 (附中文名称)，按数量降序"""
+    labels = get_tag_vocabulary().labels
+    rows = PhotoTag.objects.filter(
+        photo__deleted_at__isnull=True
+    ).values('tag').annotate(count=Count('id')).order_by('-count')
+    return [
+        {'tag': row['tag'], 'label': labels.get(row['tag'], row['tag']), 'count': row['count']}
+        for row in rows
+    ]
@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发环境
+    fcntl = None
+
+# 向量维度 (CLIP ViT-B-32)
+EMBEDDING_DIM = 512
+# 查询时每块转换为 float32 的行数：16384 x 512 x 4B = 32MB
+SEARCH_BLOCK_ROWS = 16384
+# 增量段数量超过该值 (或增量行数超过全量的 20%) 时自动合并
+MAX_DELTA_SEGMENTS = 32
+MAX_DELTA_RATIO = 0.2
+
+MANIFEST_NAME = 'manifest.json'
+
+def get_index_dir():
+    return str(getattr(settings, 'EMBEDDING_INDEX_DIR', os.path.join(settings.BASE_DIR, 'data', 'vector_index')))
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+def _ids_to_array(ids):
+    """UUID 列表 -> (N,) V16 数组 (定长 16 字节，可直接 mmap)"""
+    return np.array([(i if isinstance(i, uuid.UUID) else uuid.UUID(str(i))).bytes for i in ids], dtype='V16')
+
+class _IndexLock:
+    """跨进程写锁 (基于 fcntl 文件锁；不支持的平台退化为进程内锁)"""
+    _local_lock = threading.Lock()
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(index_dir, '.lock')
+        self._file = None
+
+    def __enter__(self):
+        self._local_lock.acquire()
+        if fcntl:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._local_lock.release()
+
+def _read_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(index_dir, manifest):
+    """原子替换 manifest：读端要么看到旧版本，要么看到完整的新版本"""
+    tmp_path = os.path.join(index_dir, f'{MANIFEST_NAME}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(index_dir, MANIFEST_NAME))
+
+def _write_segment(index_dir, name, ids, vectors):
+    """写入一个段：float16 向量矩阵 + UUID 数组"""
+    np.save(os.path.join(index_dir, f'{name}.vectors.npy'), _normalize_rows(vectors).astype(np.float16))
+    np.save(os.path.join(index_dir, f'{name}.ids.npy'), _ids_to_array(ids))
+    return {'name': name, 'rows': len(ids)}
+
+def _remove_segments(index_dir, segments):
+    for seg in segments:
+        for suffix in ('vectors', 'ids'):
+            try:
+                os.remove(os.path.join(index_dir, f"{seg['name']}.{suffix}.npy"))
+            except OSError:
+                # Windows 下仍被其他进程 mmap 的文件无法删除，留待下次重建时清理
+                pass
+
+def build_snapshot(rows_iter, index_dir=None):
+    """
+    全量重建快照
+    rows_iter: 产生 (ids, vectors) 批次的迭代器
+    """
+    index_dir = index_dir or get_index_dir()
+    os.makedirs(index_dir, exist_ok=True)
+    with _IndexLock(index_dir):
+        old = _read_manifest(index_dir) or {'generation': 0, 'segments': []}
+        generation = old['generation'] + 1
+        name = f'base-{generation}'
+
+        all_ids, chunks = [], []
+        for ids, vectors in rows_iter:
+            if len(ids):
+                all_ids.extend(ids)
+                chunks.append(_normalize_rows(vectors).astype(np.float16))
+        vectors = np.concatenate(chunks) if chunks else np.zeros((0, EMBEDDING_DIM), dtype=np.float16)
+
+        np.save(os.path.join(index_dir, f'{name}.vectors.npy'), vectors)
+        np.save(os.path.join(index_dir, f'{name}.ids.npy'), _ids_to_array(all_ids))
+        _write_manifest(index_dir, {
+            'generation': generation,
+            'segments': [{'name': name, 'rows': len(all_ids)}],
+            'updated_at': time.time(),
+        })
+        _remove_segments(index_dir, old['segments'])
+    return len(all_ids)
+
+def append_embeddings(ids, vectors, index_dir=None):
+    """
+    增量追加：新写入的向量作为一个增量段，同一照片以最新段为准
+    快照不存在时不做任何事 (需先运行 build_search_index 建立全量快照)
+    """
+    if not len(ids):
+        return False
+    index_dir = index_dir or get_index_dir()
+    if not os.path.exists(os.path.join(index_dir, MANIFEST_NAME)):
+        return False
+
+    with _IndexLock(index_dir):
+        manifest = _read_manifest(index_dir)
+        if manifest is None:
+            return False
+        seq = manifest.get('next_seq', 1)
+        segment = _write_segment(index_dir, f"delta-{manifest['generation']}-{seq}", ids, vectors)
+        manifest['segments'].append(segment)
+        manifest['next_seq'] = seq + 1
+        manifest['updated_at'] = time.time()
+
+        deltas = manifest['segments'][1:]
+        base_rows = manifest['segments'][0]['rows']
+        if len(deltas) > MAX_DELTA_SEGMENTS or sum(s['rows'] for s in deltas) > max(1000, base_rows * MAX_DELTA_RATIO):
+            manifest = _compact(index_dir, manifest)
+        _write_manifest(index_dir, manifest)
+    return True
+
+def _compact(index_dir, manifest):
+    """把所有段合并为新的全量段 (同一 ID 以最新段为准)，调用方需持有写锁"""
+    snapshot = EmbeddingSnapshot(index_dir, manifest)
+    generation = manifest['generation'] + 1
+    name = f'base-{generation}'
+    vectors, ids = snapshot.materialize()
+    np.save(os.path.join(index_dir, f'{name}.vectors.npy'), vectors)
+    np.save(os.path.join(index_dir, f'{name}.ids.npy'), ids)
+    old_segments = manifest['segments']
+    snapshot.close()
+    _remove_segments(index_dir, old_segments)
+    return {
+        'generation': generation,
+        'segments': [{'name': name, 'rows': len(ids)}],
+        'updated_at': time.time(),
+    }
+
+class EmbeddingSnapshot:
+    """
+    只读的内存映射向量快照
+    所有段以 mmap 方式打开，多个工作进程共享同一份操作系统页缓存
+    """
+    def __init__(self, index_dir, manifest):
+        self.index_dir = index_dir
+        self.manifest = manifest
+        self.segments = []
+        for seg in manifest['segments']:
+            vectors = np.load(os.path.join(index_dir, f"{seg['name']}.vectors.npy"), mmap_mode='r')
+            ids = np.load(os.path.join(index_dir, f"{seg['name']}.ids.npy"))
+            self.segments.append([vectors, ids, None])
+        self._mask_superseded()
+
+    def _mask_superseded(self):
+        """后写入的段覆盖先前段中的同一照片：为旧段计算有效行掩码"""
+        if len(self.segments) < 2:
+            return
+        all_ids = np.concatenate([seg[1] for seg in self.segments])
+        total = len(all_ids)
+        # 倒序后 np.unique 返回的首次出现位置即为每个 ID 最后一次写入的位置
+        _, last_pos = np.unique(all_ids[::-1], return_index=True)
+        keep = np.zeros(total, dtype=bool)
+        keep[total - 1 - last_pos] = True
+        offset = 0
+        for seg in self.segments:
+            rows = len(seg[1])
+            mask = keep[offset:offset + rows]
+            seg[2] = None if mask.all() else mask
+            offset += rows
+
+    @property
+    def size(self):
+        return sum(int(seg[2].sum()) if seg[2] is not None else len(seg[1]) for seg in self.segments)
+
+    def materialize(self):
+        """合并所有段的有效行，返回 (float16 向量, V16 ID)"""
+        vectors, ids = [], []
+        for seg_vectors, seg_ids, mask in self.segments:
+            if mask is None:
+                vectors.append(np.asarray(seg_vectors))
+                ids.append(seg_ids)
+            else:
+                vectors.append(np.asarray(seg_vectors)[mask])
+                ids.append(seg_ids[mask])
+        if not vectors:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float16), np.zeros(0, dtype='V16')
+        return np.concatenate(vectors), np.concatenate(ids)
+
+    def search(self, query, k=100, max_distance=None):
+        """
+        暴力精确搜索 (余弦距离)
+        query: (512,) 单条或 (Q, 512) 多条查询向量
+        按块把 float16 转为 float32 后做一次 BLAS 矩阵乘法，并维护每条查询的 top-k
+        返回 [(uuid, distance), ...]；多条查询时返回列表的列表
+        """
+        single = np.asarray(query).ndim == 1
+        k = max(1, int(k))
+        queries = _normalize_rows(query)
+        n_queries = len(queries)
+        best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((n_queries, 0), dtype='V16')
+
+        for seg_vectors, seg_ids, mask in self.segments:
+            for start in range(0, len(seg_ids), SEARCH_BLOCK_ROWS):
+                block = np.asarray(seg_vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                block_ids = seg_ids[start:start + SEARCH_BLOCK_ROWS]
+                scores = queries @ block.T
+                if mask is not None:
+                    scores[:, ~mask[start:start + SEARCH_BLOCK_ROWS]] = -np.inf
+
+                # 当前块的候选与已有 top-k 合并后重新截取
+                if scores.shape[1] > k:
+                    top = np.argpartition(-scores, kth=k - 1, axis=1)[:, :k]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                    cand_ids = block_ids[top]
+                else:
+                    cand_ids = np.broadcast_to(block_ids, scores.shape)
+                merged_scores = np.concatenate([best_scores, scores], axis=1)
+                merged_ids = np.concatenate([best_ids, cand_ids], axis=1)
+                if merged_scores.shape[1] > k:
+                    top = np.argpartition(-merged_scores, kth=k - 1, axis=1)[:, :k]
+                    merged_scores = np.take_along_axis(merged_scores, top, axis=1)
+                    merged_ids = np.take_along_axis(merged_ids, top, axis=1)
+                best_scores, best_ids = merged_scores, merged_ids
+
+        results = []
+        for scores, ids in zip(best_scores, best_ids):
+            order = np.argsort(-scores)
+            hits = []
+            for i in order:
+                if not np.isfinite(scores[i]):
+                    continue
+                distance = 1.0 - float(scores[i])
+                if max_distance is not None and distance >= max_distance:
+                    continue
+                hits.append((uuid.UUID(bytes=bytes(ids[i])), distance))
+            results.append(hits)
+        return results[0] if single else results
+
+    def close(self):
+        # 释放 mmap 引用 (Windows 下被映射的文件无法删除)
+        self.segments = []
+
+_snapshot = None
+_snapshot_key = None
+_snapshot_lock = threading.Lock()
+
+def get_embedding_snapshot():
+    """
+    获取当前进程的快照 (manifest 更新后自动重新映射)
+    快照不存在时返回 None
+    """
+    global _snapshot, _snapshot_key
+    index_dir = get_index_dir()
+    try:
+        stat = os.stat(os.path.join(index_dir, MANIFEST_NAME))
+    except OSError:
+        return None
+    key = (index_dir, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _snapshot is not None and _snapshot_key == key:
+        return _snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot_key != key:
+            manifest = _read_manifest(index_dir)
+            if manifest is None:
+                return None
+            try:
+                _snapshot = EmbeddingSnapshot(index_dir, manifest)
+                _snapshot_key = key
+            except OSError as e:
+                # 读到 manifest 后段文件已被合并删除，下次查询时重试
+                print(f"加载向量快照失败: {e}")
+                return _snapshot
+    return _snapshot
+
+def use_mmap_backend():
+    return getattr(settings, 'SEARCH_BACKEND', 'pgvector') == 'mmap'
+
+def iter_database_embeddings(batch_size=5000):
+    """用服务端游标按主键顺序分批读取数据库中所有照片向量 (用于全量重建)，向量以二进制格式直接解码"""
+    from apps.photos.models import Photo
+    from apps.photos.services.embedding_loader import iter_embedding_batches
+    from apps.photos.utils import photo_vector_field
+    for ids, matrix, _ in iter_embedding_batches(Photo, photo_vector_field(), batch_size=batch_size, order_by_id=True):
+        yield ids, matrix
@@ -1,7 +1,16 @@
 import cv2
+import hashlib
 import os
+from pathlib import Path
 from PIL import Image
 import numpy as np
+from django.conf import settings
+
+# 相邻目标帧相隔超过该秒数时改为跳转，否则顺序 grab() 跳过中间帧
+# 跳转需要从前一个关键帧开始解码，长 GOP 的 H.264/HEVC 每次跳转的代价接近解码整个 GOP
+VIDEO_SEEK_MIN_GAP = 30.0
+# 缓存的视频封面帧 (CLIP 向量化用) 最长边
+VIDEO_POSTER_MAX_EDGE = 512
 
 def extract_video_metadata(video_path):
     """
@@ -53,10 +62,7 @@ def extract_video_frame(video_path, timestamp=None):
         duration = frame_count / fps if fps > 0 else 0
 
         if timestamp is None:
-            # 默认取 10% 处，或者如果视频很短，取中间
-            target_frame = int(frame_count * 0.1)
-            if duration < 5:
-                target_frame = int(frame_count * 0.5)
+            target_frame = default_frame_index(frame_count, duration)
         else:
             target_frame = int(timestamp * fps)
 
@@ -79,60 +85,175 @@ def extract_video_frame(video_path, timestamp=None):
         print(f"Error extracting video frame for {video_path}: {e}")
         return None
 
-def extract_video_frames_generator(video_path, interval=5.0, max_frames=20):
+def default_frame_index(frame_count, duration):
+    """默认代表帧：取 10% 处，或者如果视频很短，取中间"""
+    if duration < 5:
+        return int(frame_count * 0.5)
+    return int(frame_count * 0.1)
+
+def plan_sample_times(duration, interval, max_frames):
+    """按间隔规划采样时间点"""
+    # 很多视频开头是黑屏，我们从 1秒 或者 5% 处开始
+    current_time = min(1.0, duration * 0.05)
+    times = []
+    while current_time < duration and len(times) < max_frames:
+        times.append(current_time)
+        current_time += interval
+    return times
+
+def _resize_frame(frame, max_edge):
+    """在颜色转换之前缩小 BGR 帧，后续的转换与拷贝都在小图上进行"""
+    if not max_edge:
+        return frame
+    h, w = frame.shape[:2]
+    scale = max_edge / max(h, w)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+def sample_video_frames(cap, frame_indices, max_edge=None, seek_min_gap=None):
     """
-    生成器：从视频中按间隔提取帧
-    video_path: 视频路径
-    interval: 提取间隔（秒）
-    max_frames: 最大提取帧数限制，防止长视频处理时间过长
-    
-    Yields: (timestamp, PIL.Image)
+    单次遍历视频流，只解码出目标帧
+    相邻目标帧间隔较短时用 grab() 顺序前进 (只解封装和解码，不做颜色转换)，
+    间隔超过 seek_min_gap 帧时才向前跳转，读取位置只前进不后退
+    frame_indices: 目标帧序号 (会去重排序)
+    max_edge: 目标帧在颜色转换前缩小到的最长边
+    Yields: (帧序号, PIL.Image, 原始尺寸 (w, h))
+    """
+    position = 0
+    for target in sorted(set(frame_indices)):
+        if target < position:
+            continue
+        if seek_min_gap is not None and target - position > seek_min_gap:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            position = target
+        while position < target:
+            if not cap.grab():
+                return
+            position += 1
+        ret, frame = cap.read()
+        if not ret:
+            return
+        position += 1
+        original_size = (frame.shape[1], frame.shape[0])
+        frame = _resize_frame(frame, max_edge)
+        yield target, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), original_size
+
+def extract_video_samples(video_path, interval=5.0, max_frames=20, max_edge=None, with_poster=False):
+    """
+    一次遍历同时取出人脸检测用的间隔采样帧和 CLIP 向量化用的代表帧
+    返回 ([(timestamp, PIL.Image, 原始尺寸), ...], 代表帧 PIL.Image 或 None)
     """
     if not os.path.exists(video_path):
-        return
+        return [], None
 
     cap = None
     try:
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
-            return
+            return [], None
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        
-        if fps <= 0:
-            return
+        if fps <= 0 or frame_count <= 0:
+            return [], None
+        duration = frame_count / fps
+
+        targets = {}
+        for t in plan_sample_times(duration, interval, max_frames):
+            index = int(t * fps)
+            if index < frame_count:
+                targets.setdefault(index, t)
+        poster_index = None
+        if with_poster:
+            poster_index = max(0, min(default_frame_index(frame_count, duration), frame_count - 1))
 
-        # 始终提取第一帧 (或者 1秒处，避开纯黑开头)
-        # 很多视频开头是黑屏，我们从 1秒 或者 5% 处开始
-        start_time = min(1.0, duration * 0.05)
-        
-        current_time = start_time
-        frames_extracted = 0
-        
-        while current_time < duration and frames_extracted < max_frames:
-            target_frame = int(current_time * fps)
-            
-            # 边界检查
-            if target_frame >= frame_count:
-                break
-                
-            cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-            ret, frame = cap.read()
-            
-            if ret:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                yield current_time, Image.fromarray(frame_rgb)
-                frames_extracted += 1
-            else:
-                # 读取失败可能是文件损坏或结束
-                break
-                
-            current_time += interval
+        indices = list(targets)
+        if poster_index is not None:
+            indices.append(poster_index)
 
+        frames = []
+        poster = None
+        for index, img, original_size in sample_video_frames(
+            cap, indices, max_edge=max_edge, seek_min_gap=VIDEO_SEEK_MIN_GAP * fps
+        ):
+            if index == poster_index:
+                poster = img.copy()
+                poster.thumbnail((VIDEO_POSTER_MAX_EDGE, VIDEO_POSTER_MAX_EDGE), Image.Resampling.BILINEAR)
+            if index in targets:
+                frames.append((targets[index], img, original_size))
+        return frames, poster
     except Exception as e:
         print(f"Error iterating video frames for {video_path}: {e}")
+        return [], None
     finally:
         if cap:
             cap.release()
+
+def extract_video_frames_generator(video_path, interval=5.0, max_frames=20):
+    """
+    生成器：从视频中按间隔提取帧
+    video_path: 视频路径
+    interval: 提取间隔（秒）
+    max_frames: 最大提取帧数限制，防止长视频处理时间过长
+    
+    Yields: (timestamp, PIL.Image)
+    """
+    frames, _ = extract_video_samples(video_path, interval=interval, max_frames=max_frames)
+    for timestamp, img, _ in frames:
+        yield timestamp, img
+
+def _poster_cache_dir():
+    return Path(settings.MEDIA_ROOT) / 'cache' / 'video_posters'
+
+def _poster_cache_path(video_path):
+    """代表帧缓存路径，文件修改后自动失效"""
+    stat = os.stat(video_path)
+    key = hashlib.md5(f"{video_path}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8')).hexdigest()
+    return _poster_cache_dir() / f"{key}.jpg"
+
+def save_video_poster(video_path, image):
+    """缓存人脸扫描时顺带取出的代表帧，供之后的 CLIP 向量化使用，避免再次解码视频"""
+    try:
+        cache_file = _poster_cache_path(video_path)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        image.save(cache_file, format='JPEG', quality=90)
+    except Exception as e:
+        print(f"Error saving video poster for {video_path}: {e}")
+
+def load_video_poster(video_path):
+    """
+    读取视频的代表帧：优先使用人脸扫描留下的缓存 (读取后删除)，否则从视频中提取
+    返回: PIL Image 对象
+    """
+    try:
+        cache_file = _poster_cache_path(video_path)
+    except OSError:
+        return None
+    if cache_file.exists():
+        try:
+            with Image.open(cache_file) as img:
+                poster = img.convert('RGB')
+            cache_file.unlink(missing_ok=True)
+            return poster
+        except Exception as e:
+            print(f"Error reading video poster cache {cache_file}: {e}")
+    return extract_video_frame(video_path)
+
+def prune_video_posters(older_than):
+    """
+    删除早于 older_than (时间戳) 的代表帧缓存，返回删除的文件数
+    向量化完整跑完一遍后，此前留下的缓存要么已被读取删除，要么对应的视频已有向量或读取失败，不会再被使用
+    """
+    removed = 0
+    cache_dir = _poster_cache_dir()
+    if not cache_dir.is_dir():
+        return 0
+    for cache_file in cache_dir.glob('*.jpg'):
+        try:
+            if cache_file.stat().st_mtime < older_than:
+                cache_file.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
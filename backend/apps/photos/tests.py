@@ -1,8 +1,46 @@
+import importlib
+import io
+import os
+import struct
+import tempfile
+import time
 import uuid
-from django.test import TestCase
+from unittest import mock
+import cv2
+import numpy as np
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.apps import apps as django_apps
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
-from .models import Photo
+from .models import Album, Face, GeoTile, Person, PersonCentroid, Photo
+from .pagination import RankedCursorPagination
+from .services.centroids import (
+    backfill_missing_centroids, build_centroid, get_centers, load_person_centers, nearest_people, rebuild_person_centroid,
+)
+from .services.embedding_loader import decode_vectors
+from .services.face_clustering import cluster_embeddings
+from .services.faces import build_face_objects, face_scan_rows, load_face_images
+from .services.face_quality import face_quality, face_sharpness
+from .services.geo import (
+    build_pyramid, get_tile, grid_clusters, mark_tiles_stale, merge_cells, pack_tiles, refresh_stale_tiles,
+    tile_bounds, tile_for, tile_keys, unpack_tile,
+)
+from .services.people import PersonService
+from .services.face_gate import FaceGate
+from .services.dedup import compute_dhash, find_near_duplicate_groups, hamming_distance
+from .services.embeddings import TextEmbeddingCache, search_photos_by_text
+from .services.search import keyword_search_ids, keyword_search_queryset, reciprocal_rank_fusion
+from .services.tagging import TagVocabulary, clip_prompt_matrix, clip_softmax
+from .services.video import extract_video_frame, extract_video_samples, prune_video_posters
+from .services import vector_index
+from .utils import hnsw_search_session
 
 
 class PhotosViewsTests(TestCase):
@@ -42,3 +80,810 @@ class PhotosViewsTests(TestCase):
         )
         response = self.client.get(reverse('photo_video_serve', kwargs={'pk': photo.pk}))
         self.assertEqual(response.status_code, 404)
+
+
+class FakeTextModel:
+    """模拟 CLIP 文本编码器，记录每次实际编码的文本"""
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return np.array([[float(len(t))] * 4 for t in texts], dtype=np.float32)
+
+
+
+class KeywordSearchTests(TestCase):
+    def add_photo(self, path, location='', year=2024, **extra):
+        return Photo.objects.create(
+            file_path=path, hash_md5=uuid.uuid4().hex, location_name=location,
+            captured_at=datetime(year, 5, 1, tzinfo=dt_timezone.utc), **extra
+        )
+
+    def test_match_set_and_ranking(self):
+        exact_new = self.add_photo('/photos/a.jpg', 'Hangzhou', 2024)
+        exact_old = self.add_photo('/photos/b.jpg', 'West Lake, Hangzhou', 2023)
+        by_path = self.add_photo('/photos/hangzhou_trip/c.jpg', '', 2022)
+        partial = self.add_photo('/photos/d.jpg', 'Hangzhoubei Station', 2025)
+        self.add_photo('/photos/e.jpg', 'Hangzhou', 2024, deleted_at=datetime(2024, 6, 1, tzinfo=dt_timezone.utc))
+        self.add_photo('/photos/f.jpg', 'Shanghai', 2024)
+
+        # 整词命中 (相似度 1) 按拍摄时间降序，其后是部分命中；回收站与不相关的照片不返回
+        expected = [exact_new.id, exact_old.id, by_path.id, partial.id]
+        self.assertEqual(list(keyword_search_queryset('hangzhou').values_list('id', flat=True)), expected)
+        self.assertEqual(keyword_search_ids('  HANGZHOU '), expected)
+        self.assertEqual(keyword_search_ids(' '), [])
+        scores = dict(keyword_search_queryset('hangzhou').values_list('id', 'keyword_score'))
+        self.assertAlmostEqual(scores[exact_old.id], 1.0)
+        self.assertLess(scores[partial.id], 1.0)
+
+    def test_name_search_on_people_and_albums(self):
+        Person.objects.create(name='Grandma Li')
+        Person.objects.create(name='Uncle Wang')
+        Album.objects.create(name='Trip to Hangzhou')
+        Album.objects.create(name='Birthday')
+        people = self.client.get(reverse('person-list'), {'search': 'grandma'}).json()
+        albums = self.client.get(reverse('album-list'), {'search': 'hangzhou'}).json()
+        people, albums = [r.get('results', r) if isinstance(r, dict) else r for r in (people, albums)]
+        self.assertEqual([p['name'] for p in people], ['Grandma Li'])
+        self.assertEqual([a['name'] for a in albums], ['Trip to Hangzhou'])
+
+    def test_icontains_can_use_trigram_indexes(self):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            # 空表上规划器会改用 deleted_at 或排序索引，这里只检查关键词条件本身可以走三元组索引
+            photo_plan = Photo.objects.filter(
+                Q(location_name__icontains='hangzhou') | Q(file_path__icontains='hangzhou')
+            ).order_by().explain()
+            person_plan = Person.objects.filter(name__icontains='grandma').order_by().explain()
+            album_plan = Album.objects.filter(name__icontains='hangzhou').order_by().explain()
+        self.assertIn('photo_location_trgm_idx', photo_plan)
+        self.assertIn('photo_file_path_trgm_idx', photo_plan)
+        self.assertIn('person_name_trgm_idx', person_plan)
+        self.assertIn('album_name_trgm_idx', album_plan)
+
+class TextEmbeddingCacheTests(SimpleTestCase):
+    def test_repeated_queries_skip_encoder(self):
+        model = FakeTextModel()
+        cache = TextEmbeddingCache(max_size=10, persist=False)
+
+        first = cache.encode(['Beach  Sunset', 'cat'], model)
+        second = cache.encode(['beach sunset', 'cat', 'dog'], model)
+
+        self.assertEqual(model.calls, [['beach sunset', 'cat'], ['dog']])
+        np.testing.assert_array_equal(first[0], second[0])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_lru_eviction(self):
+        model = FakeTextModel()
+        cache = TextEmbeddingCache(max_size=2, persist=False)
+        cache.encode(['a'], model)
+        cache.encode(['b'], model)
+        cache.encode(['a'], model)
+        cache.encode(['c'], model)  # 淘汰最久未使用的 b
+        cache.encode(['b'], model)
+
+        self.assertEqual(model.calls, [['a'], ['b'], ['c'], ['b']])
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class HybridSearchTests(SimpleTestCase):
+    def test_rrf_prefers_items_ranked_by_both_sources(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'd', 'a']], k=60)
+        ids = [item_id for item_id, _ in fused]
+        self.assertEqual(ids[:2], ['a', 'c'])
+        self.assertEqual(set(ids), {'a', 'b', 'c', 'd'})
+        self.assertAlmostEqual(fused[0][1], 1 / 61 + 1 / 63)
+
+    def test_cursor_pagination_walks_ranking(self):
+        factory = APIRequestFactory()
+        ranking = [(str(i), 1.0 / (i + 1)) for i in range(5)]
+
+        paginator = RankedCursorPagination(Request(factory.get('/api/photos/hybrid_search/', {'q': 'x', 'page_size': 2})))
+        page, has_next = paginator.paginate_list(ranking)
+        data = paginator.get_response_data(page, has_next)
+        self.assertEqual([pid for pid, _ in page], ['0', '1'])
+        self.assertIsNone(data['previous'])
+
+        next_request = Request(factory.get(data['next'].replace('http://testserver', '')))
+        paginator = RankedCursorPagination(next_request)
+        page, has_next = paginator.paginate_list(ranking)
+        self.assertEqual([pid for pid, _ in page], ['2', '3'])
+        self.assertTrue(has_next)
+        self.assertIsNotNone(paginator.get_response_data(page, has_next)['previous'])
+
+
+class NearDuplicateTests(SimpleTestCase):
+    def test_resized_copy_has_close_hash(self):
+        from PIL import Image
+        gradient = np.tile(np.linspace(0, 255, 640, dtype=np.uint8), (480, 1))
+        noise = np.random.default_rng(0).integers(0, 60, (480, 640), dtype=np.uint8)
+        original = Image.fromarray(gradient ^ noise).convert('RGB')
+        resized = original.resize((160, 120))
+        self.assertLessEqual(hamming_distance(compute_dhash(original), compute_dhash(resized)), 6)
+
+    def test_groups_by_hamming_radius(self):
+        ids = ['a', 'b', 'c', 'd', 'e']
+        # a/b 相差 2 位，a/c 相差 3 位，b/c 相差 5 位 (超出半径，经 a 传递合并)，d 与 a 相同，e 相距很远
+        hashes = [0b0, 0b11, 0b11100, 0b0, -1]
+        groups = find_near_duplicate_groups(ids, hashes, radius=3)
+        self.assertEqual(len(groups), 1)
+        members, max_distance = groups[0]
+        self.assertEqual(sorted(members), ['a', 'b', 'c', 'd'])
+        # 最大距离取组内任意两张之间 (b/c)，而非合并链上的配对距离
+        self.assertEqual(max_distance, 5)
+        self.assertEqual(find_near_duplicate_groups(ids, hashes, radius=1)[0][0], ['a', 'd'])
+
+
+class TagVocabularyTests(SimpleTestCase):
+    def make_vocabulary(self, top_k=2, min_score=0.05):
+        entries = [{'tag': t, 'label': t, 'prompt': f'a photo of {t}'} for t in ('food', 'beach', 'cat')]
+        vocabulary = TagVocabulary(entries, top_k=top_k, min_score=min_score)
+        vocabulary._matrix = np.eye(3, 512, dtype=np.float32)
+        return vocabulary
+
+    def test_scores_batch_and_keeps_top_k(self):
+        vocabulary = self.make_vocabulary()
+        embeddings = np.zeros((2, 512), dtype=np.float32)
+        embeddings[0, 0] = 1.0
+        embeddings[1, 1], embeddings[1, 2] = 0.8, 0.79
+        scored = vocabulary.score(embeddings)
+        self.assertEqual([tag for tag, _ in scored[0]], ['food'])
+        self.assertEqual([tag for tag, _ in scored[1]], ['beach', 'cat'])
+        self.assertGreater(scored[1][0][1], scored[1][1][1])
+
+    def test_version_changes_with_vocabulary(self):
+        self.assertEqual(self.make_vocabulary().version, self.make_vocabulary().version)
+        self.assertNotEqual(self.make_vocabulary().version, self.make_vocabulary(top_k=3).version)
+
+    def test_clip_helpers(self):
+        with mock.patch('apps.photos.services.tagging.encode_texts', return_value=np.eye(2, 512) * 4):
+            matrix = clip_prompt_matrix(['a', 'b'])
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, rtol=1e-6)
+        with mock.patch('apps.photos.services.tagging.encode_texts', return_value=None):
+            self.assertIsNone(clip_prompt_matrix(['a']))
+        probs = clip_softmax(np.eye(2, 512) * 2, matrix)
+        np.testing.assert_allclose(probs.sum(axis=1), 1.0, rtol=1e-6)
+        self.assertEqual(list(probs.argmax(axis=1)), [0, 1])
+
+
+class EmbeddingSnapshotTests(SimpleTestCase):
+    def test_search_and_incremental_update(self):
+        rng = np.random.default_rng(1)
+        ids = [uuid.uuid4() for _ in range(300)]
+        vectors = rng.standard_normal((300, 512)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as index_dir:
+            vector_index.build_snapshot(iter([(ids, vectors)]), index_dir)
+            snapshot = vector_index.EmbeddingSnapshot(index_dir, vector_index._read_manifest(index_dir))
+            hits = snapshot.search(vectors[7], k=5)
+            self.assertEqual(hits[0][0], ids[7])
+            self.assertAlmostEqual(hits[0][1], 0.0, places=2)
+
+            # 增量段中的新向量覆盖全量段中的旧向量
+            replacement = rng.standard_normal(512).astype(np.float32)
+            vector_index.append_embeddings([ids[7]], [replacement], index_dir)
+            snapshot = vector_index.EmbeddingSnapshot(index_dir, vector_index._read_manifest(index_dir))
+            self.assertEqual(snapshot.size, 300)
+            self.assertNotIn(ids[7], [pid for pid, _ in snapshot.search(vectors[7], k=5)])
+            self.assertEqual(snapshot.search(replacement, k=1)[0][0], ids[7])
+            snapshot.close()
+
+
+
+class SnapshotSearchTests(TestCase):
+    def test_trashed_photos_are_skipped_and_results_refilled(self):
+        rng = np.random.default_rng(4)
+        query = rng.standard_normal(512).astype(np.float32)
+        query /= np.linalg.norm(query)
+        photos, vectors = [], []
+        for i in range(12):
+            # 越靠前的照片越接近查询，前 6 张在回收站中
+            vector = query + (0.005 + 0.002 * i) * rng.standard_normal(512).astype(np.float32)
+            photos.append(Photo.objects.create(
+                file_path=f'/search/{i}.jpg', hash_md5=uuid.uuid4().hex,
+                deleted_at=datetime(2024, 1, 1, tzinfo=dt_timezone.utc) if i < 6 else None,
+            ))
+            vectors.append(vector)
+        with tempfile.TemporaryDirectory() as index_dir:
+            vector_index.build_snapshot(iter([([p.id for p in photos], np.stack(vectors))]), index_dir)
+            snapshot = vector_index.EmbeddingSnapshot(index_dir, vector_index._read_manifest(index_dir))
+            with mock.patch('apps.photos.services.embeddings.encode_text', return_value=query), \
+                    mock.patch('apps.photos.services.embeddings.use_mmap_backend', return_value=True), \
+                    mock.patch('apps.photos.services.embeddings.get_embedding_snapshot', return_value=snapshot):
+                results = search_photos_by_text('query', limit=3)
+            snapshot.close()
+        self.assertEqual([p.id for p in results], [p.id for p in photos[6:9]])
+
+
+class SimilarPhotosTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        base = rng.standard_normal(512).astype(np.float32)
+        shanghai = dt_timezone(timedelta(hours=8))
+
+        def add(name, day, noise, **extra):
+            photo = Photo.objects.create(
+                file_path=f'/similar/{name}.jpg', hash_md5=uuid.uuid4().hex,
+                captured_at=datetime(2024, 3, day, 10, tzinfo=shanghai), **extra
+            )
+            photo.set_embedding(base + noise * rng.standard_normal(512).astype(np.float32))
+            photo.save()
+            return photo
+
+        self.source = add('source', 10, 0.0)
+        self.same_day = add('same_day', 10, 0.01)
+        self.earlier = add('earlier', 1, 0.02)
+        self.later = add('later', 20, 0.03)
+        self.trashed = add('trashed', 15, 0.005, deleted_at=datetime(2024, 4, 1, tzinfo=dt_timezone.utc))
+        # 没有语义向量的照片不参与
+        Photo.objects.create(file_path='/similar/none.jpg', hash_md5=uuid.uuid4().hex)
+
+    def similar(self, **params):
+        response = self.client.get(reverse('photo-similar', args=[self.source.id]), params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_filters(self):
+        ids = lambda *photos: [str(p.id) for p in photos]
+        self.assertEqual(self.similar(), ids(self.same_day, self.earlier, self.later))
+        self.assertEqual(
+            self.similar(exclude_trashed='false'), ids(self.trashed, self.same_day, self.earlier, self.later)
+        )
+        self.assertEqual(self.similar(exclude_same_day='true'), ids(self.earlier, self.later))
+        self.assertEqual(self.similar(date_from='2024-03-05'), ids(self.same_day, self.later))
+        self.assertEqual(self.similar(date_to='2024-03-10', exclude_same_day='true'), ids(self.earlier))
+        self.assertEqual(
+            self.similar(date_from='2024-03-11', exclude_trashed='0'), ids(self.trashed, self.later)
+        )
+        response = self.client.get(reverse('photo-similar', args=[self.source.id]), {'date_from': '2024-13-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_hnsw_session_clamps_ef_search(self):
+        def show(name):
+            with connection.cursor() as cursor:
+                cursor.execute(f'SHOW {name}')
+                return cursor.fetchone()[0]
+
+        for requested, expected in [(5, '40'), (200, '200'), (5000, '1000')]:
+            with hnsw_search_session(ef_search=requested):
+                self.assertEqual(show('hnsw.ef_search'), expected)
+                self.assertEqual(show('hnsw.iterative_scan'), 'strict_order')
+
+class FacePersistenceTests(SimpleTestCase):
+    def test_build_face_objects_clamps_bbox(self):
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+        detections = [
+            {'bbox': [-5, 10, 50, 40], 'score': 0.9, 'embedding': np.ones(512, dtype=np.float32)},
+            {'bbox': [180, 90, 50, 50], 'score': 0.7},
+        ]
+        photo_id = uuid.uuid4()
+        faces = build_face_objects(photo_id, image, detections, timestamp=3.0)
+        self.assertEqual([f.bbox for f in faces], [[0, 10, 50, 50], [180, 90, 200, 100]])
+        self.assertTrue(all(f.photo_id == photo_id and f.timestamp == 3.0 for f in faces))
+        self.assertEqual(len(faces[0].embedding), 512)
+        self.assertIsNone(faces[1].embedding)
+
+    def test_build_face_objects_maps_bbox_to_original_size(self):
+        # 在 1/4 尺寸的图像上检测，边界框映射回原图坐标
+        image = np.zeros((300, 400, 3), dtype=np.uint8)
+        detections = [{'bbox': [100, 50, 40, 60], 'score': 0.9}, {'bbox': [380, 280, 40, 40], 'score': 0.8}]
+        faces = build_face_objects(uuid.uuid4(), image, detections, original_size=(1600, 1200))
+        self.assertEqual(faces[0].bbox, [400, 200, 560, 440])
+        self.assertEqual(faces[1].bbox, [1520, 1120, 1600, 1200])
+
+
+class VideoSamplerTests(SimpleTestCase):
+    def test_single_pass_samples_and_poster(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/clip.avi"
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (320, 240))
+            for i in range(300):
+                writer.write(np.full((240, 320, 3), i % 256, dtype=np.uint8))
+            writer.release()
+
+            frames, poster = extract_video_samples(path, interval=3.0, max_frames=5, max_edge=160, with_poster=True)
+            self.assertEqual([t for t, _, _ in frames], [1.0, 4.0, 7.0, 10.0, 13.0])
+            self.assertTrue(all(img.size == (160, 120) and size == (320, 240) for _, img, size in frames))
+            # 顺序读取取到的帧与逐帧跳转取到的帧一致
+            for timestamp, img, _ in frames:
+                expected = extract_video_frame(path, timestamp=timestamp).resize((160, 120))
+                self.assertLessEqual(abs(int(np.array(img)[0, 0, 0]) - int(np.array(expected)[0, 0, 0])), 2)
+            self.assertEqual(np.array(poster)[0, 0, 0], np.array(extract_video_frame(path))[0, 0, 0])
+
+
+class VideoPosterCacheTests(TestCase):
+    def test_poster_cached_only_for_videos_without_embedding(self):
+        pending = Photo.objects.create(file_path='/videos/a.mp4', hash_md5='1' * 32, video_path='/videos/a.mp4')
+        embedded = Photo.objects.create(file_path='/videos/b.mp4', hash_md5='2' * 32, video_path='/videos/b.mp4')
+        embedded.set_embedding(np.ones(512, dtype=np.float32))
+        embedded.save()
+        live = Photo.objects.create(file_path='/photos/c.jpg', hash_md5='3' * 32, video_path='/photos/c.mov', is_live_photo=True)
+
+        rows = {row[0]: row for row in face_scan_rows([pending.id, embedded.id, live.id])}
+        self.assertEqual(rows[pending.id][2:], (True, True, True))
+        self.assertEqual(rows[embedded.id][2:], (True, True, False))
+        self.assertEqual(rows[live.id][2:], (False, True, False))
+
+        # 分批查询结果与一次查询相同
+        with CaptureQueriesContext(connection) as queries:
+            chunked = face_scan_rows([pending.id, embedded.id, live.id], chunk_size=2)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual({row[0]: row for row in chunked}, rows)
+
+    def test_scan_without_cache_flag_leaves_no_poster(self):
+        with tempfile.TemporaryDirectory() as tmp, self.settings(MEDIA_ROOT=tmp):
+            path = f"{tmp}/clip.avi"
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (160, 120))
+            for i in range(50):
+                writer.write(np.full((120, 160, 3), i, dtype=np.uint8))
+            writer.release()
+            poster_dir = f"{tmp}/cache/video_posters"
+
+            load_face_images(path, is_pure_video=True, is_video=True, max_edge=160)
+            self.assertFalse(os.path.exists(poster_dir))
+
+            load_face_images(path, is_pure_video=True, is_video=True, max_edge=160, cache_poster=True)
+            self.assertEqual(len(os.listdir(poster_dir)), 1)
+            # 向量化跑完后清理此前留下的缓存
+            self.assertEqual(prune_video_posters(time.time() + 1), 1)
+            self.assertEqual(os.listdir(poster_dir), [])
+
+
+class FaceGateTests(SimpleTestCase):
+    def test_person_probability(self):
+        gate = FaceGate(person_prompts=['person', 'face'], other_prompts=['document', 'landscape'])
+        gate._matrix = np.eye(4, 512, dtype=np.float32)
+        scores = gate.score(np.eye(4, 512, dtype=np.float32) * 3)
+        self.assertTrue(scores[0] > 0.99 and scores[1] > 0.99)
+        self.assertTrue(scores[2] < 0.01 and scores[3] < 0.01)
+        self.assertEqual(len(gate.score(np.zeros((0, 512), dtype=np.float32))), 0)
+
+
+class PersonCentroidTests(SimpleTestCase):
+    def test_build_centroid(self):
+        rng = np.random.default_rng(2)
+        base = rng.standard_normal(512).astype(np.float32)
+        embeddings = base + 0.1 * rng.standard_normal((45, 512)).astype(np.float32)
+        centroid = build_centroid(uuid.uuid4(), embeddings)
+        self.assertEqual(centroid.face_count, 45)
+        self.assertAlmostEqual(float(np.linalg.norm(centroid.centroid)), 1.0, places=4)
+        centers = get_centers(centroid)
+        # 45 张人脸 -> 2 个中心，各中心人脸数之和等于总数
+        self.assertEqual(centers.shape, (2, 512))
+        self.assertEqual(sum(centroid.center_counts), 45)
+        self.assertGreater(float(np.dot(centroid.centroid, base / np.linalg.norm(base))), 0.9)
+
+    def test_small_person_uses_mean(self):
+        centroid = build_centroid(uuid.uuid4(), np.eye(3, 512, dtype=np.float32))
+        self.assertEqual(get_centers(centroid).shape, (1, 512))
+        self.assertEqual(centroid.center_counts, [3])
+
+
+
+class CentroidFreshnessTests(TestCase):
+    def add_person(self, name, vector):
+        person = Person.objects.create(name=name)
+        photo = Photo.objects.create(file_path=f'/people/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex)
+        face = Face(photo=photo, person=person, bbox=[0, 0, 10, 10], prob=0.9)
+        face.set_embedding(vector)
+        face.save()
+        return person
+
+    def test_read_paths_refresh_only_stale_centroids(self):
+        rng = np.random.default_rng(5)
+        first = self.add_person('甲', rng.standard_normal(512).astype(np.float32))
+        second_vector = rng.standard_normal(512).astype(np.float32)
+        second = self.add_person('乙', second_vector)
+        rebuild_person_centroid(first.id)
+        stale = rebuild_person_centroid(second.id)
+        PersonCentroid.objects.filter(person_id=second.id).update(is_stale=True)
+
+        neighbors = nearest_people(second_vector, k=5)
+        self.assertEqual(neighbors[0][0], second.id)
+        self.assertAlmostEqual(neighbors[0][1], 0.0, places=4)
+        refreshed = PersonCentroid.objects.get(person_id=second.id)
+        self.assertFalse(refreshed.is_stale)
+        self.assertEqual(refreshed.version, stale.version + 1)
+
+        # 缺少中心的人物不在读取路径上补建，由 rebuild_person_centroids 命令补建
+        missing = self.add_person('丙', rng.standard_normal(512).astype(np.float32))
+        owners, _ = load_person_centers()
+        self.assertNotIn(missing.id, owners)
+        self.assertEqual(backfill_missing_centroids(), 1)
+        owners, _ = load_person_centers()
+        self.assertIn(missing.id, owners)
+        self.assertEqual(backfill_missing_centroids(), 0)
+
+class FaceMatchingTests(SimpleTestCase):
+    def test_match_faces_to_people_in_chunks(self):
+        owners = ['a', 'a', 'b']
+        centers = np.eye(3, 512, dtype=np.float32)
+        faces = np.eye(4, 512, dtype=np.float32)
+        with mock.patch('apps.photos.services.people.load_person_centers', return_value=(owners, centers)):
+            matched = PersonService.match_faces_to_people(faces, threshold=0.3, chunk_size=3)
+        self.assertEqual(matched, ['a', 'a', 'b', None])
+
+
+class EmbeddingLoaderTests(SimpleTestCase):
+    def test_decode_vector_send_format(self):
+        vectors = np.random.default_rng(0).standard_normal((3, 512)).astype(np.float32)
+        # vector_send: 2 字节维度 + 2 字节保留 + 大端 float32
+        buffers = [memoryview(struct.pack('>HH', 512, 0) + v.astype('>f4').tobytes()) for v in vectors]
+        decoded = decode_vectors(buffers)
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertTrue(decoded.flags.c_contiguous)
+        np.testing.assert_array_equal(decoded, vectors)
+        self.assertEqual(decode_vectors([]).shape, (0, 512))
+
+    def test_decode_halfvec_send_format(self):
+        vectors = np.random.default_rng(1).standard_normal((2, 512)).astype(np.float16)
+        buffers = [struct.pack('>HH', 512, 0) + v.astype('>f2').tobytes() for v in vectors]
+        np.testing.assert_array_equal(decode_vectors(buffers, half=True), vectors.astype(np.float32))
+
+
+class EmbeddingStorageTests(SimpleTestCase):
+    def test_set_embedding_follows_storage_mode(self):
+        vector = np.linspace(-1, 1, 512, dtype=np.float32)
+        for mode, full, half in [('vector', True, False), ('dual', True, True), ('halfvec', False, True)]:
+            with self.settings(EMBEDDING_STORAGE=mode):
+                photo = Photo()
+                photo.set_embedding(vector)
+                self.assertEqual(photo.embedding_data is not None, full)
+                self.assertEqual(photo.embedding_data_half is not None, half)
+                self.assertEqual(len(Photo.embedding_fields()), int(full) + int(half))
+                np.testing.assert_allclose(photo.get_embedding(), vector)
+
+
+class FaceQualityTests(SimpleTestCase):
+    def test_blurred_and_small_faces_score_lower(self):
+        image = np.zeros((400, 400, 3), dtype=np.uint8)
+        # 左半边为清晰的棋盘格，右半边为平滑渐变 (模拟虚焦)
+        yy, xx = np.mgrid[0:400, 0:200]
+        image[:, :200] = (((yy // 4 + xx // 4) % 2) * 255)[..., None]
+        image[:, 200:] = np.linspace(0, 255, 200, dtype=np.uint8)[None, :, None]
+
+        sharp_box, blurred_box = [20, 20, 180, 180], [220, 20, 380, 180]
+        sharp, blurred = face_sharpness(image, sharp_box), face_sharpness(image, blurred_box)
+        self.assertGreater(sharp, blurred)
+        self.assertGreater(
+            face_quality(0.9, sharp_box, image.shape, sharp),
+            face_quality(0.9, blurred_box, image.shape, blurred),
+        )
+        # 尺寸达到 FULL_SIZE_RATIO 后不再加分，更小的人脸按比例降分
+        self.assertEqual(face_quality(0.9, [0, 0, 40, 40], image.shape, sharp), 0.9)
+        self.assertAlmostEqual(face_quality(0.9, [0, 0, 10, 10], image.shape, sharp), 0.45)
+
+
+class GeoTileTests(SimpleTestCase):
+    def test_tile_for_matches_bounds(self):
+        for lat, lng in [(39.9, 116.4), (-33.9, 151.2), (0.0, 0.0), (89.0, -179.9)]:
+            for z in (0, 3, 10, 16):
+                x, y = tile_for(lat, lng, z)
+                south, north, west, east = tile_bounds(z, x, y)
+                self.assertTrue(south <= lat <= north and west <= lng <= east)
+        self.assertEqual(tile_for(39.9, 116.4, 0), (0, 0))
+        self.assertEqual(len(tile_keys([(39.9, 116.4), (None, None)], max_zoom=4)), 5)
+
+    def test_merge_cells_sums_counts_and_keeps_newest_cover(self):
+        # [封面 ID, 封面时间戳, 照片数, 纬度和, 经度和]
+        cells = {
+            (4, 6): ['b', 200.0, 2, 20.0, 40.0],
+            (5, 7): ['a', None, 1, 12.0, 22.0],
+            (6, 6): ['c', 100.0, 3, 33.0, 63.0],
+        }
+        parents = merge_cells(cells)
+        self.assertEqual(parents, {(2, 3): ['b', 200.0, 3, 32.0, 62.0], (3, 3): ['c', 100.0, 3, 33.0, 63.0]})
+        # 原网格不被修改
+        self.assertEqual(cells[(4, 6)][2], 2)
+
+        tiles = pack_tiles(parents, cells_per_tile=2)
+        self.assertEqual(tiles, {(1, 1): [[0, 1, 'b', 10.666667, 20.666667, 3, 200.0], [1, 1, 'c', 11.0, 21.0, 3, 100.0]]})
+        restored = unpack_tile(1, 1, tiles[(1, 1)], cells_per_tile=2)
+        self.assertEqual(set(restored), set(parents))
+        self.assertAlmostEqual(restored[(2, 3)][3], 32.0, places=4)
+
+
+
+class GridClusterTests(TestCase):
+    def add_photo(self, lat, lng, day, **extra):
+        return Photo.objects.create(
+            file_path=f'/geo/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex, latitude=lat, longitude=lng,
+            captured_at=datetime(2024, 1, day, tzinfo=dt_timezone.utc), **extra
+        )
+
+    def test_cells_count_average_and_newest_cover(self):
+        self.add_photo(10.2, 20.2, 1)
+        newest = self.add_photo(10.4, 20.6, 5)
+        self.add_photo(10.9, 20.1, 3)
+        self.add_photo(10.5, 20.5, 9, deleted_at=datetime(2024, 2, 1, tzinfo=dt_timezone.utc))
+        alone = self.add_photo(12.5, 22.5, 2)
+        # 范围外的照片
+        self.add_photo(40.0, 100.0, 1)
+
+        clusters = grid_clusters(0, 30, 0, 30, grid_size=1.0)
+        by_cover = {row[0]: row for row in clusters}
+        self.assertEqual(set(by_cover), {newest.id, alone.id})
+
+        _, captured_at, count, lat, lng = by_cover[newest.id]
+        self.assertEqual(count, 3)
+        self.assertEqual(captured_at, newest.captured_at)
+        self.assertAlmostEqual(lat, 10.5, places=6)
+        self.assertAlmostEqual(lng, 20.3, places=6)
+        self.assertEqual(by_cover[alone.id][2], 1)
+
+@override_settings(GEO_TILE_MAX_ZOOM=6, GEO_TILE_CELLS=2)
+class GeoTilePyramidTests(TestCase):
+    def add_photo(self, lat, lng, day, **extra):
+        return Photo.objects.create(
+            file_path=f'/geo/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex, latitude=lat, longitude=lng,
+            captured_at=datetime(2024, 1, day, tzinfo=dt_timezone.utc), **extra
+        )
+
+    def snapshot(self):
+        return {(t.z, t.x, t.y): (t.photo_count, t.cells) for t in GeoTile.objects.all()}
+
+    def test_incremental_updates_match_full_rebuild(self):
+        self.add_photo(39.90, 116.40, 1)
+        self.add_photo(39.91, 116.41, 2)
+        self.add_photo(31.23, 121.47, 3)
+        build_pyramid()
+        self.assertEqual(GeoTile.objects.get(z=0).photo_count, 3)
+
+        # 新照片 (包括此前没有照片的区域) 与软删除：只标记并自底向上重算
+        new_photo = self.add_photo(-33.87, 151.21, 4)
+        trashed = Photo.objects.get(latitude=39.90)
+        mark_tiles_stale([(new_photo.latitude, new_photo.longitude), (trashed.latitude, trashed.longitude)])
+        trashed.deleted_at = datetime(2024, 2, 1, tzinfo=dt_timezone.utc)
+        trashed.save()
+        refresh_stale_tiles()
+        self.assertFalse(GeoTile.objects.filter(is_stale=True).exists())
+        incremental = self.snapshot()
+
+        build_pyramid()
+        self.assertEqual(incremental, self.snapshot())
+        root = GeoTile.objects.get(z=0)
+        self.assertEqual(root.photo_count, 3)
+
+    def test_migration_builds_pyramid_for_existing_library(self):
+        migration = importlib.import_module('apps.photos.migrations.0035_build_geotile_pyramid')
+        migration.build_geotile_pyramid(django_apps, None)
+        self.assertFalse(GeoTile.objects.exists())
+
+        self.add_photo(39.90, 116.40, 1)
+        migration.build_geotile_pyramid(django_apps, None)
+        self.assertEqual(GeoTile.objects.get(z=0).photo_count, 1)
+        self.assertEqual(GeoTile.objects.count(), 7)
+
+    def test_low_zoom_rebuild_does_not_query_photos(self):
+        self.add_photo(39.90, 116.40, 1)
+        build_pyramid()
+        GeoTile.objects.filter(z__lt=6).update(is_stale=True)
+        with CaptureQueriesContext(connection) as queries:
+            tile = get_tile(0, 0, 0)
+        self.assertEqual(tile.photo_count, 1)
+        self.assertFalse([q for q in queries if 'photos_photo' in q['sql']])
+
+    def test_empty_tiles_are_not_saved(self):
+        self.add_photo(39.90, 116.40, 1)
+        build_pyramid()
+        count = GeoTile.objects.count()
+        x, y = tile_for(0.0, -150.0, 6)
+        response = self.client.get(reverse('map_tile', args=[6, x, y]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cells'], [])
+        self.assertEqual(GeoTile.objects.count(), count)
+
+        response = self.client.get(reverse('map_tile', args=[7, 0, 0]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['max_zoom'], 6)
+
+    def test_tile_response_supports_etag(self):
+        photo = self.add_photo(39.90, 116.40, 1)
+        build_pyramid()
+        response = self.client.get(reverse('map_tile', args=[0, 0, 0]))
+        self.assertEqual(response.json()['cells'][0]['id'], str(photo.id))
+        self.assertIn('max-age=', response['Cache-Control'])
+        cached = self.client.get(reverse('map_tile', args=[0, 0, 0]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+
+class MergePlanTests(SimpleTestCase):
+    def test_plan_merges_follows_chains(self):
+        plan = PersonService.plan_merges([('a', 'b'), ('b', 'c'), ('d', 'a'), ('c', 'a'), ('e', 'f')])
+        self.assertEqual({k: sorted(v) for k, v in plan.items()}, {'c': ['a', 'b', 'd'], 'f': ['e']})
+
+
+
+
+
+
+class CreatePeopleTests(TestCase):
+    def test_faces_labeled_meanwhile_keep_their_person(self):
+        manual = Person.objects.create(name='小明')
+        photos = [Photo.objects.create(file_path=f'/people/{i}.jpg', hash_md5=uuid.uuid4().hex) for i in range(4)]
+        faces = [Face.objects.create(photo=p, bbox=[0, 0, 10, 10], prob=0.9) for p in photos]
+        embeddings = np.eye(4, 512, dtype=np.float32)
+        # 加载之后被手动标记的人脸
+        Face.objects.filter(id__in=[faces[1].id, faces[3].id]).update(person=manual)
+
+        labeled = PersonService.create_people_for_groups(
+            [f.id for f in faces], [p.id for p in photos], embeddings, [[0, 1, 2], [3]]
+        )
+        self.assertEqual(labeled, 2)
+        self.assertEqual(set(Face.objects.filter(person=manual).values_list('id', flat=True)), {faces[1].id, faces[3].id})
+        created = Person.objects.exclude(id=manual.id).get()
+        self.assertEqual(set(created.faces.values_list('id', flat=True)), {faces[0].id, faces[2].id})
+        self.assertEqual(set(created.photos.values_list('id', flat=True)), {photos[0].id, photos[2].id})
+        self.assertEqual(created.photo_count, 2)
+        self.assertEqual(created.representative_face_id, faces[0].id)
+        self.assertEqual(PersonCentroid.objects.get(person=created).face_count, 2)
+
+class PersonPhotoSyncTests(TestCase):
+    def make_drift(self):
+        """每个人物一条缺失的关联 (有人脸没有关联) 和一条多余的关联 (有关联没有人脸)"""
+        people = [Person.objects.create(name=n) for n in ['甲', '乙']]
+        for person in people:
+            face_photo, stale_photo = [
+                Photo.objects.create(file_path=f'/people/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex) for _ in range(2)
+            ]
+            Face.objects.create(photo=face_photo, person=person, bbox=[0, 0, 10, 10], prob=0.9)
+            Face.objects.create(photo=face_photo, person=person, bbox=[20, 20, 30, 30], prob=0.8)
+            person.photos.add(stale_photo)
+        return people
+
+    def assert_links_match_faces(self, person):
+        self.assertEqual(
+            set(person.photos.values_list('id', flat=True)), set(person.faces.values_list('photo_id', flat=True))
+        )
+
+    def test_check_and_sync_all_people(self):
+        first, second = self.make_drift()
+        self.assertEqual(PersonService.check_person_photos(), {'missing': 2, 'stale': 2, 'people': 2})
+        self.assertEqual(PersonService.sync_person_photos(), (2, 2))
+        self.assertEqual(PersonService.check_person_photos(), {'missing': 0, 'stale': 0, 'people': 0})
+        self.assert_links_match_faces(first)
+        self.assert_links_match_faces(second)
+
+    def test_check_and_sync_selected_people(self):
+        first, second = self.make_drift()
+        self.assertEqual(PersonService.check_person_photos([first.id]), {'missing': 1, 'stale': 1, 'people': 1})
+        # 只补齐不清理
+        self.assertEqual(PersonService.sync_person_photos([first.id], cleanup=False), (1, 0))
+        self.assertEqual(PersonService.check_person_photos([first.id]), {'missing': 0, 'stale': 1, 'people': 1})
+        self.assertEqual(PersonService.sync_person_photos([first.id]), (0, 1))
+        self.assert_links_match_faces(first)
+        # 其他人物不受影响
+        self.assertEqual(PersonService.check_person_photos([second.id]), {'missing': 1, 'stale': 1, 'people': 1})
+
+class MergePeopleTests(TestCase):
+    def add_photo(self):
+        return Photo.objects.create(file_path=f'/people/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex)
+
+    def test_merge_moves_faces_links_and_ignored_pairs(self):
+        target, a, b, other, stranger = [Person.objects.create(name=n) for n in ['目标', '甲', '乙', '丙', '丁']]
+        p1, p2, p3 = self.add_photo(), self.add_photo(), self.add_photo()
+        for person, photo in [(a, p1), (a, p2), (b, p2), (b, p3)]:
+            Face.objects.create(photo=photo, person=person, bbox=[0, 0, 10, 10], prob=0.9)
+        a.photos.add(p1, p2)
+        b.photos.add(p2, p3)
+        target.photos.add(p3)
+        a.ignored_merges.add(other, target, b)
+        b.ignored_merges.add(stranger)
+
+        self.assertEqual(PersonService.merge_people(target, [a.id, b.id, target.id]), 2)
+
+        self.assertFalse(Person.objects.filter(id__in=[a.id, b.id]).exists())
+        self.assertEqual(set(Face.objects.values_list('person_id', flat=True)), {target.id})
+        self.assertEqual(set(target.photos.values_list('id', flat=True)), {p1.id, p2.id, p3.id})
+        ignored = Person.ignored_merges.through.objects.values_list('from_person_id', 'to_person_id')
+        self.assertEqual(set(ignored), {
+            (target.id, other.id), (other.id, target.id), (target.id, stranger.id), (stranger.id, target.id),
+        })
+        target.refresh_from_db()
+        self.assertEqual(target.photo_count, 3)
+
+    def test_apply_merges_continues_after_a_failed_target(self):
+        people = {n: Person.objects.create(name=n) for n in ['甲', '乙', '丙', '丁']}
+        merge_people = PersonService.merge_people
+
+        def failing_merge(target, source_ids, invalidate_cache=True):
+            if target.name == '乙':
+                raise RuntimeError('boom')
+            return merge_people(target, source_ids, invalidate_cache)
+
+        messages = []
+        with mock.patch.object(PersonService, 'merge_people', side_effect=failing_merge):
+            merged = PersonService.apply_merges(
+                [(people['甲'].id, people['乙'].id), (people['丙'].id, people['丁'].id)],
+                log_func=lambda message, level: messages.append(level),
+            )
+        self.assertEqual(merged, 1)
+        self.assertEqual(messages, ['error'])
+        self.assertEqual(set(Person.objects.values_list('name', flat=True)), {'甲', '乙', '丁'})
+
+class PersonStatsTests(TestCase):
+    def add_photo(self):
+        return Photo.objects.create(file_path=f'/people/{uuid.uuid4()}.jpg', hash_md5=uuid.uuid4().hex)
+
+    def add_face(self, photo, person, prob):
+        return Face.objects.create(photo=photo, person=person, bbox=[0, 0, 10, 10], prob=prob)
+
+    def test_avatar_face_wins_and_unchanged_rows_are_skipped(self):
+        avatar_photo, other_photo = self.add_photo(), self.add_photo()
+        person = Person.objects.create(name='人物_1', avatar=avatar_photo)
+        avatar_face = self.add_face(avatar_photo, person, 0.80)
+        self.add_face(other_photo, person, 0.99)
+        self.add_face(other_photo, person, 0.95)
+        empty = Person.objects.create(name='人物_2')
+
+        # 没有人脸的人物统计本来就是 0 / 空，不会被写入
+        self.assertEqual(PersonService.refresh_person_stats(), 1)
+        person.refresh_from_db()
+        self.assertEqual(person.photo_count, 2)
+        self.assertEqual(person.representative_face_id, avatar_face.id)
+        self.assertEqual(PersonService.refresh_person_stats(), 0)
+        self.assertEqual(PersonService.refresh_person_stats(person_ids=[person.id, empty.id]), 0)
+
+        # 没有头像时取置信度最高的人脸
+        Person.objects.filter(id=person.id).update(avatar=None)
+        self.assertEqual(PersonService.refresh_person_stats(person_ids=[person.id]), 1)
+        person.refresh_from_db()
+        self.assertEqual(person.representative_face.prob, 0.99)
+
+    def test_hard_delete_refreshes_people_without_centroid(self):
+        kept, removed = self.add_photo(), self.add_photo()
+        person = Person.objects.create(name='人物_3')
+        self.add_face(kept, person, 0.7)
+        self.add_face(removed, person, 0.9)
+        PersonService.refresh_person_stats()
+        self.assertFalse(PersonCentroid.objects.filter(person=person).exists())
+
+        Photo.objects.filter(id=removed.id).update(deleted_at=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+        call_command('cleanup_trash', stdout=io.StringIO())
+        person.refresh_from_db()
+        self.assertEqual(person.photo_count, 1)
+        self.assertEqual(person.representative_face.photo_id, kept.id)
+
+    def test_default_name_column_follows_renames(self):
+        Person.objects.bulk_create([Person(name='人物_7'), Person(name='小明')])
+        self.assertEqual(
+            dict(Person.objects.values_list('name', 'is_default_name')), {'人物_7': True, '小明': False}
+        )
+        person = Person.objects.get(name='人物_7')
+        person.name = '小红'
+        person.save()
+        self.assertFalse(Person.objects.get(id=person.id).is_default_name)
+
+        Person.objects.filter(name='小明').update(photo_count=3)
+        Person.objects.create(name='人物_8', photo_count=50)
+        Person.objects.create(name='小刚', photo_count=1, is_starred=True)
+        response = self.client.get(reverse('person-list'))
+        results = response.json()
+        results = results.get('results', results) if isinstance(results, dict) else results
+        self.assertEqual([p['name'] for p in results], ['小刚', '小明', '小红', '人物_8'])
+
+class FaceClusteringTests(SimpleTestCase):
+    def make_blobs(self, people=20, faces_per_person=8):
+        rng = np.random.default_rng(3)
+        centers = rng.standard_normal((people, 512)).astype(np.float32)
+        embeddings = np.repeat(centers / np.linalg.norm(centers, axis=1, keepdims=True), faces_per_person, axis=0)
+        embeddings += rng.normal(0, 0.02, embeddings.shape).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # 再加一张与所有人都不相似的孤立人脸
+        outlier = rng.standard_normal((1, 512)).astype(np.float32)
+        embeddings = np.vstack([embeddings, outlier / np.linalg.norm(outlier)])
+        return embeddings, np.append(np.repeat(np.arange(people), faces_per_person), -1)
+
+    def assert_same_partition(self, labels, truth):
+        self.assertEqual(labels[-1], -1)
+        pairs = {(t, l) for t, l in zip(truth[:-1], labels[:-1])}
+        self.assertEqual(len(pairs), len(set(truth[:-1])))
+        self.assertEqual(len({l for _, l in pairs}), len(pairs))
+
+    def test_graph_methods_recover_people(self):
+        embeddings, truth = self.make_blobs()
+        for method in ['chinese_whispers', 'components']:
+            labels = cluster_embeddings(embeddings, threshold=0.3, min_samples=2, method=method, k=10)
+            self.assert_same_partition(labels, truth)
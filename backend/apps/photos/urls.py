@@ -2,8 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     PhotoViewSet, AlbumViewSet, PersonViewSet, LibraryViewSet, 
-    SystemViewSet, MemoryViewSet, MaintenanceTaskViewSet, ScheduledTaskViewSet,
-    places_list, photo_serve, photo_video_serve, face_crop_serve, map_markers
+    SystemViewSet, MemoryViewSet, MaintenanceTaskViewSet, ScheduledTaskViewSet, DuplicateGroupViewSet,
+    places_list, photo_serve, photo_video_serve, face_crop_serve, map_markers, map_tile
 )
 
 router = DefaultRouter()
@@ -14,6 +14,7 @@ router.register(r'people', PersonViewSet)
 router.register(r'libraries', LibraryViewSet)
 router.register(r'maintenance', MaintenanceTaskViewSet)
 router.register(r'schedules', ScheduledTaskViewSet)
+router.register(r'duplicates', DuplicateGroupViewSet)
 router.register(r'system', SystemViewSet, basename='system')
 
 urlpatterns = [
@@ -25,4 +26,5 @@ urlpatterns = [
     path('photo/<uuid:pk>/video/', photo_video_serve, name='photo_video_serve'),
     path('face/<uuid:pk>/crop/', face_crop_serve, name='face_crop_serve'),
     path('map/markers/', map_markers, name='map_markers'),
+    path('map/tiles/<int:z>/<int:x>/<int:y>/', map_tile, name='map_tile'),
 ]
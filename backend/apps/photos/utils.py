@@ -1,4 +1,10 @@
 import os
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+
+EMBEDDING_STORAGE_MODES = ['vector', 'dual', 'halfvec']
 
 def resolve_docker_path(path):
     """
@@ -37,3 +43,55 @@ def resolve_docker_path(path):
             return new_path
 
     return path
+
+@contextmanager
+def hnsw_search_session(ef_search=None):
+    """
+    在事务内调整 HNSW 索引扫描参数 (SET LOCAL，事务结束自动恢复)
+    - hnsw.iterative_scan: pgvector >= 0.8 支持迭代扫描，WHERE 过滤在索引扫描过程中完成，
+      过滤掉的候选会继续从索引中补齐，不会出现"过滤后结果不足"的问题
+    - hnsw.ef_search: 候选队列长度，深翻页时需要不小于 offset + limit
+    旧版本 pgvector 不支持的参数会被忽略
+    """
+    with transaction.atomic():
+        settings_sql = [("SET LOCAL hnsw.iterative_scan = strict_order", None)]
+        if ef_search:
+            settings_sql.append(("SET LOCAL hnsw.ef_search = %s", [int(min(max(ef_search, 40), 1000))]))
+        for sql, params in settings_sql:
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, params)
+            except DatabaseError:
+                pass
+        yield
+
+def get_embedding_storage():
+    """向量存储模式：vector / dual / halfvec (见 settings.EMBEDDING_STORAGE)"""
+    mode = getattr(settings, 'EMBEDDING_STORAGE', 'vector')
+    return mode if mode in EMBEDDING_STORAGE_MODES else 'vector'
+
+def photo_vector_field():
+    """读取照片语义向量使用的列：halfvec 模式读 float16 列，其余模式读 float32 列"""
+    return 'embedding_data_half' if get_embedding_storage() == 'halfvec' else 'embedding_data'
+
+def face_vector_field():
+    """读取人脸特征向量使用的列"""
+    return 'embedding_half' if get_embedding_storage() == 'halfvec' else 'embedding'
+
+def embedding_write_fields(full_field, half_field):
+    """当前模式下写入向量时需要保存的列"""
+    mode = get_embedding_storage()
+    if mode == 'halfvec':
+        return [half_field]
+    if mode == 'dual':
+        return [full_field, half_field]
+    return [full_field]
+
+def vector_to_numpy(value):
+    """数据库读出的向量转 float32 数组 (vector 列读出为 ndarray，halfvec 列读出为 HalfVector)"""
+    if value is None:
+        return None
+    if hasattr(value, 'to_numpy'):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
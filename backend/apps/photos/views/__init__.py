@@ -5,8 +5,9 @@ from .memories import MemoryViewSet
 from .albums import AlbumViewSet
 from .people import PersonViewSet
 from .libraries import LibraryViewSet
+from .duplicates import DuplicateGroupViewSet
 from .serving import face_crop_serve, photo_serve, photo_video_serve
-from .geo import places_list, map_markers
+from .geo import places_list, map_markers, map_tile
 
 __all__ = [
     'ScheduledTaskViewSet',
@@ -17,9 +18,11 @@ __all__ = [
     'AlbumViewSet',
     'PersonViewSet',
     'LibraryViewSet',
+    'DuplicateGroupViewSet',
     'face_crop_serve',
     'photo_serve',
     'photo_video_serve',
     'places_list',
     'map_markers',
+    'map_tile',
 ]
@@ -0,0 +1,57 @@
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from ..models import DuplicateGroup, Photo
+from ..serializers import DuplicateGroupSerializer
+from ..services.geo import mark_photo_tiles_stale, refresh_stale_tiles
+
+class DuplicateGroupViewSet(viewsets.ReadOnlyModelViewSet):
+    """近似重复照片审核：列出分组，选择保留的照片后将其余照片移入回收站，或忽略整组"""
+    queryset = DuplicateGroup.objects.all()
+    serializer_class = DuplicateGroupSerializer
+
+    def get_queryset(self):
+        qs = DuplicateGroup.objects.prefetch_related(
+            Prefetch(
+                'photos',
+                queryset=Photo.objects.filter(deleted_at__isnull=True).order_by('-width', '-size')
+            )
+        )
+        if self.action == 'list':
+            group_status = self.request.query_params.get('status', DuplicateGroup.Status.PENDING)
+            qs = qs.filter(status=group_status)
+        return qs
+
+    @action(detail=True, methods=['post'])
+    def resolve(self, request, pk=None):
+        """保留 keep_ids 中的照片，组内其余照片软删除 (可在回收站恢复)"""
+        group = self.get_object()
+        keep_ids = {str(pid) for pid in request.data.get('keep_ids', [])}
+        member_ids = {str(pid) for pid in group.photos.values_list('id', flat=True)}
+
+        if not keep_ids:
+            return Response({'error': 'No keep_ids provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not keep_ids <= member_ids:
+            return Response({'error': 'keep_ids must belong to the group'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            to_trash = Photo.objects.filter(id__in=member_ids - keep_ids, deleted_at__isnull=True)
+            mark_photo_tiles_stale(to_trash)
+            trashed = to_trash.update(deleted_at=timezone.now())
+            group.status = DuplicateGroup.Status.RESOLVED
+            group.save(update_fields=['status', 'updated_at'])
+        refresh_stale_tiles()
+
+        return Response({'status': 'resolved', 'trashed': trashed})
+
+    @action(detail=True, methods=['post'])
+    def ignore(self, request, pk=None):
+        """标记为非重复，之后重新查找时不再提示"""
+        group = self.get_object()
+        group.status = DuplicateGroup.Status.IGNORED
+        group.save(update_fields=['status', 'updated_at'])
+        return Response({'status': 'ignored'})
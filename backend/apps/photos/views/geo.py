@@ -1,8 +1,13 @@
-from django.http import JsonResponse
+import hashlib
+import json
+from datetime import datetime, timezone
+from django.http import HttpResponseNotModified, JsonResponse
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.db.models import Count, Avg, Subquery, OuterRef
 
 from ..models import Photo
+from ..services.geo import get_tile, get_tile_max_age, get_tile_max_zoom, grid_clusters, grid_size_for_zoom
 
 def places_list(request):
     """
@@ -39,7 +44,7 @@ def places_list(request):
 def map_markers(request):
     """
     获取地图标记点
-    支持网格聚合: 根据 zoom 级别将相近的点合并
+    支持网格聚合: 根据 zoom 级别将相近的点合并，聚合在数据库中完成 (见 services/geo)，范围内的照片全部参与
     """
     try:
         min_lat = float(request.GET.get('min_lat'))
@@ -47,67 +52,59 @@ def map_markers(request):
         min_lng = float(request.GET.get('min_lng'))
         max_lng = float(request.GET.get('max_lng'))
         zoom = float(request.GET.get('zoom', 10))
-        
-        # 1. 基础查询
-        photos = Photo.objects.filter(
-            latitude__range=(min_lat, max_lat),
-            longitude__range=(min_lng, max_lng)
-        ).only('id', 'latitude', 'longitude', 'captured_at').order_by('-captured_at')
-        
-        # 限制最大数量以防止 Python 处理过慢 (例如最多取前 3000 张进行聚合)
-        # 如果需要显示所有，可以考虑在数据库层做聚合 (需要 PostGIS) 或优化算法
-        photos = photos[:3000]
-        
-        # 2. 网格聚合逻辑
-        # 计算网格大小: zoom 越大，网格越小
-        # 粗略估算: 360 度 / 2^zoom
-        # 系数可调，决定聚合的松紧程度
-        grid_size = 100.0 / (2 ** zoom) 
-        
-        clusters = {}
-        
-        for p in photos:
-            # 计算网格坐标
-            grid_x = int(p.latitude / grid_size)
-            grid_y = int(p.longitude / grid_size)
-            key = (grid_x, grid_y)
-            
-            if key not in clusters:
-                clusters[key] = {
-                    'count': 0,
-                    'lat_sum': 0,
-                    'lng_sum': 0,
-                    'cover_photo': p, # 默认取第一张（也就是最新的，因为按时间倒序）
-                    'ids': []
-                }
-            
-            c = clusters[key]
-            c['count'] += 1
-            c['lat_sum'] += p.latitude
-            c['lng_sum'] += p.longitude
-            # c['ids'].append(str(p.id)) # 暂时不需要返回所有 ID
-            
-        # 3. 生成结果
-        data = []
-        for c in clusters.values():
-            # 计算中心点 (可以是网格中心，也可以是所有点的平均中心)
-            # 这里使用平均中心，显示更准确
-            avg_lat = c['lat_sum'] / c['count']
-            avg_lng = c['lng_sum'] / c['count']
-            
-            p = c['cover_photo']
-            data.append({
-                'id': str(p.id), # 代表照片 ID
-                'lat': avg_lat,
-                'lng': avg_lng,
-                'count': c['count'],
-                'thumb': reverse('photo_serve', args=[p.id]) + '?size=100&crop=1',
-                'preview': reverse('photo_serve', args=[p.id]) + '?size=400',
-                'date': p.captured_at.strftime('%Y年%m月%d日') if p.captured_at else ''
-            })
-            
-        return JsonResponse(data, safe=False)
-
     except (TypeError, ValueError):
         # 如果没有传边界，返回空的
         return JsonResponse([], safe=False)
+
+    clusters = grid_clusters(min_lat, max_lat, min_lng, max_lng, grid_size_for_zoom(zoom))
+
+    data = []
+    for photo_id, captured_at, count, lat, lng in clusters:
+        # 中心点使用网格内所有点的平均坐标，封面为网格内最新的一张
+        data.append({
+            'id': str(photo_id), # 代表照片 ID
+            'lat': lat,
+            'lng': lng,
+            'count': count,
+            'thumb': reverse('photo_serve', args=[photo_id]) + '?size=100&crop=1',
+            'preview': reverse('photo_serve', args=[photo_id]) + '?size=400',
+            'date': captured_at.strftime('%Y年%m月%d日') if captured_at else ''
+        })
+
+    return JsonResponse(data, safe=False)
+
+def map_tile(request, z, x, y):
+    """
+    获取地图瓦片 (z/x/y，Web 墨卡托编号) 内的聚合点
+    瓦片由 build_geo_tiles 预先生成，照片变化后随即重算；响应带 ETag 与 Cache-Control，浏览器在有效期内直接使用缓存
+    超过最大缩放级别时返回 404 与 max_zoom，前端改用该级别的瓦片
+    """
+    max_zoom = get_tile_max_zoom()
+    if z > max_zoom or x >= 2 ** z or y >= 2 ** z:
+        return JsonResponse({'error': 'Tile out of range', 'max_zoom': max_zoom}, status=404)
+
+    tile = get_tile(z, x, y)
+    packed = tile.cells if tile is not None else []
+    etag = '"%s"' % hashlib.md5(json.dumps(packed).encode()).hexdigest()
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        cells = []
+        for _, _, photo_id, lat, lng, count, ts in packed:
+            captured_at = datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None
+            cells.append({
+                'id': photo_id,
+                'lat': lat,
+                'lng': lng,
+                'count': count,
+                'thumb': reverse('photo_serve', args=[photo_id]) + '?size=100&crop=1',
+                'preview': reverse('photo_serve', args=[photo_id]) + '?size=400',
+                'date': captured_at.strftime('%Y年%m月%d日') if captured_at else ''
+            })
+        response = JsonResponse({
+            'z': z, 'x': x, 'y': y, 'max_zoom': max_zoom,
+            'count': sum(cell['count'] for cell in cells), 'cells': cells,
+        })
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=get_tile_max_age())
+    return response
@@ -1,14 +1,15 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Prefetch, Count, Case, When, Value, IntegerField
-from pgvector.django import CosineDistance
+import numpy as np
 from django.core.management import call_command
 import threading
 
 from ..models import Person, Face, Photo
 from ..serializers import PersonSerializer
-from ..services import scan_all_faces, generate_photo_embedding
+from ..services import scan_all_faces, generate_photo_embedding, tag_photos, PersonService
+from ..services.centroids import remove_faces_from_centroid
+from ..utils import face_vector_field, photo_vector_field, vector_to_numpy
 
 class PersonViewSet(viewsets.ModelViewSet):
     queryset = Person.objects.all() # Satisfy DRF router introspection
@@ -27,26 +28,11 @@ class PersonViewSet(viewsets.ModelViewSet):
         else:
             queryset = Person.objects.filter(is_hidden=False)
         
-        # 预加载人脸以优化 representative_face 获取
-        queryset = queryset.prefetch_related(
-            Prefetch('faces', queryset=Face.objects.order_by('-prob'), to_attr='prefetched_faces')
-        )
+        # 照片数与代表人脸为冗余字段 (与详情页一致，按人脸所在照片计数)，无需再预加载人脸
+        queryset = queryset.select_related('avatar')
         
-        # 1. 注解照片数量
-        # 使用 faces__photo 进行计数，确保与详情页查询逻辑一致（不依赖 ManyToMany 同步）
-        queryset = queryset.annotate(photo_count=Count('faces__photo', distinct=True))
-        
-        # 2. 区分已命名和默认命名 (默认命名格式: 人物_数字)
-        # is_default_name: 1 (是默认), 0 (是已命名)
-        queryset = queryset.annotate(
-            is_default_name=Case(
-                When(name__regex=r'^人物_\d+$', then=Value(1)),
-                default=Value(0),
-                output_field=IntegerField(),
-            )
-        )
-        
-        # 3. 排序: 标星优先(True > False), 已命名优先(0 < 1), 然后按照片数量降序, 最后按创建时间
+        # 排序: 标星优先(True > False), 已命名优先(is_default_name 为生成列), 然后按照片数量降序, 最后按创建时间，
+        # 与 person_list_idx 的列顺序一致
         return queryset.order_by('-is_starred', 'is_default_name', '-photo_count', '-created_at')
 
     @action(detail=True, methods=['post'])
@@ -54,7 +40,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         """标星人物"""
         person = self.get_object()
         person.is_starred = True
-        person.save()
+        person.save(update_fields=['is_starred'])
         return Response({'status': 'starred'})
 
     @action(detail=True, methods=['post'])
@@ -62,7 +48,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         """取消标星"""
         person = self.get_object()
         person.is_starred = False
-        person.save()
+        person.save(update_fields=['is_starred'])
         return Response({'status': 'unstarred'})
 
     @action(detail=True, methods=['post'])
@@ -79,10 +65,14 @@ class PersonViewSet(viewsets.ModelViewSet):
         except Photo.DoesNotExist:
             return Response({'error': 'Photo not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # 1. 解除 Face 关联
+        # 1. 解除 Face 关联，并从人物特征中心中减去这些人脸
         faces = Face.objects.filter(photo=photo, person=person)
         if faces.exists():
+            field = face_vector_field()
+            removed = [vector_to_numpy(v) for v in faces.exclude(**{f'{field}__isnull': True}).values_list(field, flat=True)]
             faces.update(person=None)
+            if removed:
+                remove_faces_from_centroid(person.id, np.stack(removed))
             
         # 2. 解除 ManyToMany 关联
         person.photos.remove(photo)
@@ -92,6 +82,9 @@ class PersonViewSet(viewsets.ModelViewSet):
             person.avatar = None
             person.ensure_avatar() # 尝试找一个新的头像
             person.save()
+
+        # 4. 重算照片数与代表人脸
+        PersonService.refresh_person_stats([person.id])
             
         return Response({'status': 'removed'})
 
@@ -99,7 +92,7 @@ class PersonViewSet(viewsets.ModelViewSet):
     def hide(self, request, pk=None):
         person = self.get_object()
         person.is_hidden = True
-        person.save()
+        person.save(update_fields=['is_hidden'])
         return Response({'status': 'hidden'})
 
     @action(detail=True, methods=['post'])
@@ -107,7 +100,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         """取消隐藏人物"""
         person = self.get_object()
         person.is_hidden = False
-        person.save()
+        person.save(update_fields=['is_hidden'])
         return Response({'status': 'unhidden'})
 
     @action(detail=True, methods=['post'])
@@ -119,13 +112,8 @@ class PersonViewSet(viewsets.ModelViewSet):
         if not source_ids:
             return Response({'error': 'No source ids provided'}, status=status.HTTP_400_BAD_REQUEST)
             
-        source_people = Person.objects.filter(id__in=source_ids)
-        merged_count = 0
-        
-        for source_person in source_people:
-            if source_person.id != target_person.id:
-                source_person.merge_with(target_person)
-                merged_count += 1
+        # 所有源人物在一个事务中合并
+        merged_count = PersonService.merge_people(target_person, source_ids)
                 
         return Response({'status': 'merged', 'count': merged_count})
 
@@ -147,6 +135,9 @@ class PersonViewSet(viewsets.ModelViewSet):
             
             person.avatar = photo
             person.save()
+            # 代表人脸改为新头像照片中的人脸
+            PersonService.refresh_person_stats([person.id])
+            person.refresh_from_db(fields=['representative_face'])
             return Response({'status': 'updated', 'face_url': PersonSerializer(person).data['face_url']})
         except Photo.DoesNotExist:
             return Response({'error': 'Photo not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -190,49 +181,24 @@ class PersonViewSet(viewsets.ModelViewSet):
     def similar(self, request, pk=None):
         """查找相似人物"""
         person = self.get_object()
-        face = person.representative_face
-        if not face or face.embedding is None:
-            return Response([])
 
         try:
             threshold = float(request.query_params.get('threshold', 0.5))
         except ValueError:
             threshold = 0.5
         
-        # Find similar faces belonging to OTHER people
-        similar_faces = Face.objects.filter(
-            person__isnull=False,
-            embedding__isnull=False
-        ).exclude(
-            person=person
-        ).annotate(
-            distance=CosineDistance('embedding', face.embedding)
-        ).filter(
-            distance__lt=threshold
-        ).order_by('distance')[:200] # 限制数量以防过大
-
-        # Group by person, keeping the best match per person
-        similar_people_map = {}
-        for f in similar_faces:
-            if f.person_id not in similar_people_map:
-                similar_people_map[f.person_id] = {
-                    'person': f.person,
-                    'distance': f.distance,
-                }
-        
-        # Convert to list and sort
+        # 比较预先维护的人物特征中心 (走 HNSW 索引)，不再扫描整张人脸表
         results = []
-        for item in similar_people_map.values():
+        for item in PersonService.get_similar_to_person(person, threshold=threshold):
             p = item['person']
             results.append({
                 'id': p.id,
                 'name': p.name,
-                'face_url': f"/face/{p.representative_face.id}/crop/" if p.representative_face else None,
+                'face_url': f"/face/{p.representative_face_id}/crop/" if p.representative_face_id else None,
                 'distance': item['distance'],
-                'photo_count': p.photos.count()
+                'photo_count': p.photo_count
             })
         
-        results.sort(key=lambda x: x['distance'])
         return Response(results)
 
     @action(detail=False, methods=['post'])
@@ -253,12 +219,17 @@ class PersonViewSet(viewsets.ModelViewSet):
         """生成语义搜索索引"""
         
         def run_task():
-            photos = Photo.objects.filter(embedding_data__isnull=True)
+            photos = Photo.objects.filter(**{f'{photo_vector_field()}__isnull': True})
             for photo in photos:
                 try:
                     generate_photo_embedding(photo.id)
                 except Exception as e:
                     print(f"Error processing embedding for {photo.id}: {e}")
+            # 新向量生成后增量打标签
+            try:
+                tag_photos()
+            except Exception as e:
+                print(f"Error tagging photos: {e}")
                     
         thread = threading.Thread(target=run_task)
         thread.daemon = True
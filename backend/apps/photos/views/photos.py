@@ -2,13 +2,17 @@ from rest_framework import viewsets, filters, status, parsers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 import os
 
 from ..models import Photo, Library
-from ..serializers import PhotoSerializer
-from ..services import process_single_file, search_photos_by_text
+from ..serializers import PhotoSerializer, PhotoSearchResultSerializer
+from ..services import process_single_file, search_photos_by_text, keyword_search_photos, get_hybrid_ranking, similar_photo_queryset, tag_summary, PersonService
+from ..utils import hnsw_search_session
+from ..pagination import RankedCursorPagination
+from ..services.centroids import affected_person_ids, mark_centroids_stale
+from ..services.geo import refresh_stale_tiles, refresh_tiles_for_points
 
 class PhotoViewSet(viewsets.ModelViewSet):
     queryset = Photo.objects.all().order_by('-captured_at')
@@ -58,6 +62,7 @@ class PhotoViewSet(viewsets.ModelViewSet):
             # 注意：这可能会阻塞请求，对于大文件或大量文件建议使用 Celery 异步任务
             # 但作为 MVP，同步处理是可以接受的
             process_single_file(save_path)
+            refresh_stale_tiles()
             
             # 查找刚创建的对象
             photo = Photo.objects.filter(file_path=save_path).first()
@@ -80,6 +85,11 @@ class PhotoViewSet(viewsets.ModelViewSet):
         if person_id:
             qs = qs.filter(faces__person_id=person_id).distinct()
 
+        # 零样本标签过滤 (如 ?tag=food)：(tag, score) 索引上的 B-tree 查找
+        tag = self.request.query_params.get('tag')
+        if tag:
+            qs = qs.filter(tags__tag=tag.strip().lower())
+
         # 如果是 trash action，则显示已删除的
         if self.action == 'trash':
             return Photo.objects.filter(deleted_at__isnull=False).order_by('-deleted_at')
@@ -90,6 +100,12 @@ class PhotoViewSet(viewsets.ModelViewSet):
         """软删除：设置 deleted_at 而不是真正删除"""
         instance.deleted_at = timezone.now()
         instance.save()
+        refresh_tiles_for_points([(instance.latitude, instance.longitude)])
+
+    @action(detail=False, methods=['get'])
+    def tags(self, request):
+        """获取所有标签及其照片数量"""
+        return Response(tag_summary())
 
     @action(detail=False, methods=['get'])
     def trash(self, request):
@@ -110,6 +126,7 @@ class PhotoViewSet(viewsets.ModelViewSet):
             photo = Photo.objects.get(pk=pk, deleted_at__isnull=False)
             photo.deleted_at = None
             photo.save()
+            refresh_tiles_for_points([(photo.latitude, photo.longitude)])
             return Response({'status': 'restored'})
         except Photo.DoesNotExist:
             return Response({'error': 'Photo not found in trash'}, status=status.HTTP_404_NOT_FOUND)
@@ -121,7 +138,10 @@ class PhotoViewSet(viewsets.ModelViewSet):
             photo = Photo.objects.get(pk=pk, deleted_at__isnull=False)
             # 同时删除物理文件 (可选，根据需求)
             # 这里先只删除数据库记录
-            photo.delete() 
+            person_ids = affected_person_ids(Photo.objects.filter(pk=photo.pk))
+            mark_centroids_stale(Photo.objects.filter(pk=photo.pk))
+            photo.delete()
+            PersonService.refresh_person_stats(person_ids)
             return Response({'status': 'permanently_deleted'})
         except Photo.DoesNotExist:
             return Response({'error': 'Photo not found in trash'}, status=status.HTTP_404_NOT_FOUND)
@@ -129,7 +149,11 @@ class PhotoViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['delete'])
     def empty_trash(self, request):
         """清空回收站"""
-        count, _ = Photo.objects.filter(deleted_at__isnull=False).delete()
+        trashed = Photo.objects.filter(deleted_at__isnull=False)
+        person_ids = affected_person_ids(trashed)
+        mark_centroids_stale(trashed)
+        count, _ = trashed.delete()
+        PersonService.refresh_person_stats(person_ids)
         return Response({'status': 'trash_emptied', 'count': count})
 
     @action(detail=False, methods=['get'])
@@ -140,11 +164,8 @@ class PhotoViewSet(viewsets.ModelViewSet):
             return Response([])
             
         try:
-            # 1. 关键词匹配 (Location, FilePath)
-            keyword_results = Photo.objects.filter(
-                Q(location_name__icontains=query) | 
-                Q(file_path__icontains=query)
-            ).order_by('-captured_at')[:100]
+            # 1. 关键词匹配 (Location, FilePath，走 pg_trgm 三元组索引)
+            keyword_results = keyword_search_photos(query, limit=100)
             
             # 2. 语义搜索 (尝试执行，如果失败则降级)
             semantic_results = []
@@ -167,3 +188,74 @@ class PhotoViewSet(viewsets.ModelViewSet):
         except Exception as e:
             # 如果完全失败 (如数据库连接断开)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'])
+    def hybrid_search(self, request):
+        """
+        混合搜索接口：关键词与语义两路并发召回，按 RRF 融合排序
+        使用游标分页，只返回轻量结果 (id, 缩略图, 得分)；
+        融合后的排序会短暂缓存，翻页时不会重新计算
+        """
+        query = request.query_params.get('q', '').strip()
+        paginator = RankedCursorPagination(request)
+        if not query:
+            return Response(paginator.get_response_data([], False))
+
+        try:
+            ranking = get_hybrid_ranking(query)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        page, has_next = paginator.paginate_list(ranking)
+        serializer = PhotoSearchResultSerializer(
+            [{'id': photo_id, 'score': score} for photo_id, score in page], many=True
+        )
+        return Response(paginator.get_response_data(serializer.data, has_next))
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        更多类似照片：以当前照片的语义向量在 HNSW 索引中查找相似照片
+        过滤条件 (日期范围 / 排除同一天 / 排除回收站) 在索引扫描内完成
+        """
+        photo = self.get_object()
+        paginator = RankedCursorPagination(request)
+        if photo.get_embedding() is None:
+            return Response(paginator.get_response_data([], False))
+
+        params = request.query_params
+        date_from = date_to = None
+        try:
+            if params.get('date_from'):
+                date_from = parse_date(params['date_from'])
+            if params.get('date_to'):
+                date_to = parse_date(params['date_to'])
+        except ValueError:
+            date_from = date_to = None
+        if (params.get('date_from') and not date_from) or (params.get('date_to') and not date_to):
+            return Response({'error': '日期格式应为 YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def flag(name, default):
+            value = params.get(name)
+            if value is None:
+                return default
+            return value.lower() in ('1', 'true', 'yes')
+
+        queryset = similar_photo_queryset(
+            photo,
+            date_from=date_from,
+            date_to=date_to,
+            exclude_same_day=flag('exclude_same_day', False),
+            exclude_trashed=flag('exclude_trashed', True),
+        )
+
+        start, end = paginator.slice_bounds()
+        with hnsw_search_session(ef_search=end):
+            rows = list(queryset.values_list('id', 'distance')[start:end])
+
+        has_next = len(rows) > paginator.limit
+        serializer = PhotoSearchResultSerializer(
+            [{'id': photo_id, 'score': round(1 - distance, 6)} for photo_id, distance in rows[:paginator.limit]],
+            many=True
+        )
+        return Response(paginator.get_response_data(serializer.data, has_next))
@@ -7,6 +7,7 @@ import shutil
 import os
 import threading
 from ..models import Photo, Library
+from ..services import get_text_embedding_cache
 
 class SystemViewSet(viewsets.ViewSet):
     """
@@ -34,6 +35,11 @@ class SystemViewSet(viewsets.ViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def text_cache(self, request):
+        """CLIP 文本向量缓存命中统计 (监控用)"""
+        return Response(get_text_embedding_cache().stats())
+
     @action(detail=False, methods=['post'])
     def run_clustering(self, request):
         """手动触发人脸聚类"""
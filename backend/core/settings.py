@@ -59,6 +59,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party
     'rest_framework',
@@ -165,3 +166,43 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# AI / 搜索相关配置
+
+# CLIP 文本向量 LRU 缓存容量 (条)，设为 0 关闭进程内缓存
+CLIP_TEXT_CACHE_SIZE = int(os.getenv('CLIP_TEXT_CACHE_SIZE', '2048'))
+# 是否将文本向量持久化到数据库 (进程重启/多进程间共享)
+CLIP_TEXT_CACHE_PERSIST = os.getenv('CLIP_TEXT_CACHE_PERSIST', 'True').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+# 零样本标签词表 (JSON 文件，格式: [{"tag": "food", "label": "美食", "prompt": "a photo of food"}, ...])
+# 不设置时使用内置词表
+PHOTO_TAG_VOCABULARY_FILE = os.getenv('PHOTO_TAG_VOCABULARY_FILE', '')
+# 每张照片最多保存的标签数量及最低置信度
+PHOTO_TAG_TOP_K = int(os.getenv('PHOTO_TAG_TOP_K', '5'))
+PHOTO_TAG_MIN_SCORE = float(os.getenv('PHOTO_TAG_MIN_SCORE', '0.05'))
+
+# 语义搜索后端: pgvector (默认，数据库 HNSW 索引) / mmap (进程内内存映射 float16 向量快照，适合中小型图库)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'pgvector')
+# 向量快照目录 (需先运行 build_search_index 建立全量快照)
+EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', str(BASE_DIR / 'data' / 'vector_index'))
+
+# 人脸与照片向量的存储精度: vector (默认，float32) / dual (双写 float32 与 halfvec，读取 float32，用于回填与回滚)
+# / halfvec (只写入并读取 float16 的 halfvec 列)。切换步骤见 migrate_embedding_storage
+EMBEDDING_STORAGE = os.getenv('EMBEDDING_STORAGE', 'vector')
+
+# 人脸检测输入图像的最长边 (像素)：照片以降低的分辨率解码 (JPEG draft / HEIF 缩略图) 后再检测，
+# 检测框映射回原图坐标。0 表示使用原图。可用 benchmark_face_detection 评估速度与召回率
+FACE_DETECT_MAX_EDGE = int(os.getenv('FACE_DETECT_MAX_EDGE', '1920'))
+# 人脸检测预筛阈值 (process_faces --gate)：CLIP 判定 "有人" 的概率低于该值的照片跳过检测
+FACE_GATE_THRESHOLD = float(os.getenv('FACE_GATE_THRESHOLD', '0.1'))
+# 人脸质量分阈值 (0~1，见 face_quality_report)：低于丢弃阈值的人脸不提取特征也不入库，
+# 低于聚类阈值的人脸入库但不参与人物匹配与聚类。默认 0 表示不过滤
+FACE_QUALITY_DROP_THRESHOLD = float(os.getenv('FACE_QUALITY_DROP_THRESHOLD', '0'))
+FACE_QUALITY_CLUSTER_THRESHOLD = float(os.getenv('FACE_QUALITY_CLUSTER_THRESHOLD', '0'))
+# 地图瓦片金字塔 (build_geo_tiles)：最大缩放级别、每个瓦片每边的网格数，以及瓦片接口的浏览器缓存时间 (秒)
+GEO_TILE_MAX_ZOOM = int(os.getenv('GEO_TILE_MAX_ZOOM', '16'))
+GEO_TILE_CELLS = int(os.getenv('GEO_TILE_CELLS', '4'))
+GEO_TILE_MAX_AGE = int(os.getenv('GEO_TILE_MAX_AGE', '300'))
+# 新人物发现的聚类方法：chinese_whispers (默认) / components / dbscan (旧实现，只适合小图库)
+FACE_CLUSTER_METHOD = os.getenv('FACE_CLUSTER_METHOD', 'chinese_whispers')